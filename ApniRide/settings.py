@@ -128,6 +128,18 @@ ASGI_APPLICATION = "ApniRide.asgi.application"
 
 REDIS_HOST = os.getenv('REDIS_HOST')
 REDIS_PORT = os.getenv('REDIS_PORT')
+# Separate logical DB for application data (live driver locations etc.)
+REDIS_STORE_DB = int(os.getenv('REDIS_STORE_DB', 1))
+# Separate logical DB for the Django cache (fare quotes, dashboard snapshots)
+REDIS_CACHE_DB = int(os.getenv('REDIS_CACHE_DB', 2))
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": f"redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_CACHE_DB}",
+    } if REDIS_HOST else {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+}
 CHANNEL_LAYERS = {
     "default": {
         "BACKEND": "channels_redis.core.RedisChannelLayer",
@@ -241,11 +253,18 @@ from celery.schedules import crontab
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
 from celery.schedules import crontab
 
+# Location writes to MySQL are coalesced per driver and applied as one bulk UPDATE per
+# window: flush-driver-locations runs once a window, and the in-process fallback buffer
+# (used while Redis is down) flushes on the same window
+LOCATION_WRITE_WINDOW_SECONDS = 2
+LOCATION_WRITE_MAX_BATCH = 500
+
+
 CELERY_BEAT_SCHEDULE = {
-    # Midnight reset
-    'reset-earned-every-day-midnight': {
-        'task': 'api.tasks.reset_earned_field',
-        'schedule': crontab(hour=0, minute=0),  # 12:00 AM daily
+    # Incentive progress is windowed per DriverIncentive.period; drop old windows nightly
+    'prune-incentive-windows-daily': {
+        'task': 'api.tasks.prune_incentive_windows',
+        'schedule': crontab(hour=0, minute=30),
     },
 
     # Auto-cancel pending rides
@@ -254,6 +273,24 @@ CELERY_BEAT_SCHEDULE = {
         'schedule': crontab(minute='*/5'),  # every 5 minutes
     },
 
+    # Global assignment of pending rides to idle drivers (no-op unless BATCH_DISPATCH_ENABLED)
+    'batch-dispatch-pending-rides': {
+        'task': 'api.tasks.batch_dispatch_rides',
+        'schedule': timedelta(seconds=10),
+    },
+
+    # Write live driver locations back to MySQL, mark stale drivers offline
+    'flush-driver-locations': {
+        'task': 'api.tasks.flush_driver_locations',
+        'schedule': timedelta(seconds=LOCATION_WRITE_WINDOW_SECONDS),
+    },
+
+    # Fold AdminWallet shard totals back into the wallet rows
+    'compact-admin-wallet-shards': {
+        'task': 'api.tasks.compact_admin_wallet_shards',
+        'schedule': crontab(minute='*/5'),
+    },
+
     # 'auto-reactivate-suspended-users-every-10-minutes': {
     #     'task': 'api.tasks.auto_reactivate_users',
     #     'schedule': crontab(minute='*/1'),
@@ -266,6 +303,72 @@ CELERY_BEAT_SCHEDULE = {
 
 STATIC_URL = 'static/'
 
+# Driver matching: in-memory grid index of online drivers.
+# With DRIVER_INDEX_ENABLED = False candidates come from a bounding-box query instead.
+DRIVER_INDEX_ENABLED = True
+DRIVER_INDEX_CELL_KM = 1.0
+DRIVER_INDEX_REFRESH_SECONDS = 5
+
+# Live driver locations in Redis; a driver with no ping for this long is marked offline
+LIVE_LOCATION_TTL_SECONDS = 60
+
+# Points RideLocationConsumer buffers per ride before saving them as a segment
+TRAJECTORY_MAX_POINTS = 4096
+
+# Server-side trip distance: GPS jitter below MIN_STEP_M is ignored, points implying more
+# than MAX_SPEED_KMPH are dropped; RESEED_AFTER drops in a row restart the meter at the new
+# point. Fewer than MIN_POINTS, or more than MAX_REJECTED_SHARE of points dropped, falls
+# back to the client distance.
+TRIP_METER_MIN_STEP_M = 10
+TRIP_METER_MAX_SPEED_KMPH = 150
+TRIP_METER_SMOOTHING = 0.5
+TRIP_METER_MIN_POINTS = 10
+TRIP_METER_RESEED_AFTER = 5
+TRIP_METER_MAX_REJECTED_SHARE = 0.3
+TRIP_METER_DRIFT_WARN = 0.2
+
+# Ride dispatch: notify the DISPATCH_K best drivers, searching these radii in order.
+# Weights are the km of pickup distance a perfect score on each scorer is worth.
+DISPATCH_K = 10
+DISPATCH_RINGS_KM = (1, 2, 5, 10)
+DISPATCH_SCORE_WEIGHTS = {
+    "rating": 1.0,
+    "idle": 0.5,
+}
+DISPATCH_IDLE_CAP_MINUTES = 60
+
+# Rides are offered in waves of DISPATCH_WAVE_SIZE drivers every DISPATCH_WAVE_INTERVAL_SECONDS
+# until accepted or auto-cancelled
+DISPATCH_WAVE_SIZE = 3
+DISPATCH_WAVE_INTERVAL_SECONDS = 20
+DISPATCH_STATE_TTL_SECONDS = 3600
+
+# Batch dispatch (batch-dispatch-pending-rides beat entry): match pending rides to idle drivers
+# globally (Hungarian algorithm on pickup distance). Off by default; waves keep running.
+BATCH_DISPATCH_ENABLED = False
+BATCH_DISPATCH_MAX_RIDES = 200
+BATCH_DISPATCH_MAX_PICKUP_KM = 10
+
+# Bulk fare quotes are memoized per distance rounded to this many decimals (km)
+FARE_QUOTE_DISTANCE_DECIMALS = 2
+FARE_QUOTE_CACHE_SECONDS = 120
+
+# Incentive progress windows older than this many days are deleted
+INCENTIVE_PROGRESS_KEEP_DAYS = 90
+
+# Platform wallet credits are spread over this many AdminWalletShard rows
+ADMIN_WALLET_SHARDS = 16
+
+# Admin dashboard snapshots (cached per chart range): served as is for FRESH_SECONDS, then
+# served stale while a Celery task recomputes them; rebuilt in the request after MAX_STALE_SECONDS.
+# With INVALIDATE_ON_COMPLETION every completed ride marks the snapshots stale.
+DASHBOARD_CACHE_FRESH_SECONDS = 30
+DASHBOARD_CACHE_MAX_STALE_SECONDS = 3600
+DASHBOARD_CACHE_INVALIDATE_ON_COMPLETION = False
+
+# Ratings kept in each driver's DriverRatingAggregate as recent feedback
+DRIVER_RATING_RECENT_FEEDBACK = 10
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -9,6 +9,7 @@ class MyAppConfig(AppConfig):
 
     def ready(self):
         import ApniRide.firebase_app
+        from . import signals
         if "runserver" in sys.argv or "daphne" in sys.argv:
             from . import scheduler
             # Delay scheduler start by 1 second so Django finishes init
@@ -0,0 +1,159 @@
+import logging
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .distance import haversine_many
+from .driver_index import driver_index
+from .utils import available_drivers
+
+logger = logging.getLogger(__name__)
+
+# Cost of a pair that must not be matched (wrong vehicle type, too far, rejected).
+# Large but finite so the solver's arithmetic stays exact.
+INFEASIBLE = 1e9
+
+
+def hungarian(cost):
+    """
+    Minimum-cost assignment for a rectangular cost matrix (shortest augmenting
+    path form of the Hungarian algorithm, O(n^2 m) with the inner scan in NumPy).
+    Returns [(row, col)] with one pair per row when rows <= cols, else per col.
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+    if n == 0:
+        return []
+
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    p = np.zeros(m + 1, dtype=np.int64)    # p[j]: row (1-based) assigned to column j
+    way = np.zeros(m + 1, dtype=np.int64)  # previous column on the augmenting path
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used[1:]
+            reduced = cost[i0 - 1] - u[i0] - v[1:]
+            better = free & (reduced < minv[1:])
+            minv[1:][better] = reduced[better]
+            way[1:][better] = j0
+            candidates = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(candidates)) + 1
+            delta = candidates[j1 - 1]
+            used_cols = np.nonzero(used)[0]
+            u[p[used_cols]] += delta
+            v[used_cols] -= delta
+            minv[1:][free] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        # Flip the augmenting path
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    pairs = [(int(p[j]) - 1, j - 1) for j in range(1, m + 1) if p[j]]
+    if transposed:
+        pairs = [(col, row) for row, col in pairs]
+    return sorted(pairs)
+
+
+def greedy_assignment(cost):
+    """Each row in order takes its cheapest still-free column (first-come nearest driver)"""
+    cost = np.asarray(cost, dtype=np.float64)
+    taken = np.zeros(cost.shape[1], dtype=bool)
+    pairs = []
+    for row in range(cost.shape[0]):
+        costs = np.where(taken, np.inf, cost[row])
+        col = int(np.argmin(costs)) if costs.size else 0
+        if costs.size and costs[col] < INFEASIBLE:
+            taken[col] = True
+            pairs.append((row, col))
+    return pairs
+
+
+def build_cost_matrix(rides, drivers, max_pickup_km, blocked=()):
+    """
+    Pickup distance in km for every (ride, driver) pair.
+
+    rides: [(lat, lng, vehicle_type)]; drivers: [(lat, lng, vehicle_type)];
+    blocked: (ride_index, driver_index) pairs to exclude. Pairs with a
+    different vehicle type or more than max_pickup_km apart cost INFEASIBLE.
+    """
+    cost = np.full((len(rides), len(drivers)), INFEASIBLE)
+    if not rides or not drivers:
+        return cost
+    d_lats, d_lngs, d_types = zip(*drivers)
+    d_types = np.array([(vt or "").lower() for vt in d_types])
+    for row, (lat, lng, vehicle_type) in enumerate(rides):
+        distances = haversine_many(lat, lng, d_lats, d_lngs)
+        feasible = distances <= max_pickup_km
+        if vehicle_type and vehicle_type.lower() != "any":
+            feasible &= d_types == vehicle_type.lower()
+        cost[row, feasible] = distances[feasible]
+    for row, col in blocked:
+        cost[row, col] = INFEASIBLE
+    return cost
+
+
+def plan_batch_assignment():
+    """
+    Match pending rides to idle drivers minimising total pickup distance.
+    Returns [(ride, driver_id, fcm_token, pickup_km)].
+    """
+    from .models import Ride
+
+    rides = list(
+        Ride.objects.select_related("user")
+        .filter(status="pending", driver__isnull=True, pickup_time__lte=timezone.now())
+        .exclude(pickup_lat__isnull=True).exclude(pickup_lng__isnull=True)
+        .order_by("created_at")[:settings.BATCH_DISPATCH_MAX_RIDES]
+    )
+    if not rides:
+        return []
+
+    driver_index.ensure_fresh()
+    drivers = []
+    for driver_id, vehicle_type, lat, lng, fcm_token in (
+        available_drivers().exclude(fcm_token__isnull=True).exclude(fcm_token="")
+        .values_list("id", "vehicle_type", "current_lat", "current_lng", "fcm_token")
+    ):
+        # Prefer the live position over the periodically flushed column
+        lat, lng = driver_index.position(driver_id) or (lat, lng)
+        drivers.append((driver_id, vehicle_type, lat, lng, fcm_token))
+    if not drivers:
+        return []
+
+    column = {driver[0]: col for col, driver in enumerate(drivers)}
+    rejected = Ride.rejected_by.through.objects.filter(ride_id__in=[ride.id for ride in rides])
+    row = {ride.id: index for index, ride in enumerate(rides)}
+    blocked = [
+        (row[ride_id], column[user_id])
+        for ride_id, user_id in rejected.values_list("ride_id", "user_id")
+        if user_id in column
+    ]
+
+    cost = build_cost_matrix(
+        [(ride.pickup_lat, ride.pickup_lng, ride.vehicle_type) for ride in rides],
+        [(lat, lng, vehicle_type) for _, vehicle_type, lat, lng, _ in drivers],
+        settings.BATCH_DISPATCH_MAX_PICKUP_KM,
+        blocked,
+    )
+    plan = []
+    for r, c in hungarian(cost):
+        if cost[r, c] >= INFEASIBLE:
+            continue
+        driver_id, _, _, _, fcm_token = drivers[c]
+        plan.append((rides[r], driver_id, fcm_token, float(cost[r, c])))
+    logger.info(f"Batch dispatch matched {len(plan)} of {len(rides)} pending rides with {len(drivers)} idle drivers")
+    return plan
@@ -1,4 +1,4 @@
-from .views import calculate_fare,calculate_incentives_and_rewards
+from .views import calculate_incentives_and_rewards
 import logging
 import random
 from decimal import Decimal
@@ -9,12 +9,14 @@ from rest_framework.response import Response
 from rest_framework.serializers import ValidationError
 from rest_framework import serializers
 
-from .models import Ride, Payment, DriverWallet,DistanceReward
+from .models import Ride, Payment, DriverWallet
 from .utils import (
     calculate_distance,
-    get_nearby_driver_tokens, 
     get_nearest_driver_distance
 )
+from .dispatch import find_dispatch_candidates
+from .fare_tables import quote_fare
+from .reward_index import find_reward
 from .serializers import RideSerializer
 from ApniRide.firebase_app import send_multicast
 
@@ -51,7 +53,8 @@ def send_ride_notification(ride_id):
     """Send notifications to nearby drivers for a scheduled ride"""
     try:
         ride = Ride.objects.get(id=ride_id)
-        tokens = get_nearby_driver_tokens(ride.pickup_lat, ride.pickup_lng)
+        candidates = find_dispatch_candidates(ride.pickup_lat, ride.pickup_lng, vehicle_type=ride.vehicle_type)
+        tokens = [candidate["fcm_token"] for candidate in candidates]
 
         if not tokens:
             logger.warning(f"⚠️ No drivers found for scheduled ride {ride.id}.")
@@ -169,12 +172,13 @@ class BookRideView(generics.CreateAPIView):
         print("distance_km",distance_km)
         # Calculate fare and incentives
         try:
-            overall = calculate_fare(vehicle_type, distance_km)
-            fare = int(overall['total_user_pays'])
-            gst_amount =int(overall['gst_amount'])
-            commission_amount = int(overall['commission_amount'])
-            driver_earnings = int(overall['driver_earnings'])
-            company_revenue = int(overall['company_revenue'])
+            # Exact paise amounts, so the wallet postings add up to the fare
+            overall = quote_fare(vehicle_type, distance_km)
+            fare = overall.rupees('total_user_pays')
+            gst_amount = overall.rupees('gst_amount')
+            commission_amount = overall.rupees('commission_amount')
+            driver_earnings = overall.rupees('driver_earnings')
+            company_revenue = overall.rupees('company_revenue')
             # driver_incentive, customer_reward = calculate_incentives_and_rewards(distance_km)
         except Exception as e:
             raise ValidationError(f"Error calculating fare or incentives: {str(e)}")
@@ -229,7 +233,7 @@ class BookRideView(generics.CreateAPIView):
 
         # Send notifications or schedule
         if pickup_mode == "NOW":
-            self._send_ride_notifications(ride, driver_to_pickup_km, distance_km)
+            self._send_ride_notifications(ride)
         else:
             # schedule_ride_notification(ride.id, ride.pickup_time)
             from api.tasks import send_scheduled_ride_notification
@@ -264,11 +268,15 @@ class BookRideView(generics.CreateAPIView):
 
                 # Debit wallet and log transaction
                 print("ff",Decimal(str(fare)),ride.booking_id,)
-                wallet.withdraw(
-                    Decimal(str(fare)), 
-                    description=f"Ride payment for booking {ride.booking_id}", 
-                    transaction_type='ride_payment'
-                )
+                try:
+                    # Conditional debit: fails if a concurrent debit drained the wallet since the check above
+                    wallet.withdraw(
+                        Decimal(str(fare)), 
+                        description=f"Ride payment for booking {ride.booking_id}", 
+                        transaction_type='ride_payment'
+                    )
+                except ValueError:
+                    raise ValidationError({"StatusCode":"0","StatusMessage":"Insufficient wallet balance for this ride","Balance":wallet.balance})
                 print("completed",self.request.user)
                 # Create completed payment record
                 Payment.objects.create(
@@ -309,36 +317,11 @@ class BookRideView(generics.CreateAPIView):
         else:
             raise ValidationError("Invalid payment type. Supported: cod, wallet, razorpay")
 
-    def _send_ride_notifications(self, ride, driver_to_pickup_km, distance_km):
-        """Send notifications to nearby drivers"""
-        driver_to_pickup_km = driver_to_pickup_km or 0
-        distance_km = distance_km or 0
-        tokens = get_nearby_driver_tokens(ride.pickup_lat, ride.pickup_lng,vehicle_type=ride.vehicle_type)
-        if tokens:
-            notification = {
-                "title": "New Ride Request 🚖",
-                "body": f"Pickup near you: {ride.pickup} - {ride.drop}"
-            }
-            data_payload = {
-                "ride_id": str(ride.id),
-                "booking_id": str(ride.booking_id),
-                "pickup_location": str(ride.pickup),
-                "drop_location": str(ride.drop),
-                "driver_to_pickup_km": str(round(driver_to_pickup_km, 2)),  
-                "pickup_to_drop_km": str(round(distance_km, 2)),
-                "excepted_earnings":str(round(ride.driver_earnings,0)),
-                "user_number":ride.user.mobile,
-                "pickup_time":str(ride.pickup_time),
-                "action": "NEW_RIDE"
-            }
-
-            print(f"Tokens found: {tokens}")
-            try:
-                response = send_multicast(tokens, notification=notification, data=data_payload)
-                print(f"Notification response: {response}")
-                logger.info(f"Instant ride notification sent for ride {ride.id}")
-            except Exception as e:
-                logger.error(f"FCM send error for ride {ride.id}: {e}")
+    def _send_ride_notifications(self, ride):
+        """Hand the ride to the wave dispatcher (tasks.dispatch_ride_wave)"""
+        from api.tasks import dispatch_ride_wave
+        dispatch_ride_wave.delay(ride.id)
+        logger.info(f"Dispatch started for ride {ride.id}")
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -382,25 +365,17 @@ class BookRideView(generics.CreateAPIView):
     
 def Usercashback(km, vehicle_type):
     try:
-        cashback_amount = 0
-        reward_details = None
-        rules = DistanceReward.objects.filter(vehicle_type__iexact=vehicle_type)
-
-        for rule in rules:
-            if rule.min_distance <= km <= (rule.max_distance or 999999):  
-                cashback_amount = rule.cashback
-                reward_details = rule
-                break
+        reward = find_reward("cashback", km, vehicle_type)
 
-        if cashback_amount > 0 and reward_details:
+        if reward and reward["cashback"] > 0:
             return {
                 "status": True,
-                "cashback": reward_details.cashback,
-                "water_bottles": reward_details.water_bottles,
-                "tea": reward_details.tea,
-                "heading": reward_details.heading,
-                "message": reward_details.message,
-                "vehicle_image": reward_details.vehicle_image.url if reward_details.vehicle_image else None
+                "cashback": reward["cashback"],
+                "water_bottles": reward["water_bottles"],
+                "tea": reward["tea"],
+                "heading": reward["heading"],
+                "message": reward["message"],
+                "vehicle_image": reward["vehicle_image"]
             }
         else:
             return {
@@ -7,6 +7,8 @@ from rest_framework.views import APIView
 from .models import *
 from .serializers import *
 from .tasks import notify_ride_status
+from . import wallet_ledger
+from .daily_metrics import record_ride_cancelled
 
 # User API to cancel a ride
 class UserCancelRideViews(APIView):
@@ -52,16 +54,10 @@ class UserCancelRideViews(APIView):
 
         if charge > 0:
             # Deduct from user wallet (allow negative)
-            ride_wallet.balance -= charge
-            ride_wallet.save(update_fields=["balance", "updated_at"])
-
-            # Log user wallet transaction
-            UserWalletTransaction.objects.create(
-                wallet=ride_wallet,
-                transaction_type="ride_payment",
-                amount=-charge,
-                description=f"Cancellation charge for Ride {ride.id}",
-                balance_after=ride_wallet.balance,
+            wallet_ledger.debit(
+                ride_wallet, charge, "ride_payment",
+                f"Cancellation charge for Ride {ride.id}",
+                allow_negative=True,
                 related_ride=ride
             )
 
@@ -93,7 +89,8 @@ class UserCancelRideViews(APIView):
         if ride.driver: 
             ride.driver.is_available = True
             ride.driver.save(update_fields=["is_available"])
-        ride.save(update_fields=["status", "is_cancelled_by_user", "cancelled_at", "cancellation_charge"])
+        ride.save(update_fields=["status", "is_cancelled_by_user", "cancelled_at", "cancellation_charge", "updated_at"])
+        record_ride_cancelled(ride)
 
         #  Notify via WebSocket / FCM
         notify_ride_status(ride)
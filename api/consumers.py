@@ -63,23 +63,49 @@ from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from django.contrib.auth.models import AnonymousUser
+from asgiref.sync import sync_to_async
+from redis.exceptions import RedisError
+from .driver_index import driver_index
+from .live_location import live_locations
+from .location_buffer import location_buffer
 
 logger = logging.getLogger(__name__)
 
+
+def query_token(scope):
+    """The JWT passed as ?token=... on a websocket URL, or None"""
+    token = None
+    for param in scope['query_string'].decode().split('&'):
+        if param.startswith('token='):
+            token = param.split('=')[1]
+    return token
+
+
+@database_sync_to_async
+def get_user_from_token(token):
+    jwt_auth = JWTAuthentication()
+    try:
+        validated_token = jwt_auth.get_validated_token(token)
+        user = jwt_auth.get_user(validated_token)
+        logger.info(f"User authenticated: {user.id} ({user.username})")
+        return user
+    except Exception as e:
+        logger.error(f"Token authentication failed: {str(e)}")
+        return AnonymousUser()
+
+
 class DriverLocationConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         logger.info(f"WebSocket connecting: {self.scope['query_string']}")
-        query_string = self.scope['query_string'].decode()
-        token = None
-        for param in query_string.split('&'):
-            if param.startswith('token='):
-                token = param.split('=')[1]
+        token = query_token(self.scope)
 
         if token:
-            user = await self.get_user_from_token(token)
+            user = await get_user_from_token(token)
             if user and user.is_authenticated:
                 self.scope['user'] = user
                 self.driver_id = user.id
+                # Kept current by online_status events from DriverOnlineStatusUpdateView
+                self.is_online = user.is_online
                 self.group_name = f"driver_{self.driver_id}"
                 await self.channel_layer.group_add(self.group_name, self.channel_name)
                 await self.accept()
@@ -96,16 +122,16 @@ class DriverLocationConsumer(AsyncWebsocketConsumer):
             await self.close(code=4002)
 
     @database_sync_to_async
-    def get_user_from_token(self, token):
-        jwt_auth = JWTAuthentication()
+    def store_location(self, latitude, longitude, heading=None):
         try:
-            validated_token = jwt_auth.get_validated_token(token)
-            user = jwt_auth.get_user(validated_token)
-            logger.info(f"User authenticated: {user.id} ({user.username})")
-            return user
-        except Exception as e:
-            logger.error(f"Token authentication failed: {str(e)}")
-            return AnonymousUser()
+            heading = float(heading) if heading is not None else None
+        except (TypeError, ValueError):
+            heading = None
+        try:
+            live_locations.update(self.driver_id, latitude, longitude, heading=heading, online=self.is_online)
+        except RedisError as e:
+            logger.error(f"Live location store unavailable, buffering location write for driver {self.driver_id}: {e}")
+            location_buffer.add(self.driver_id, latitude, longitude)
 
     async def disconnect(self, close_code):
         if hasattr(self, 'group_name'):
@@ -118,6 +144,15 @@ class DriverLocationConsumer(AsyncWebsocketConsumer):
         """Handle location updates from driver"""
         data = json.loads(text_data)
         logger.info(f"Location update from driver {self.scope['user'].id}: {data}")
+        try:
+            latitude, longitude = float(data.get("latitude")), float(data.get("longitude"))
+        except (TypeError, ValueError):
+            logger.warning(f"Invalid coordinates from driver {self.driver_id}: {data}")
+        else:
+            # Offline drivers keep reporting their position but are not offered rides
+            if self.is_online:
+                driver_index.update(self.driver_id, latitude, longitude)
+            await self.store_location(latitude, longitude, data.get("heading"))
         await self.channel_layer.group_send(
             self.group_name,
             {
@@ -128,6 +163,9 @@ class DriverLocationConsumer(AsyncWebsocketConsumer):
             }
         )
 
+    async def online_status(self, event):
+        self.is_online = event["is_online"]
+
     async def location_update(self, event):
         logger.info(f"Sending location update to driver {self.driver_id}: {event}")
         await self.send(text_data=json.dumps({
@@ -139,11 +177,32 @@ class DriverLocationConsumer(AsyncWebsocketConsumer):
 
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+from .trajectory import TrajectoryBuffer
+from .trip_distance import trip_meter
 
 class RideLocationConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.ride_id = self.scope['url_route']['kwargs']['ride_id']
         self.room_group_name = f"ride_{self.ride_id}"
+        self.trajectory = TrajectoryBuffer(settings.TRAJECTORY_MAX_POINTS)
+        self.recording = False
+
+        # Only the ride's rider, its driver and staff may join; the points are billed on
+        token = query_token(self.scope)
+        user = await get_user_from_token(token) if token else None
+        ride = await self.get_ride()
+        if not user or not user.is_authenticated or not ride or not (
+            user.id in (ride['user_id'], ride['driver_id']) or user.is_staff
+        ):
+            logger.warning(f"Ride {self.ride_id} location socket rejected for {getattr(user, 'id', None)}")
+            await self.close(code=4001)
+            return
+        self.user_id = user.id
+        self.is_driver = user.id == ride['driver_id']
+
+        # Points are only recorded from the ride's driver while the ride is ongoing
+        self.recording = self.is_driver and ride['status'] == 'ongoing'
 
         # Join ride group
         await self.channel_layer.group_add(
@@ -153,6 +212,9 @@ class RideLocationConsumer(AsyncWebsocketConsumer):
         await self.accept()
 
     async def disconnect(self, close_code):
+        # Keep what was recorded so far if the driver drops mid-ride
+        if hasattr(self, 'user_id'):
+            await self.save_trajectory()
         # Leave ride group
         await self.channel_layer.group_discard(
             self.room_group_name,
@@ -160,11 +222,26 @@ class RideLocationConsumer(AsyncWebsocketConsumer):
         )
 
     async def receive(self, text_data):
+        if not self.is_driver:
+            # Riders and staff only watch; their messages would move the driver's marker
+            logger.warning(f"Ignoring location from non-driver {self.user_id} on ride {self.ride_id}")
+            return
         data = json.loads(text_data)
         latitude = data.get("lat")
         longitude = data.get("lng")
         kilo = data.get("kilo")
 
+        if self.recording:
+            try:
+                full = self.trajectory.append(latitude, longitude)
+            except (TypeError, ValueError):
+                logger.warning(f"Invalid coordinates for ride {self.ride_id}: {data}")
+            else:
+                await self.meter_point(latitude, longitude)
+                if full:
+                    # Save the full window as a segment before the ring wraps
+                    await self.save_trajectory()
+
         # Broadcast location to group
         await self.channel_layer.group_send(
             self.room_group_name,
@@ -184,7 +261,37 @@ class RideLocationConsumer(AsyncWebsocketConsumer):
         }))
 
     async def ride_status_update(self, event):
+        if event["status"] == 'ongoing':
+            self.recording = self.is_driver
+        elif self.recording:
+            self.recording = False
+            await self.save_trajectory()
         await self.send(text_data=json.dumps({
             "type": "ride_status",
             "status": event["status"]
         }))
+
+    @sync_to_async
+    def meter_point(self, latitude, longitude):
+        try:
+            trip_meter.add_point(self.ride_id, latitude, longitude)
+        except RedisError as e:
+            logger.error(f"Trip meter unavailable for ride {self.ride_id}: {e}")
+
+    @database_sync_to_async
+    def get_ride(self):
+        from .models import Ride
+        return Ride.objects.filter(id=self.ride_id).values('status', 'user_id', 'driver_id').first()
+
+    @database_sync_to_async
+    def save_trajectory(self):
+        """Append the buffered points to the ride's stored polyline and empty the buffer"""
+        if not len(self.trajectory):
+            return
+        from .models import Ride, RideTrajectory
+        if not Ride.objects.filter(id=self.ride_id).exists():
+            return
+        trajectory, _ = RideTrajectory.objects.get_or_create(ride_id=self.ride_id)
+        trajectory.append_points(self.trajectory.points())
+        self.trajectory.clear()
+        logger.info(f"Saved trajectory for ride {self.ride_id}: {trajectory.point_count} points, {trajectory.distance_km} km")
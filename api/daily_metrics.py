@@ -0,0 +1,176 @@
+import logging
+from datetime import timedelta
+from decimal import Decimal
+
+from django.apps import apps as global_apps
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Min, Q, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import DailyMetric
+
+logger = logging.getLogger(__name__)
+
+COUNTERS = (
+    "rides_created", "rides_completed", "rides_cancelled",
+    "revenue", "commission", "gst", "new_users", "new_drivers",
+)
+
+
+def increment(model, lookup, deltas):
+    """Add `deltas` to the counters of the `model` row matching `lookup` with one F() UPDATE, creating it on first use"""
+    deltas = {field: value for field, value in deltas.items() if value}
+    if not deltas:
+        return
+    rows = model.objects.filter(**lookup)
+    if rows.update(**{field: F(field) + value for field, value in deltas.items()}):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **deltas)
+    except IntegrityError:
+        # Another worker created the row first
+        rows.update(**{field: F(field) + value for field, value in deltas.items()})
+
+
+def bump(day, vehicle_type="", **deltas):
+    """Add `deltas` to the (day, vehicle_type) rollup row"""
+    increment(DailyMetric, {"date": day, "vehicle_type": vehicle_type or ""}, deltas)
+
+
+def _day(value=None):
+    return timezone.localdate(value) if value else timezone.localdate()
+
+
+def record_ride_created(ride):
+    bump(_day(ride.created_at), ride.vehicle_type, rides_created=1)
+
+
+def record_ride_completed(ride, revenue_row=None):
+    """
+    Count a completion on the day of ride.completed_at, and the revenue
+    transaction it posted on the row's own day, the days rebuild() dates
+    them to. Both go in one rollup update when they fall on the same day.
+    """
+    day = _day(ride.completed_at)
+    deltas = {"rides_completed": 1}
+    if revenue_row is not None:
+        if _day(revenue_row.created_at) == day:
+            deltas.update(_revenue_deltas(revenue_row))
+        else:
+            record_revenue(revenue_row, ride.vehicle_type)
+    bump(day, ride.vehicle_type, **deltas)
+
+
+def record_ride_cancelled(ride):
+    """Count a cancellation on the day of ride.cancelled_at, the day rebuild() dates it to"""
+    bump(_day(ride.cancelled_at), ride.vehicle_type, rides_cancelled=1)
+
+
+def _revenue_deltas(transaction_row):
+    return {
+        "revenue": Decimal(transaction_row.amount),
+        "commission": Decimal(transaction_row.commission_amount or 0),
+        "gst": Decimal(transaction_row.gst_amount or 0),
+    }
+
+
+def record_revenue(transaction_row, vehicle_type=""):
+    """Count an AdminWalletTransaction of type 'revenue' (rows of other types are ignored)"""
+    if transaction_row.transaction_type != "revenue":
+        return
+    bump(_day(transaction_row.created_at), vehicle_type, **_revenue_deltas(transaction_row))
+
+
+def record_user_joined(user):
+    bump(_day(user.date_joined), new_users=1 if user.is_user else 0, new_drivers=1 if user.is_driver else 0)
+
+
+def record_user_deleted(user):
+    """Take a deleted user off their sign-up day, so all-time user and driver totals stay current"""
+    bump(_day(user.date_joined), new_users=-1 if user.is_user else 0, new_drivers=-1 if user.is_driver else 0)
+
+
+def daily_totals(start, end):
+    """{date: {counter: total over vehicle types}} for every day in [start, end], zero-filled"""
+    totals = {start + timedelta(days=i): dict.fromkeys(COUNTERS, 0) for i in range((end - start).days + 1)}
+    rows = DailyMetric.objects.filter(date__range=(start, end)).values("date").annotate(
+        **{f"sum_{field}": Sum(field) for field in COUNTERS}
+    )
+    for row in rows:
+        totals[row["date"]] = {field: row[f"sum_{field}"] for field in COUNTERS}
+    return totals
+
+
+def all_time_totals(*fields):
+    row = DailyMetric.objects.aggregate(**{field: Sum(field) for field in fields})
+    return {field: row[field] or 0 for field in fields}
+
+
+def first_day(apps=global_apps):
+    """Local date of the first ride or user sign-up, or None on an empty database"""
+    first = [
+        value for value in (
+            apps.get_model("api", "Ride").objects.aggregate(first=Min("created_at"))["first"],
+            apps.get_model("api", "User").objects.aggregate(first=Min("date_joined"))["first"],
+        ) if value
+    ]
+    return timezone.localdate(min(first)) if first else None
+
+
+def rebuild(start, end, apps=global_apps):
+    """
+    Recompute the rollup rows of [start, end] from rides, users and admin
+    wallet transactions. `apps` is the app registry to take the models from
+    (a migration passes its historical one).
+    """
+    Ride = apps.get_model("api", "Ride")
+    User = apps.get_model("api", "User")
+    AdminWalletTransaction = apps.get_model("api", "AdminWalletTransaction")
+    DailyMetric = apps.get_model("api", "DailyMetric")
+    counts = {}
+
+    def add(day, vehicle_type, field, value):
+        if day is None or not value:
+            return
+        row = counts.setdefault((day, vehicle_type or ""), dict.fromkeys(COUNTERS, 0))
+        row[field] += value
+
+    rides = Ride.objects.all()
+    for row in rides.filter(created_at__date__range=(start, end)).values(
+        day=TruncDate("created_at"), vt=F("vehicle_type")
+    ).annotate(n=Count("id")):
+        add(row["day"], row["vt"], "rides_created", row["n"])
+    for row in rides.filter(status="completed").annotate(
+        at=Coalesce("completed_at", "updated_at")
+    ).filter(at__date__range=(start, end)).values(day=TruncDate("at"), vt=F("vehicle_type")).annotate(n=Count("id")):
+        add(row["day"], row["vt"], "rides_completed", row["n"])
+    # Every cancellation path sets cancelled_at; updated_at only dates rides cancelled before it did
+    for row in rides.filter(status__in=["cancelled", "cancelled_by_user", "auto_cancelled"]).annotate(
+        at=Coalesce("cancelled_at", "updated_at")
+    ).filter(at__date__range=(start, end)).values(day=TruncDate("at"), vt=F("vehicle_type")).annotate(n=Count("id")):
+        add(row["day"], row["vt"], "rides_cancelled", row["n"])
+
+    for row in AdminWalletTransaction.objects.filter(
+        transaction_type="revenue", created_at__date__range=(start, end)
+    ).values(day=TruncDate("created_at"), vt=F("related_ride__vehicle_type")).annotate(
+        revenue=Sum("amount"), commission=Sum("commission_amount"), gst=Sum("gst_amount")
+    ):
+        for field in ("revenue", "commission", "gst"):
+            add(row["day"], row["vt"], field, row[field])
+
+    for row in User.objects.filter(date_joined__date__range=(start, end)).values(
+        day=TruncDate("date_joined")
+    ).annotate(users=Count("id", filter=Q(is_user=1)), drivers=Count("id", filter=Q(is_driver=1))):
+        add(row["day"], "", "new_users", row["users"])
+        add(row["day"], "", "new_drivers", row["drivers"])
+
+    with transaction.atomic():
+        DailyMetric.objects.filter(date__range=(start, end)).delete()
+        DailyMetric.objects.bulk_create([
+            DailyMetric(date=day, vehicle_type=vehicle_type, **values)
+            for (day, vehicle_type), values in sorted(counts.items())
+        ])
+    logger.info(f"Rebuilt {len(counts)} daily metric rows for {start}..{end}")
+    return len(counts)
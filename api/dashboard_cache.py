@@ -0,0 +1,82 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_KEY = "dashboard:invalidation"
+
+
+def snapshot_key(chart_range, custom_chart):
+    start, end, granularity = chart_range
+    return f"dashboard:{start.isoformat()}:{end.isoformat()}:{granularity}:{int(custom_chart)}"
+
+
+def _invalidation():
+    return cache.get(INVALIDATION_KEY, 0)
+
+
+def refresh(chart_range, custom_chart, build):
+    """Compute the snapshot of `chart_range` with `build(chart_range, custom_chart)` and store it"""
+    key = snapshot_key(chart_range, custom_chart)
+    # Read before building, so an invalidation that lands mid-build still marks the result stale
+    invalidation = _invalidation()
+    snapshot = {
+        "payload": build(chart_range, custom_chart),
+        "computed_at": time.time(),
+        "invalidation": invalidation,
+    }
+    cache.set(key, snapshot, settings.DASHBOARD_CACHE_MAX_STALE_SECONDS)
+    cache.delete(f"{key}:refreshing")
+    return snapshot
+
+
+def _schedule_refresh(key, chart_range, custom_chart):
+    # One refresh in flight per key; the marker expires in case the worker never runs it
+    if not cache.add(f"{key}:refreshing", 1, settings.DASHBOARD_CACHE_FRESH_SECONDS):
+        return
+    from .tasks import refresh_dashboard_snapshot
+    start, end, granularity = chart_range
+    try:
+        refresh_dashboard_snapshot.delay(start.isoformat(), end.isoformat(), granularity, custom_chart)
+    except Exception as e:
+        logger.warning(f"Could not enqueue dashboard refresh for {key}: {e}")
+        cache.delete(f"{key}:refreshing")
+
+
+def get_snapshot(chart_range, custom_chart, build):
+    """
+    (payload, age in seconds, stale) of the dashboard for `chart_range`.
+
+    A snapshot younger than DASHBOARD_CACHE_FRESH_SECONDS that no ride
+    completion has invalidated is served as is. An older or invalidated one
+    is still served straight away while a Celery task recomputes it
+    (stale-while-revalidate); only a missing snapshot, or one past
+    DASHBOARD_CACHE_MAX_STALE_SECONDS, is built in the request. If the
+    cache is unreachable every request builds its own payload.
+    """
+    key = snapshot_key(chart_range, custom_chart)
+    try:
+        snapshot = cache.get(key)
+        if snapshot is None:
+            return refresh(chart_range, custom_chart, build)["payload"], 0, False
+        age = time.time() - snapshot["computed_at"]
+        stale = age > settings.DASHBOARD_CACHE_FRESH_SECONDS or snapshot["invalidation"] != _invalidation()
+        if stale:
+            _schedule_refresh(key, chart_range, custom_chart)
+        return snapshot["payload"], age, stale
+    except RedisError as e:
+        logger.warning(f"Dashboard cache unavailable, building inline: {e}")
+        return build(chart_range, custom_chart), 0, False
+
+
+def invalidate_dashboards():
+    """Mark every cached dashboard snapshot stale; they keep being served until refreshed"""
+    try:
+        cache.add(INVALIDATION_KEY, 0, None)
+        cache.incr(INVALIDATION_KEY)
+    except (RedisError, ValueError) as e:
+        logger.warning(f"Could not invalidate dashboard snapshots: {e}")
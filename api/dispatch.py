@@ -0,0 +1,158 @@
+import logging
+
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+
+from ApniRide.firebase_app import send_multicast
+from .redis_client import get_redis
+from .utils import get_nearby_driver_rows
+
+logger = logging.getLogger(__name__)
+
+
+# --- Scorers ---
+# Each scorer takes a list of driver ids and returns {driver_id: score in [0, 1]},
+# higher is better. DISPATCH_SCORE_WEIGHTS maps scorer name -> km of distance a
+# perfect score is worth.
+
+def rating_score(driver_ids):
+    """Average star rating scaled to [0, 1]; unrated drivers are neutral (0.5)"""
+    from .models import DriverRatingAggregate
+
+    averages = {
+        driver_id: stars_sum / rating_count
+        for driver_id, stars_sum, rating_count in DriverRatingAggregate.objects.filter(
+            driver_id__in=driver_ids, rating_count__gt=0
+        ).values_list("driver_id", "stars_sum", "rating_count")
+    }
+    return {
+        driver_id: (averages[driver_id] - 1) / 4 if driver_id in averages else 0.5
+        for driver_id in driver_ids
+    }
+
+
+def idle_score(driver_ids):
+    """Time since the driver's last completed ride, capped at DISPATCH_IDLE_CAP_MINUTES"""
+    from .models import Ride
+
+    cap_minutes = settings.DISPATCH_IDLE_CAP_MINUTES
+    last_completed = dict(
+        Ride.objects.filter(driver_id__in=driver_ids, status="completed")
+        .values("driver_id")
+        .annotate(last=Max("completed_at"))
+        .values_list("driver_id", "last")
+    )
+    now = timezone.now()
+    scores = {}
+    for driver_id in driver_ids:
+        last = last_completed.get(driver_id)
+        if last is None:
+            scores[driver_id] = 1.0
+        else:
+            idle_minutes = (now - last).total_seconds() / 60
+            scores[driver_id] = min(idle_minutes / cap_minutes, 1.0)
+    return scores
+
+
+SCORERS = {
+    "rating": rating_score,
+    "idle": idle_score,
+}
+
+
+def find_dispatch_candidates(pickup_lat, pickup_lng, vehicle_type=None, k=None, rings_km=None, exclude_ids=()):
+    """
+    The k best available drivers for a pickup.
+
+    Searches rings of increasing radius (DISPATCH_RINGS_KM) until k drivers are
+    found or the last ring is reached, then orders them by
+    distance_km - sum(weight * score) over DISPATCH_SCORE_WEIGHTS.
+    Returns [{"driver_id", "fcm_token", "distance_km", "score"}], best first.
+    """
+    k = k or settings.DISPATCH_K
+    rings_km = rings_km or settings.DISPATCH_RINGS_KM
+
+    rows = []
+    for radius_km in rings_km:
+        rows = get_nearby_driver_rows(pickup_lat, pickup_lng, radius_km, vehicle_type, exclude_ids=exclude_ids)
+        if len(rows) >= k:
+            break
+    if not rows:
+        logger.info(f"No {vehicle_type or 'any'} drivers within {rings_km[-1]} km of ({pickup_lat}, {pickup_lng})")
+        return []
+
+    driver_ids = [driver_id for driver_id, _, _ in rows]
+    bonus = dict.fromkeys(driver_ids, 0.0)
+    for name, weight in settings.DISPATCH_SCORE_WEIGHTS.items():
+        if not weight:
+            continue
+        for driver_id, score in SCORERS[name](driver_ids).items():
+            bonus[driver_id] += weight * score
+
+    candidates = [
+        {
+            "driver_id": driver_id,
+            "fcm_token": fcm_token,
+            "distance_km": round(dist, 3),
+            "score": round(dist - bonus[driver_id], 3),
+        }
+        for driver_id, fcm_token, dist in rows
+    ]
+    candidates.sort(key=lambda c: c["score"])
+    logger.info(f"Dispatch candidates within {radius_km} km: {[c['driver_id'] for c in candidates[:k]]}")
+    return candidates[:k]
+
+
+# --- Wave offers ---
+# dispatch_ride_wave (tasks.py) offers a pending ride to DISPATCH_WAVE_SIZE
+# drivers at a time; the drivers already offered are kept in a Redis set so
+# each wave goes to new drivers.
+
+def _offered_key(ride_id):
+    return f"ride:{ride_id}:offered"
+
+
+def offered_driver_ids(ride_id):
+    return {int(driver_id) for driver_id in get_redis().smembers(_offered_key(ride_id))}
+
+
+def record_offers(ride_id, driver_ids):
+    pipe = get_redis().pipeline(transaction=False)
+    pipe.sadd(_offered_key(ride_id), *driver_ids)
+    pipe.expire(_offered_key(ride_id), settings.DISPATCH_STATE_TTL_SECONDS)
+    pipe.execute()
+
+
+def clear_offers(ride_id):
+    get_redis().delete(_offered_key(ride_id))
+
+
+def send_ride_offer(ride, candidates):
+    """
+    Push the NEW_RIDE notification to the candidates' devices. Each driver is
+    told their own pickup distance, so candidates go out in one multicast per
+    distinct (rounded) distance; returns the multicast responses.
+    """
+    notification = {
+        "title": "New Ride Request 🚖",
+        "body": f"Pickup near you: {ride.pickup} - {ride.drop}"
+    }
+    data_payload = {
+        "ride_id": str(ride.id),
+        "booking_id": str(ride.booking_id),
+        "pickup_location": str(ride.pickup),
+        "drop_location": str(ride.drop),
+        "pickup_to_drop_km": str(round(ride.distance_km or 0, 2)),
+        "excepted_earnings": str(round(ride.driver_earnings, 0)),
+        "user_number": ride.user.mobile,
+        "pickup_time": str(ride.pickup_time),
+        "action": "NEW_RIDE"
+    }
+    tokens_by_distance = {}
+    for candidate in candidates:
+        tokens_by_distance.setdefault(str(round(candidate["distance_km"], 2)), []).append(candidate["fcm_token"])
+    return [
+        send_multicast(tokens, notification=notification, data={**data_payload, "driver_to_pickup_km": km})
+        for km, tokens in tokens_by_distance.items()
+    ]
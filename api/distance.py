@@ -0,0 +1,77 @@
+import math
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+# Length of a degree of latitude on the sphere haversine_km measures on
+KM_PER_DEGREE_LAT = EARTH_RADIUS_KM * math.pi / 180
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance in km between two points"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = math.radians(lat2 - lat1)
+    dlambda = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return EARTH_RADIUS_KM * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+def bounding_box(lat, lng, radius_km):
+    """
+    (min_lat, max_lat, min_lng, max_lng) of a box that contains every point
+    within radius_km of (lat, lng). Used as an index-friendly prefilter before
+    the exact haversine check.
+
+    Latitudes are clamped to the poles; a box that reaches a pole spans every
+    longitude. Longitudes are wrapped into [-180, 180], so a box crossing the
+    antimeridian comes back with min_lng > max_lng.
+    """
+    lat_delta = radius_km / KM_PER_DEGREE_LAT
+    min_lat, max_lat = max(lat - lat_delta, -90.0), min(lat + lat_delta, 90.0)
+    if min_lat == -90.0 or max_lat == 90.0:
+        return min_lat, max_lat, -180.0, 180.0
+    # Widest at the latitude of the box edge nearest the pole
+    lng_delta = radius_km / (KM_PER_DEGREE_LAT * math.cos(math.radians(abs(lat) + lat_delta)))
+    if lng_delta >= 180.0:
+        return min_lat, max_lat, -180.0, 180.0
+    min_lng, max_lng = lng - lng_delta, lng + lng_delta
+    if min_lng < -180.0:
+        min_lng += 360.0
+    if max_lng > 180.0:
+        max_lng -= 360.0
+    return min_lat, max_lat, min_lng, max_lng
+
+
+def haversine_many(lat, lng, lats, lngs):
+    """
+    Distances in km from one point to arrays of coordinates in a single NumPy pass.
+    Returns a float64 array the same length as lats/lngs.
+    """
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    lngs = np.radians(np.asarray(lngs, dtype=np.float64))
+    phi = math.radians(float(lat))
+    dphi = lats - phi
+    dlambda = lngs - math.radians(float(lng))
+    a = np.sin(dphi / 2) ** 2 + math.cos(phi) * np.cos(lats) * np.sin(dlambda / 2) ** 2
+    return EARTH_RADIUS_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def rank_by_distance(lat, lng, lats, lngs, radius_km=None, k=None):
+    """
+    Rank coordinates by distance from (lat, lng).
+
+    Optionally keeps only points within radius_km and the k nearest of those.
+    Returns (indices, distances) as arrays ordered nearest first, where indices
+    point back into lats/lngs.
+    """
+    distances = haversine_many(lat, lng, lats, lngs)
+    indices = np.arange(distances.size)
+    if radius_km is not None:
+        mask = distances <= radius_km
+        indices, distances = indices[mask], distances[mask]
+    if k is not None and k < distances.size:
+        # argpartition keeps the k smallest without sorting everything
+        top = np.argpartition(distances, k - 1)[:k]
+        indices, distances = indices[top], distances[top]
+    order = np.argsort(distances, kind="stable")
+    return indices[order], distances[order]
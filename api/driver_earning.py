@@ -6,25 +6,27 @@ from datetime import timedelta
 from django.db.models import Sum, Count
 from .models import Ride, User,DriverIncentiveProgress
 from .serializers import DriverEarningsSerializer,DriverIncentiveProgressSerializer
+from .timeseries import parse_range, series_payload, time_series
+from .driver_summary import period_totals
 
 class DriverEarningsAPIView(APIView):
     """
-    API to get driver earnings and ride counts: daily, weekly, monthly
+    API to get driver earnings and ride counts: daily, weekly, monthly,
+    plus an earnings chart when start/end/granularity are given
     """
 
-    def get_rides_data(self, driver, start_date, end_date, period_name):
-        rides = Ride.objects.filter(
-            driver=driver,
-            completed=True,
-            completed_at__date__range=[start_date, end_date]
+    def earnings_series(self, driver, start_date, end_date, granularity="day"):
+        rides = Ride.objects.filter(driver=driver, completed=True)
+        return time_series(
+            rides, 'completed_at', start_date, end_date, granularity,
+            total_earnings=Sum('fare'), total_rides=Count('id')
         )
-        total_earnings = rides.aggregate(total=Sum('fare'))['total'] or 0
-        total_rides = rides.count()
 
+    def get_rides_data(self, totals, period_name):
         return {
             'period': period_name,
-            'total_earnings': total_earnings,
-            'total_rides': total_rides
+            'total_earnings': totals['fare_total'],
+            'total_rides': totals['rides_completed']
         }
 
     def get(self, request, driver_id):
@@ -33,24 +35,41 @@ class DriverEarningsAPIView(APIView):
         except User.DoesNotExist:
             return Response({"error": "Driver not found"}, status=404)
 
-        today = timezone.now().date()
+        today = timezone.localdate()
+        start_of_week = today - timedelta(days=today.weekday())
+        end_of_week = start_of_week + timedelta(days=6)
+        first_day_of_month = today.replace(day=1)
+        last_day_of_month = (first_day_of_month + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+
+        # Sums over at most ~37 DriverDailySummary rows, one query for all three periods
+        totals = period_totals(driver, {
+            "daily": (today, today),
+            "weekly": (start_of_week, end_of_week),
+            "monthly": (first_day_of_month, last_day_of_month),
+        })
 
         # Daily
-        daily_data = self.get_rides_data(driver, today, today, "daily")
+        daily_data = self.get_rides_data(totals["daily"], "daily")
 
         # Weekly (Monday to Sunday)
-        start_of_week = today - timedelta(days=today.weekday())
-        end_of_week = start_of_week + timedelta(days=6)
-        weekly_data = self.get_rides_data(driver, start_of_week, end_of_week, "weekly")
+        weekly_data = self.get_rides_data(totals["weekly"], "weekly")
 
         # Monthly
-        first_day_of_month = today.replace(day=1)
-        last_day_of_month = (first_day_of_month + timedelta(days=32)).replace(day=1) - timedelta(days=1)
-        monthly_data = self.get_rides_data(driver, first_day_of_month, last_day_of_month, "monthly")
+        monthly_data = self.get_rides_data(totals["monthly"], "monthly")
 
         data = [daily_data, weekly_data, monthly_data]
         serializer = DriverEarningsSerializer(data, many=True)
-        return Response({"StatusCode":"1","StatusMessage":"Sucess","data":serializer.data})
+        response = {"StatusCode":"1","StatusMessage":"Sucess","data":serializer.data}
+
+        if any(key in request.query_params for key in ("start", "end", "granularity")):
+            try:
+                start_date, end_date, granularity = parse_range(request.query_params, default_days=30)
+            except ValueError as e:
+                return Response({"StatusCode":"0","StatusMessage":str(e)}, status=400)
+            response["chart"] = series_payload(
+                self.earnings_series(driver, start_date, end_date, granularity), granularity
+            )
+        return Response(response)
 
 
 # views.py
@@ -181,6 +200,7 @@ from django.utils import timezone
 from rest_framework import generics
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from django.db.models import Q
 from .models import UserWalletTransaction, DriverWallet
 from .serializers import UserWalletTransactionSerializer
 
@@ -241,20 +261,58 @@ class DriverWalletTransactionHistoryView(generics.ListAPIView):
 
         return queryset
 
+    def chart_params(self):
+        """start/end/granularity for parse_range() matching this view's date filters (default: last 30 days)"""
+        params = self.request.query_params
+        chart = {"granularity": params.get('granularity')}
+        filter_type = (params.get('filter_type') or '').lower()
+        today = timezone.localdate()
+        if params.get('start_date') and params.get('end_date'):
+            chart.update(start=params['start_date'], end=params['end_date'])
+        elif filter_type == 'daily':
+            chart.update(start=today.isoformat(), end=today.isoformat())
+        elif filter_type == 'weekly':
+            monday = today - timedelta(days=today.weekday())
+            chart.update(start=monday.isoformat(), end=(monday + timedelta(days=6)).isoformat())
+        elif filter_type == 'monthly':
+            first = today.replace(day=1)
+            last = (first + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+            chart.update(start=first.isoformat(), end=last.isoformat())
+        return chart
+
+    def get_chart(self):
+        start, end, granularity = parse_range(self.chart_params(), default_days=30)
+        series = time_series(
+            UserWalletTransaction.objects.filter(wallet__driver=self.request.user), 'created_at',
+            start, end, granularity,
+            credits=Sum('amount', filter=Q(amount__gt=0)),
+            debits=Sum('amount', filter=Q(amount__lt=0)),
+            transactions=Count('id'),
+        )
+        return series_payload(series, granularity)
+
     def list(self, request, *args, **kwargs):
         queryset = self.get_queryset()
         serializer = self.get_serializer(queryset, many=True)
         wallet = DriverWallet.objects.filter(driver=request.user).first()
         current_balance = wallet.balance if wallet else 0
 
+        data = {
+            "driver": request.user.username,
+            "current_balance": current_balance,
+            "transactions": serializer.data
+        }
+        # Per-bucket credit/debit totals, one grouped query, when a granularity is asked for
+        if request.query_params.get('granularity'):
+            try:
+                data["chart"] = self.get_chart()
+            except ValueError as e:
+                return Response({"StatusCode": "0", "StatusMessage": str(e)}, status=400)
+
         return Response({
             "StatusCode": "1",
             "StatusMessage": "Success",
-            "data": {
-                "driver": request.user.username,
-                "current_balance": current_balance,
-                "transactions": serializer.data
-            }
+            "data": data
         })
 
     
@@ -262,25 +320,37 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from .models import DriverIncentive, DriverIncentiveProgress
+from .incentive_engine import in_windows, current_windows, incentive_rules
 
 class DriverIncentiveProgressView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        # Fetch all incentive rules
-        incentive_rules = DriverIncentive.objects.all().select_related('driver')
-        
+        # Global rules plus this driver's own, with the driver's progress in each rule's current window
+        rules = [
+            rule for rule in incentive_rules.get("all")
+            if rule.driver_id in (None, request.user.id)
+        ]
+        windows = current_windows(rules)
+        progress_by_rule = {}
+        if windows:
+            for progress in DriverIncentiveProgress.objects.filter(driver=request.user).filter(
+                in_windows(windows)
+            ).select_related('incentive_rule'):
+                progress_by_rule[progress.incentive_rule_id] = progress
+
         data = []
-        for rule in incentive_rules:
-            print("ruke",rule)
-            progress = DriverIncentiveProgress.objects.filter(incentive_rule=rule).first()
-            print("progress",progress)
+        for rule in rules:
+            progress = progress_by_rule.get(rule.id)
             rule_data = {
                 'ride_type': rule.ride_type,
                 'min_rides':f"{rule.days}Rides" if rule.days is not None else "N/A",
                 'distance': f"{rule.distance}KM" if rule.distance is not None else "N/A", 
                 'driver_incentive': float(rule.driver_incentive),
-                'details': rule.details
+                'details': rule.details,
+                'period': rule.period,
+                'period_days': rule.period_days,
+                'period_start': windows[rule.id],
             }
             if progress:
                 rule_data.update({
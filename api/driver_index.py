@@ -0,0 +1,217 @@
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from .distance import EARTH_RADIUS_KM, KM_PER_DEGREE_LAT, bounding_box, rank_by_distance
+from .live_location import live_locations
+
+logger = logging.getLogger(__name__)
+
+
+class DriverGridIndex:
+    """
+    Uniform lat/lng grid mapping cell -> set of driver ids.
+
+    Radius and nearest-driver queries only visit the cells that can contain a
+    match instead of scanning every online driver. The index lives in process
+    memory; it is kept current by the location update paths and rebuilt from
+    the live location store every `refresh_seconds` so pings handled by other
+    workers are picked up as well.
+    """
+
+    def __init__(self, cell_size_km=1.0, refresh_seconds=30):
+        self.cell_size_deg = cell_size_km / KM_PER_DEGREE_LAT
+        self.refresh_seconds = refresh_seconds
+        self._cells = {}
+        self._positions = {}
+        self._loaded_at = None
+        self._lock = threading.RLock()
+
+    def _cell(self, lat, lng):
+        return (int(math.floor(lat / self.cell_size_deg)), int(math.floor(lng / self.cell_size_deg)))
+
+    def __len__(self):
+        return len(self._positions)
+
+    # --- Writes ---
+
+    def update(self, driver_id, lat, lng):
+        """Insert or move a driver"""
+        if lat is None or lng is None:
+            return
+        lat, lng = float(lat), float(lng)
+        cell = self._cell(lat, lng)
+        with self._lock:
+            previous = self._positions.get(driver_id)
+            if previous is not None and previous[2] != cell:
+                self._discard_from_cell(driver_id, previous[2])
+            self._positions[driver_id] = (lat, lng, cell)
+            self._cells.setdefault(cell, set()).add(driver_id)
+
+    def remove(self, driver_id):
+        with self._lock:
+            previous = self._positions.pop(driver_id, None)
+            if previous is not None:
+                self._discard_from_cell(driver_id, previous[2])
+
+    def _discard_from_cell(self, driver_id, cell):
+        members = self._cells.get(cell)
+        if members is not None:
+            members.discard(driver_id)
+            if not members:
+                del self._cells[cell]
+
+    def rebuild(self, rows):
+        """Replace the whole index with (driver_id, lat, lng) rows"""
+        cells = {}
+        positions = {}
+        for driver_id, lat, lng in rows:
+            if lat is None or lng is None:
+                continue
+            lat, lng = float(lat), float(lng)
+            cell = self._cell(lat, lng)
+            positions[driver_id] = (lat, lng, cell)
+            cells.setdefault(cell, set()).add(driver_id)
+        with self._lock:
+            self._cells = cells
+            self._positions = positions
+            self._loaded_at = time.monotonic()
+
+    def ensure_fresh(self):
+        """
+        Reload on first use and whenever the index is older than refresh_seconds.
+        Positions come from the live location store; the database is only read
+        when Redis is unreachable.
+        """
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.refresh_seconds:
+            return
+        try:
+            rows = live_locations.positions()
+        except RedisError as e:
+            logger.warning(f"Live location store unavailable, loading driver index from DB: {e}")
+            from .models import User
+
+            rows = (
+                User.objects.filter(is_driver=True, is_online=True)
+                .exclude(current_lat__isnull=True)
+                .exclude(current_lng__isnull=True)
+                .values_list("id", "current_lat", "current_lng")
+            )
+        self.rebuild(rows)
+
+    # --- Queries ---
+
+    def position(self, driver_id):
+        """(lat, lng) last seen for a driver, or None if not indexed"""
+        entry = self._positions.get(driver_id)
+        return entry[:2] if entry is not None else None
+
+    def _cells_in_box(self, box):
+        """
+        Cells that overlap a bounding_box, split in two column ranges when it
+        crosses the antimeridian. When the box spans more cells than are
+        occupied (wide radii, boxes opened up at the poles) the occupied cells
+        are filtered instead of walking the box.
+        """
+        min_lat, max_lat, min_lng, max_lng = box
+        (min_i, min_j), (max_i, max_j) = self._cell(min_lat, min_lng), self._cell(max_lat, max_lng)
+        if min_j <= max_j:
+            columns = [(min_j, max_j)]
+        else:
+            columns = [(min_j, self._cell(0, 180.0)[1]), (self._cell(0, -180.0)[1], max_j)]
+        size = (max_i - min_i + 1) * sum(last - first + 1 for first, last in columns)
+        if size > len(self._cells):
+            return [
+                (i, j) for i, j in self._cells
+                if min_i <= i <= max_i and any(first <= j <= last for first, last in columns)
+            ]
+        return [(i, j) for i in range(min_i, max_i + 1) for first, last in columns for j in range(first, last + 1)]
+
+    def _ring(self, center, ring, lng_scale):
+        """Cells on the square ring `ring` cells away from center (lng widened by lng_scale)"""
+        ci, cj = center
+        lng_ring = ring * lng_scale
+        if ring == 0:
+            for dj in range(-lng_scale + 1, lng_scale):
+                yield (ci, cj + dj)
+            return
+        for di in range(-ring, ring + 1):
+            if abs(di) == ring:
+                for dj in range(-lng_ring - lng_scale + 1, lng_ring + lng_scale):
+                    yield (ci + di, cj + dj)
+            else:
+                for dj in range(lng_ring, lng_ring + lng_scale):
+                    yield (ci + di, cj + dj)
+                    yield (ci + di, cj - dj)
+
+    def _gather(self, cells):
+        """Driver ids and coordinates in the given cells as parallel lists"""
+        ids, lats, lngs = [], [], []
+        for cell in cells:
+            for driver_id in self._cells.get(cell, ()):
+                d_lat, d_lng, _ = self._positions[driver_id]
+                ids.append(driver_id)
+                lats.append(d_lat)
+                lngs.append(d_lng)
+        return ids, lats, lngs
+
+    def within_radius(self, lat, lng, radius_km):
+        """Return [(distance_km, driver_id)] within radius_km, nearest first"""
+        lat, lng = float(lat), float(lng)
+        with self._lock:
+            ids, lats, lngs = self._gather(self._cells_in_box(bounding_box(lat, lng, radius_km)))
+        if not ids:
+            return []
+        indices, distances = rank_by_distance(lat, lng, lats, lngs, radius_km=radius_km)
+        return [(float(dist), ids[i]) for i, dist in zip(indices, distances)]
+
+    def nearest(self, lat, lng, k=1, max_radius_km=None):
+        """
+        Return up to k [(distance_km, driver_id)] nearest first, within
+        max_radius_km when given.
+        Walks outward ring by ring until k drivers are found; the k-th of them
+        bounds the answer, which a radius query out to that distance then
+        settles exactly (including cells beyond the rings' corners or across
+        the antimeridian). Once the rings would visit more cells than are
+        occupied, every indexed driver is ranked instead.
+        """
+        lat, lng = float(lat), float(lng)
+        if max_radius_km is None:
+            # Nothing on the sphere is further away than the antipode
+            max_radius_km = math.pi * EARTH_RADIUS_KM
+        center = self._cell(lat, lng)
+        cos_lat = max(math.cos(math.radians(lat)), 0.01)
+        # Widen each ring along lng so rings stay roughly square in km
+        lng_scale = max(int(math.ceil(1 / cos_lat)), 1)
+        ring_km = self.cell_size_deg * KM_PER_DEGREE_LAT
+        max_ring = int(math.ceil(max_radius_km / ring_km))
+        radius_km = max_radius_km
+        ids, lats, lngs = [], [], []
+        with self._lock:
+            if not self._positions:
+                return []
+            for ring in range(max_ring + 1):
+                everyone = (2 * ring + 1) ** 2 * lng_scale > len(self._cells)
+                if everyone:
+                    ids, lats, lngs = self._gather(list(self._cells))
+                else:
+                    ring_ids, ring_lats, ring_lngs = self._gather(self._ring(center, ring, lng_scale))
+                    ids += ring_ids
+                    lats += ring_lats
+                    lngs += ring_lngs
+                if len(ids) >= k:
+                    _, distances = rank_by_distance(lat, lng, lats, lngs, k=k)
+                    radius_km = min(float(distances[-1]), max_radius_km)
+                    break
+                if everyone:
+                    break
+        return self.within_radius(lat, lng, radius_km)[:k]
+
+driver_index = DriverGridIndex(
+    cell_size_km=settings.DRIVER_INDEX_CELL_KM,
+    refresh_seconds=settings.DRIVER_INDEX_REFRESH_SECONDS,
+)
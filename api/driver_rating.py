@@ -5,6 +5,8 @@ from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
 from .models import Ride, DriverRating
 from .serializers import DriverRatingSerializer
+from .driver_summary import period_totals
+from .rating_aggregate import get_aggregate, recent_ratings, submit_rating
 from django.utils import timezone
 from datetime import datetime, timedelta
 from django.db.models import Sum, Avg, Count
@@ -31,12 +33,8 @@ class SubmitRatingView(APIView):
         if not stars or int(stars) not in range(1, 6):
             return Response({"error": "Stars must be between 1 and 5"}, status=400)
 
-        rating, created = DriverRating.objects.update_or_create(
-            ride=ride,
-            user=request.user,
-            driver=ride.driver,
-            defaults={"stars": stars, "feedback": feedback}
-        )
+        # Rating and the driver's rating aggregate together, re-ratings included
+        rating, created = submit_rating(ride, request.user, int(stars), feedback)
 
         # optional: sync to Ride model fields for backward compatibility
         ride.rating = stars
@@ -49,7 +47,7 @@ class SubmitRatingView(APIView):
 
 
 
-from django.db.models import Avg, Count, F
+from django.db.models import Avg, Count, F, Q
 from .models import Ride
 
 class DriverRatingSummaryView(APIView):
@@ -57,20 +55,15 @@ class DriverRatingSummaryView(APIView):
 
     def get(self, request):
         driver = request.user
-        ratings = DriverRating.objects.filter(driver=driver)
-
-        avg_rating = ratings.aggregate(Avg("stars"))["stars__avg"] or 0
-        total_reviews = ratings.count()
-
-        # Distribution (1–5 stars)
-        distribution = ratings.values("stars").annotate(count=Count("stars"))
-        dist_dict = {i: 0 for i in range(1, 6)}
-        for d in distribution:
-            dist_dict[d["stars"]] = d["count"]
+        # Ratings from the driver's aggregate row
+        aggregate = get_aggregate(driver.id)
 
         # Ride summaries
-        total_rides = Ride.objects.filter(driver=driver).count()
-        completed_rides = Ride.objects.filter(driver=driver, completed=True).count()
+        ride_counts = Ride.objects.filter(driver=driver).aggregate(
+            total=Count("id"), completed=Count("id", filter=Q(completed=True))
+        )
+        total_rides = ride_counts["total"]
+        completed_rides = ride_counts["completed"]
         completion_rate = round((completed_rides / total_rides) * 100, 1) if total_rides else 0
 
         avg_trip_time = (
@@ -91,10 +84,10 @@ class DriverRatingSummaryView(APIView):
         top_destination_name = top_destination["drop"] if top_destination else None
 
         data = {
-            "avg_rating": round(avg_rating, 1),
-            "total_reviews": total_reviews,
-            "distribution": dist_dict,
-            "recent_feedback": DriverRatingSerializer(ratings.order_by("-created_at")[:10], many=True).data,
+            "avg_rating": round(aggregate.average, 1),
+            "total_reviews": aggregate.rating_count,
+            "distribution": aggregate.distribution,
+            "recent_feedback": DriverRatingSerializer(recent_ratings(aggregate), many=True).data,
             "ride_summary": {
                 "total_rides": total_rides,
                 "completion_rate": completion_rate,
@@ -117,28 +110,14 @@ class DriverDashboardAPIView(APIView):
                 status=status.HTTP_403_FORBIDDEN
             )
 
-        # Get today's date range (from midnight to now)
-        today = timezone.now().date()
+        # Today's earnings (sum of fare for completed rides) from the driver's daily summary
+        today = timezone.localdate()
+        today_earnings = period_totals(request.user, {"today": (today, today)})["today"]["fare_total"]
         start_of_day = timezone.make_aware(datetime.combine(today, datetime.min.time()))
         end_of_day = timezone.make_aware(datetime.combine(today, datetime.max.time()))
 
-        # Calculate today's earnings (sum of fare for completed rides)
-        today_earnings = (
-            Ride.objects.filter(
-                driver=request.user,
-                status="completed",
-                completed_at__range=[start_of_day, end_of_day]
-            )
-            .aggregate(total_earnings=Sum("fare"))
-            .get("total_earnings") or 0.0
-        )
-
         # Calculate average rating for the driver
-        avg_rating = (
-            DriverRating.objects.filter(driver=request.user)
-            .aggregate(avg_stars=Avg("stars"))
-            .get("avg_stars") or 0.0
-        )
+        avg_rating = get_aggregate(request.user.id).average
         # Round to 2 decimal places
         avg_rating = round(avg_rating, 2)
 
@@ -0,0 +1,115 @@
+import logging
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .daily_metrics import increment
+from .models import DriverDailySummary, Ride, UserWalletTransaction
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ("rides_completed", "fare_total", "driver_earnings", "refunds")
+CENT = Decimal("0.01")
+
+
+def _money(value):
+    return Decimal(str(value or 0)).quantize(CENT)
+
+
+def record_ride_completed(ride, driver):
+    """Count a completed ride (fare and driver earnings) on the driver's row for its completion day"""
+    day = timezone.localdate(ride.completed_at) if ride.completed_at else timezone.localdate()
+    increment(DriverDailySummary, {"driver_id": driver.id, "date": day}, {
+        "rides_completed": 1,
+        "fare_total": _money(ride.fare),
+        "driver_earnings": _money(ride.driver_earnings),
+    })
+
+
+def record_refund(driver, amount):
+    """Count a refund taken from the driver's wallet on today's row"""
+    increment(DriverDailySummary, {"driver_id": driver.id, "date": timezone.localdate()}, {
+        "refunds": _money(amount),
+    })
+
+
+def period_totals(driver, periods):
+    """
+    {name: {field: total}} for {name: (start, end)} date ranges, summed over
+    the driver's summary rows; one query for all periods.
+    """
+    totals = {name: dict.fromkeys(FIELDS, 0) for name in periods}
+    if not periods:
+        return totals
+    first = min(start for start, _ in periods.values())
+    last = max(end for _, end in periods.values())
+    rows = DriverDailySummary.objects.filter(driver=driver, date__range=(first, last)).values("date", *FIELDS)
+    for row in rows:
+        for name, (start, end) in periods.items():
+            if start <= row["date"] <= end:
+                for field in FIELDS:
+                    totals[name][field] += row[field]
+    return totals
+
+
+def expected_rows(start, end):
+    """{(driver_id, date): {field: value}} for [start, end] recomputed from rides and wallet refunds"""
+    rows = {}
+
+    def add(driver_id, day, values):
+        row = rows.setdefault((driver_id, day), {field: 0 for field in FIELDS})
+        for field, value in values.items():
+            row[field] += value
+
+    completed = Ride.objects.filter(status="completed", driver__isnull=False).annotate(
+        at=Coalesce("completed_at", "updated_at")
+    ).filter(at__date__range=(start, end))
+    for row in completed.values("driver_id", day=TruncDate("at")).annotate(
+        n=Count("id"), fare=Sum("fare"), earnings=Sum("driver_earnings")
+    ):
+        add(row["driver_id"], row["day"], {
+            "rides_completed": row["n"],
+            "fare_total": _money(row["fare"]),
+            "driver_earnings": _money(row["earnings"]),
+        })
+
+    # Refunds are withdrawals (negative amounts) from the driver's own wallet
+    for row in UserWalletTransaction.objects.filter(
+        transaction_type="refund", amount__lt=0, created_at__date__range=(start, end)
+    ).values(driver_id=F("wallet__driver_id"), day=TruncDate("created_at")).annotate(total=Sum("amount")):
+        add(row["driver_id"], row["day"], {"refunds": -_money(row["total"])})
+    return rows
+
+
+def reconcile(start, end, fix=True):
+    """
+    Compare the summary rows of [start, end] with rides and refunds and
+    return the drift as (driver_id, date, field, stored, expected) tuples.
+    With `fix` the range is rebuilt from the recomputed rows.
+    """
+    expected = expected_rows(start, end)
+    stored = {
+        (row["driver_id"], row["date"]): {field: row[field] for field in FIELDS}
+        for row in DriverDailySummary.objects.filter(date__range=(start, end)).values("driver_id", "date", *FIELDS)
+    }
+    zero = dict.fromkeys(FIELDS, 0)
+    drift = []
+    for key in sorted(set(expected) | set(stored)):
+        have, want = stored.get(key, zero), expected.get(key, zero)
+        for field in FIELDS:
+            if have[field] != want[field]:
+                drift.append((*key, field, have[field], want[field]))
+
+    if fix:
+        with transaction.atomic():
+            DriverDailySummary.objects.filter(date__range=(start, end)).delete()
+            DriverDailySummary.objects.bulk_create([
+                DriverDailySummary(driver_id=driver_id, date=day, **values)
+                for (driver_id, day), values in sorted(expected.items())
+            ])
+    if drift:
+        logger.warning(f"Driver summaries drifted in {len(drift)} fields for {start}..{end}")
+    return drift
@@ -0,0 +1,44 @@
+import math
+
+from rest_framework import permissions, status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .fare_tables import quote_all_vehicle_types
+from .utils import calculate_distance
+
+
+class FareQuoteView(APIView):
+    """
+    Fare breakdown for every active vehicle type in one call.
+    Accepts either distance_km or pickup_lat/pickup_lng/drop_lat/drop_lng.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        data = request.data
+        try:
+            if data.get("distance_km") not in (None, ""):
+                distance_km = float(data["distance_km"])
+            else:
+                distance_km = calculate_distance(
+                    data["pickup_lat"], data["pickup_lng"], data["drop_lat"], data["drop_lng"]
+                )
+        except (KeyError, TypeError, ValueError):
+            return Response({
+                "statusCode": "0",
+                "statusMessage": "distance_km or pickup_lat, pickup_lng, drop_lat and drop_lng are required numbers."
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if not math.isfinite(distance_km) or distance_km < 0:
+            return Response({
+                "statusCode": "0",
+                "statusMessage": "distance_km must be a finite, non-negative number."
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        distance_km, quotes = quote_all_vehicle_types(distance_km)
+        return Response({
+            "statusCode": "1",
+            "statusMessage": "Fare quotes retrieved successfully",
+            "distance_km": distance_km,
+            "quotes": [{"vehicle_type": name, **fare} for name, fare in quotes],
+        })
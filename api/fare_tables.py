@@ -0,0 +1,278 @@
+import logging
+from bisect import bisect_right
+from collections import namedtuple
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from redis.exceptions import RedisError
+
+from .local_cache import VersionedLocalCache
+
+logger = logging.getLogger(__name__)
+
+# Totals returned by calculate_fare, in the order the per-slab values are summed
+FARE_KEYS = (
+    "base_fare", "gst_amount", "commission_amount", "driver_earnings",
+    "total_user_pays", "company_revenue", "government_revenue",
+)
+
+# Width of the open-ended last slab, in metres (larger than any real trip)
+OPEN_SLAB_M = 10 ** 9
+
+
+def to_paise(rupees):
+    """Rupees (float, str or Decimal) to whole paise, half-up"""
+    return int((Decimal(str(rupees)) * 100).to_integral_value("ROUND_HALF_UP"))
+
+
+def to_rupees(paise):
+    """Whole paise to an exact 2-place Decimal, ready for a DecimalField or wallet"""
+    return Decimal(int(paise)).scaleb(-2)
+
+
+def to_meters(km):
+    km = Decimal(str(km))
+    if not km.is_finite():
+        raise ValueError(f"distance must be finite, got {km}")
+    return int((km * 1000).to_integral_value("ROUND_HALF_UP"))
+
+
+def _scale(amount, multiplier, unit):
+    """round_half_up(amount * multiplier / unit) for non-negative integers"""
+    return (amount * multiplier + unit // 2) // unit
+
+
+class FareQuote(namedtuple("FareQuote", (
+    "distance_m", "base_fare", "gst_amount", "commission_amount",
+    "driver_earnings", "total_user_pays",
+))):
+    """
+    Fare for one trip with every amount in integer paise.
+
+    total_user_pays == base_fare + gst_amount and
+    base_fare == driver_earnings + commission_amount hold exactly, so
+    what the rider pays is exactly what the driver and admin wallets receive.
+    """
+    __slots__ = ()
+
+    @property
+    def company_revenue(self):
+        return self.commission_amount
+
+    @property
+    def government_revenue(self):
+        return self.gst_amount
+
+    def rupees(self, field):
+        return to_rupees(getattr(self, field))
+
+
+ZERO_QUOTE = FareQuote(0, 0, 0, 0, 0, 0)
+
+
+class FareTable:
+    """
+    FareRule slabs of one vehicle type compiled into parallel sorted lists of
+    integers: slab bounds in metres, rates in paise per km and GST/commission
+    in basis points.
+
+    Slabs are consumed in min_distance order, each covering
+    max_distance - min_distance km (an open-ended slab covers the rest), as the
+    original slab walk did. Every slab's base fare is rounded to the paisa and
+    its GST and commission are taken from that rounded base, so a trip's
+    totals are the exact sum of its slab lines. `prefix` holds the running
+    (base, gst, commission) after each full slab, so a fare is one bisect plus
+    the partial slab.
+    """
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.starts, self.ends, self.widths = [], [], []
+        self.rates, self.gst_bp, self.commission_bp = [], [], []
+        self.labels = []
+        self.prefix = [(0, 0, 0)]
+        self.slabs = []
+
+        covered = 0
+        for rule in self.rules:
+            if rule.max_distance:
+                width = to_meters(rule.max_distance) - to_meters(rule.min_distance)
+            else:
+                width = OPEN_SLAB_M
+            if width <= 0:
+                continue
+            self.starts.append(covered)
+            self.widths.append(width)
+            covered += width
+            self.ends.append(covered)
+            self.rates.append(to_paise(rule.per_km_rate))
+            self.gst_bp.append(to_paise(rule.gst_percentage))
+            self.commission_bp.append(to_paise(rule.commission_percentage))
+            self.labels.append(f"{rule.min_distance}-{rule.max_distance or '∞'} km")
+            if not rule.max_distance:
+                break
+            slab = self._slab(len(self.rates) - 1, width)
+            self.slabs.append(slab)
+            base, gst, commission = self.prefix[-1]
+            self.prefix.append((base + slab[0], gst + slab[1], commission + slab[2]))
+
+    def _slab(self, index, meters):
+        """(base, gst, commission) in paise for `meters` of slab `index`"""
+        base = _scale(meters, self.rates[index], 1000)
+        return (
+            base,
+            _scale(base, self.gst_bp[index], 10000),
+            _scale(base, self.commission_bp[index], 10000),
+        )
+
+    def _locate(self, meters):
+        """(number of full slabs, paise of the partial slab or None, its metres)"""
+        if meters <= 0 or not self.ends:
+            return 0, None, 0
+        full = bisect_right(self.ends, meters)
+        if full < len(self.ends) and meters > self.starts[full]:
+            remaining = meters - self.starts[full]
+            return full, self._slab(full, remaining), remaining
+        return full, None, 0
+
+    def quote_paise(self, distance):
+        """FareQuote in integer paise for `distance` km"""
+        meters = to_meters(distance) if distance > 0 else 0
+        full, partial, _ = self._locate(meters)
+        base, gst, commission = self.prefix[full]
+        if partial is not None:
+            base += partial[0]
+            gst += partial[1]
+            commission += partial[2]
+        return FareQuote(meters, base, gst, commission, base - commission, base + gst)
+
+    def quote(self, distance):
+        """Fare totals (rupees) and slab breakdown for `distance` km, same shape as views.calculate_fare"""
+        meters = to_meters(distance) if distance > 0 else 0
+        full, partial, remaining = self._locate(meters)
+        lines = [(self.labels[i], self.widths[i], self.slabs[i]) for i in range(full)]
+        if partial is not None:
+            lines.append((self.labels[full], remaining, partial))
+        return quote_dict(distance, lines)
+
+
+def quote_dict(distance, lines):
+    """calculate_fare's dict for [(label, metres, (base, gst, commission))] slab lines"""
+    base = sum(line[2][0] for line in lines)
+    gst = sum(line[2][1] for line in lines)
+    commission = sum(line[2][2] for line in lines)
+    paise = (base, gst, commission, base - commission, base + gst, commission, gst)
+    totals = {"distance": distance}
+    for key, value in zip(FARE_KEYS, paise):
+        totals[key] = value / 100
+    totals["breakdown"] = [
+        {"range": label, "distance": meters / 1000, "fare": (slab[0] + slab[1]) / 100}
+        for label, meters, slab in lines
+    ]
+    return totals
+
+
+def _compile(vehicle_type):
+    from .models import FareRule
+    return FareTable(FareRule.objects.filter(vehicle_type=vehicle_type).order_by("min_distance"))
+
+
+fare_tables = VersionedLocalCache("fare_tables", _compile)
+
+
+def get_fare_table(vehicle_type):
+    return fare_tables.get(vehicle_type)
+
+
+def quote_fare(vehicle_type, distance):
+    """FareQuote in integer paise for `distance` km of `vehicle_type`; use this for anything that is charged or posted"""
+    return get_fare_table(vehicle_type).quote_paise(distance)
+
+
+class FareMatrix:
+    """
+    The fare tables of several vehicle types padded into 2-D int64 arrays
+    (one row per vehicle type) so a distance is quoted for all of them in one
+    vectorized pass. Full slabs come from each table's prefix sums and the
+    partial slab uses the same integer rounding, so every quote equals
+    FareTable.quote for the same distance.
+    """
+
+    def __init__(self, names, tables):
+        self.names = list(names)
+        self.tables = list(tables)
+        n = len(self.tables)
+        # One spare column so "all slabs full" still indexes a padding slot
+        width = max([len(table.widths) for table in self.tables] + [0]) + 1
+        padding = np.iinfo(np.int64).max
+        self.ends = np.full((n, width), padding, dtype=np.int64)
+        self.starts = np.full((n, width), padding, dtype=np.int64)
+        self.rates = np.zeros((n, width), dtype=np.int64)
+        self.gst_bp = np.zeros((n, width), dtype=np.int64)
+        self.commission_bp = np.zeros((n, width), dtype=np.int64)
+        for row, table in enumerate(self.tables):
+            count = len(table.widths)
+            self.ends[row, :count] = table.ends
+            self.starts[row, :count] = table.starts
+            self.rates[row, :count] = table.rates
+            self.gst_bp[row, :count] = table.gst_bp
+            self.commission_bp[row, :count] = table.commission_bp
+
+    def quote_all(self, distance):
+        """[(vehicle_type, quote)] for every vehicle type, quote shaped like calculate_fare"""
+        n = len(self.tables)
+        if not n:
+            return []
+        meters = to_meters(distance) if distance > 0 else 0
+        rows = np.arange(n)
+        full = (self.ends <= meters).sum(axis=1)
+        starts = self.starts[rows, full]
+        has_partial = (meters > 0) & (meters > starts)
+        remaining = np.where(has_partial, meters - np.minimum(starts, meters), 0)
+        base = (remaining * self.rates[rows, full] + 500) // 1000
+        gst = (base * self.gst_bp[rows, full] + 5000) // 10000
+        commission = (base * self.commission_bp[rows, full] + 5000) // 10000
+
+        quotes = []
+        for row, (name, table) in enumerate(zip(self.names, self.tables)):
+            slabs = int(full[row])
+            lines = [(table.labels[i], table.widths[i], table.slabs[i]) for i in range(slabs)]
+            if has_partial[row]:
+                lines.append((
+                    table.labels[slabs], int(remaining[row]),
+                    (int(base[row]), int(gst[row]), int(commission[row])),
+                ))
+            quotes.append((name, quote_dict(distance, lines)))
+        return quotes
+
+
+def _compile_matrix(_key):
+    from .models import VehicleType
+    names = list(VehicleType.objects.filter(is_active=True).order_by("name").values_list("name", flat=True))
+    return FareMatrix(names, [get_fare_table(name) for name in names])
+
+
+fare_matrix = VersionedLocalCache("fare_matrix", _compile_matrix)
+
+
+def quote_all_vehicle_types(distance):
+    """
+    Quotes for every active vehicle type, memoized for FARE_QUOTE_CACHE_SECONDS
+    on the distance rounded to FARE_QUOTE_DISTANCE_DECIMALS.
+    """
+    distance = round(float(distance), settings.FARE_QUOTE_DISTANCE_DECIMALS)
+    key = f"fare_quote:{fare_tables.version}:{fare_matrix.version}:{distance}"
+    try:
+        quotes = cache.get(key)
+    except RedisError as e:
+        logger.warning(f"Fare quote cache unavailable, quoting directly: {e}")
+        return distance, fare_matrix.get("all").quote_all(distance)
+    if quotes is None:
+        quotes = fare_matrix.get("all").quote_all(distance)
+        try:
+            cache.set(key, quotes, settings.FARE_QUOTE_CACHE_SECONDS)
+        except RedisError as e:
+            logger.warning(f"Could not cache fare quote for {distance} km: {e}")
+    return distance, quotes
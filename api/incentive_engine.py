@@ -0,0 +1,136 @@
+import logging
+from datetime import timedelta
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .local_cache import VersionedLocalCache
+from .models import DriverIncentive, DriverIncentiveProgress, DriverWallet
+from .utils import get_ride_type
+
+logger = logging.getLogger(__name__)
+
+
+def _load_rules(_key):
+    return list(DriverIncentive.objects.order_by("id"))
+
+
+incentive_rules = VersionedLocalCache("driver_incentives", _load_rules)
+
+
+def matching_incentives(driver_id, distance):
+    """Global rules and the driver's own rules whose get_ride_type interval covers `distance` km"""
+    return [
+        rule for rule in incentive_rules.get("all")
+        if rule.driver_id in (None, driver_id) and get_ride_type(distance, rule) is not None
+    ]
+
+
+def period_start(rule, today):
+    """First day of the window of `rule` that contains `today`; lifetime rules have one window from creation"""
+    if rule.period == "lifetime":
+        return timezone.localdate(rule.created_at)
+    if rule.period == "week":
+        return today - timedelta(days=today.weekday())
+    if rule.period == "days" and rule.period_days:
+        anchor = timezone.localdate(rule.created_at)
+        return anchor + timedelta(days=(today - anchor).days // rule.period_days * rule.period_days)
+    return today
+
+
+def current_windows(rules, today=None):
+    """{rule_id: period_start} of the window each rule is in today"""
+    today = today or timezone.localdate()
+    return {rule.id: period_start(rule, today) for rule in rules}
+
+
+def in_windows(windows):
+    """Q for the progress rows of the given {rule_id: period_start} windows"""
+    by_start = {}
+    for rule_id, start in windows.items():
+        by_start.setdefault(start, []).append(rule_id)
+    return reduce(or_, (
+        Q(incentive_rule_id__in=rule_ids, period_start=start) for start, rule_ids in by_start.items()
+    ))
+
+
+def _target_reached(rule):
+    """Q for progress rows of `rule` that have reached its ride count or distance target"""
+    reached = []
+    if rule.days:
+        reached.append(Q(rides_completed__gte=rule.days))
+    if rule.distance:
+        reached.append(Q(travelled_distance__gte=rule.distance))
+    if not reached:
+        return None
+    return Q(incentive_rule_id=rule.id) & reduce(or_, reached)
+
+
+def update_driver_incentive_progress(driver, ride):
+    """
+    Count a completed ride towards every matching incentive and pay out the
+    ones it completes. Progress is kept per incentive window: the first ride
+    in a new window creates that window's row, so counters and the earned
+    flag start over without any reset job. Progress advances in one
+    set-based UPDATE; rows that reach their target and are not yet earned
+    are locked, flipped to earned and credited in the same transaction, so
+    each payout happens once per window. Returns the incentives paid.
+    """
+    distance = ride.distance_km or 0
+    rules = {rule.id: rule for rule in matching_incentives(driver.id, distance)}
+    if not rules:
+        return []
+    windows = current_windows(rules.values())
+
+    with transaction.atomic():
+        progress = DriverIncentiveProgress.objects.filter(driver=driver).filter(in_windows(windows))
+        existing = set(progress.values_list("incentive_rule_id", flat=True))
+        # A concurrent completion may create the same window row first; the unique constraint keeps one
+        DriverIncentiveProgress.objects.bulk_create([
+            DriverIncentiveProgress(driver=driver, incentive_rule_id=rule_id, period_start=start)
+            for rule_id, start in windows.items() if rule_id not in existing
+        ], ignore_conflicts=True)
+        progress.update(
+            rides_completed=F("rides_completed") + 1,
+            travelled_distance=F("travelled_distance") + distance,
+        )
+
+        targets = [q for q in map(_target_reached, rules.values()) if q is not None]
+        if not targets:
+            return []
+        reached = list(
+            progress.select_for_update()
+            .filter(earned=False).filter(reduce(or_, targets))
+            .values_list("id", "incentive_rule_id")
+        )
+        if not reached:
+            return []
+        DriverIncentiveProgress.objects.filter(id__in=[row_id for row_id, _ in reached]).update(earned=True)
+
+        paid = [rules[rule_id] for rule_id in sorted({rule_id for _, rule_id in reached})]
+        driver_wallet, _ = DriverWallet.objects.get_or_create(driver=driver)
+        for rule in paid:
+            driver_wallet.add_incentive(
+                amount=rule.driver_incentive,
+                transaction_type="driver_incentive",
+                ride=ride,
+                description=f"Incentive completed by Driver #{driver.id} for Ride #{ride.booking_id}"
+            )
+        logger.info(f"Driver {driver.id} earned incentives {[rule.id for rule in paid]} on ride {ride.id}")
+    return paid
+
+
+def prune_incentive_progress(keep_days):
+    """
+    Delete progress rows of windows that started more than `keep_days` days
+    ago (or predate windows). Lifetime rules have a single window that never
+    closes, so their rows are kept.
+    """
+    cutoff = timezone.localdate() - timedelta(days=keep_days)
+    deleted, _ = DriverIncentiveProgress.objects.filter(
+        Q(period_start__lt=cutoff) | Q(period_start__isnull=True)
+    ).exclude(incentive_rule__period="lifetime").delete()
+    return deleted
@@ -0,0 +1,122 @@
+import time
+
+from django.conf import settings
+
+from .redis_client import get_redis
+
+GEO_KEY = "drivers:geo"
+DIRTY_KEY = "drivers:dirty"
+PINGS_KEY = "drivers:stats:pings_received"
+ROWS_KEY = "drivers:stats:rows_written"
+
+
+def _location_key(driver_id):
+    return f"driver:{driver_id}:location"
+
+
+class LiveLocationStore:
+    """
+    Live driver positions kept in Redis instead of MySQL.
+
+    Each ping overwrites a small hash (lat, lng, heading, ts) that expires after
+    LIVE_LOCATION_TTL_SECONDS, adds the driver to a GEO set used for matching
+    (only while they are online), and marks the driver dirty so the periodic
+    flush writes the latest position back to User.current_lat/current_lng.
+    """
+
+    def __init__(self, ttl_seconds):
+        self.ttl_seconds = ttl_seconds
+
+    def update(self, driver_id, lat, lng, heading=None, ts=None, online=True):
+        """Store a ping; an offline driver's position is kept but left out of (or dropped from) the GEO set"""
+        lat, lng = float(lat), float(lng)
+        ts = ts or time.time()
+        mapping = {"lat": lat, "lng": lng, "ts": ts}
+        if heading is not None:
+            mapping["heading"] = float(heading)
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.hset(_location_key(driver_id), mapping=mapping)
+        pipe.expire(_location_key(driver_id), self.ttl_seconds)
+        if online:
+            pipe.geoadd(GEO_KEY, (lng, lat, driver_id))
+        else:
+            pipe.zrem(GEO_KEY, driver_id)
+        pipe.sadd(DIRTY_KEY, driver_id)
+        pipe.incr(PINGS_KEY)
+        pipe.execute()
+
+    def get(self, driver_id):
+        """Latest {lat, lng, heading, ts} for a driver, or None when stale"""
+        data = get_redis().hgetall(_location_key(driver_id))
+        if not data:
+            return None
+        return {key: float(value) for key, value in data.items()}
+
+    def remove(self, driver_id):
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.delete(_location_key(driver_id))
+        pipe.zrem(GEO_KEY, driver_id)
+        pipe.srem(DIRTY_KEY, driver_id)
+        pipe.execute()
+
+    def positions(self):
+        """(driver_id, lat, lng) for every driver in the GEO set"""
+        client = get_redis()
+        members = client.zrange(GEO_KEY, 0, -1)
+        if not members:
+            return []
+        coords = client.geopos(GEO_KEY, *members)
+        return [
+            (int(member), pos[1], pos[0])
+            for member, pos in zip(members, coords)
+            if pos is not None
+        ]
+
+    def take_dirty(self):
+        """
+        Pop the drivers that moved since the last call.
+        Returns {driver_id: {lat, lng, heading, ts}}; drivers whose hash already
+        expired are left out.
+        """
+        client = get_redis()
+        driver_ids = client.spop(DIRTY_KEY, client.scard(DIRTY_KEY) or 1)
+        if not driver_ids:
+            return {}
+        pipe = client.pipeline(transaction=False)
+        for driver_id in driver_ids:
+            pipe.hgetall(_location_key(driver_id))
+        latest = {}
+        for driver_id, data in zip(driver_ids, pipe.execute()):
+            if data:
+                latest[int(driver_id)] = {key: float(value) for key, value in data.items()}
+        return latest
+
+    def mark_dirty(self, driver_ids):
+        """Put drivers back in the dirty set, e.g. after a flush that could not write them"""
+        if driver_ids:
+            get_redis().sadd(DIRTY_KEY, *driver_ids)
+
+    def record_flush(self, rows_written):
+        get_redis().incrby(ROWS_KEY, rows_written)
+
+    def stats(self):
+        """Pings received vs rows written to MySQL since the counters were created"""
+        pings, rows = get_redis().mget(PINGS_KEY, ROWS_KEY)
+        return {"pings_received": int(pings or 0), "rows_written": int(rows or 0)}
+
+    def sweep_stale(self):
+        """Drop drivers whose location hash expired from the GEO set and return their ids"""
+        client = get_redis()
+        members = client.zrange(GEO_KEY, 0, -1)
+        if not members:
+            return []
+        pipe = client.pipeline(transaction=False)
+        for member in members:
+            pipe.exists(_location_key(member))
+        stale = [member for member, alive in zip(members, pipe.execute()) if not alive]
+        if stale:
+            client.zrem(GEO_KEY, *stale)
+        return [int(member) for member in stale]
+
+
+live_locations = LiveLocationStore(ttl_seconds=settings.LIVE_LOCATION_TTL_SECONDS)
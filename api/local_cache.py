@@ -0,0 +1,75 @@
+import logging
+import threading
+import time
+
+from redis.exceptions import RedisError
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+class VersionedLocalCache:
+    """
+    Per-process cache of values built by `loader(key)`, for small read-mostly
+    tables (fare slabs, reward rules) that are read on every request.
+
+    Invalidation bumps a version counter in Redis so every worker process
+    drops its copy; each process checks that counter at most once every
+    `check_seconds`, so a hit costs no database or network round trip. If
+    Redis is unreachable the cache keeps working within the process.
+    """
+
+    def __init__(self, name, loader, check_seconds=5):
+        self.name = name
+        self.loader = loader
+        self.check_seconds = check_seconds
+        self._version_key = f"cache:{name}:version"
+        self._data = {}
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _remote_version(self):
+        try:
+            return get_redis().get(self._version_key)
+        except RedisError as e:
+            logger.warning(f"Cache {self.name}: version check failed: {e}")
+            return self._version
+
+    def _check_version(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_seconds:
+            return
+        self._checked_at = now
+        version = self._remote_version()
+        if version != self._version:
+            with self._lock:
+                self._data = {}
+                self._version = version
+
+    @property
+    def version(self):
+        """Invalidation counter this process currently holds (None before the first invalidation)"""
+        self._check_version()
+        return self._version
+
+    def get(self, key):
+        self._check_version()
+        try:
+            return self._data[key]
+        except KeyError:
+            value = self.loader(key)
+            with self._lock:
+                self._data[key] = value
+            return value
+
+    def invalidate(self):
+        """Drop every cached value here and, through the Redis version, in other processes"""
+        with self._lock:
+            self._data = {}
+        try:
+            self._version = str(get_redis().incr(self._version_key))
+        except RedisError as e:
+            logger.warning(f"Cache {self.name}: could not publish invalidation: {e}")
+        self._checked_at = time.monotonic()
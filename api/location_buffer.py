@@ -0,0 +1,118 @@
+import logging
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.db.models import Case, DateTimeField, FloatField, Value, When
+
+logger = logging.getLogger(__name__)
+
+
+def write_locations(latest, max_batch):
+    """
+    Apply {driver_id: (lat, lng, ts)} to User rows as one
+    UPDATE ... SET current_lat = CASE id WHEN ... END per chunk of max_batch
+    drivers. Returns the number of rows written.
+    """
+    from .models import User
+
+    driver_ids = list(latest)
+    written = 0
+    for start in range(0, len(driver_ids), max_batch):
+        chunk = driver_ids[start:start + max_batch]
+        lat_cases, lng_cases, ts_cases = [], [], []
+        for driver_id in chunk:
+            lat, lng, ts = latest[driver_id]
+            lat_cases.append(When(id=driver_id, then=Value(lat)))
+            lng_cases.append(When(id=driver_id, then=Value(lng)))
+            ts_cases.append(When(id=driver_id, then=Value(datetime.fromtimestamp(ts, tz=dt_timezone.utc))))
+        written += User.objects.filter(id__in=chunk).update(
+            current_lat=Case(*lat_cases, output_field=FloatField()),
+            current_lng=Case(*lng_cases, output_field=FloatField()),
+            last_location_update=Case(*ts_cases, output_field=DateTimeField()),
+        )
+    return written
+
+
+class LocationWriteBuffer:
+    """
+    Coalesces location pings in process memory.
+
+    Only the latest position per driver is kept. The first ping of a window
+    starts a timer that writes the whole window with write_locations after
+    window_seconds, so the last pings are written even if no more arrive;
+    reaching max_batch pending drivers writes it at once. Used when the live
+    location store is unavailable so the database still sees a handful of
+    statements per window instead of one UPDATE per ping.
+    """
+
+    def __init__(self, window_seconds=2.0, max_batch=500):
+        self.window_seconds = window_seconds
+        self.max_batch = max_batch
+        self._pending = {}
+        self._timer = None
+        self._lock = threading.Lock()
+        self.pings_received = 0
+        self.rows_written = 0
+        self.flushes = 0
+
+    def add(self, driver_id, lat, lng, ts=None):
+        """Record a ping; flushes right away once max_batch drivers are pending"""
+        with self._lock:
+            self._pending[driver_id] = (float(lat), float(lng), ts or time.time())
+            self.pings_received += 1
+            if self._timer is None:
+                self._timer = threading.Timer(self.window_seconds, self._flush_on_timer)
+                self._timer.daemon = True
+                self._timer.start()
+            due = len(self._pending) >= self.max_batch
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write every pending position and start a new window"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not pending:
+            return 0
+        try:
+            written = write_locations(pending, self.max_batch)
+        except DatabaseError:
+            # Keep the window for the next flush unless newer pings replaced it
+            with self._lock:
+                self._pending = {**pending, **self._pending}
+            raise
+        with self._lock:
+            self.rows_written += written
+            self.flushes += 1
+        return written
+
+    def _flush_on_timer(self):
+        try:
+            self.flush()
+        except DatabaseError as e:
+            logger.error(f"Buffered location write failed: {e}")
+        finally:
+            # The timer thread opened its own connection
+            connections.close_all()
+
+    def stats(self):
+        """Counters of this process's buffer"""
+        with self._lock:
+            return {
+                "pings_received": self.pings_received,
+                "rows_written": self.rows_written,
+                "flushes": self.flushes,
+                "pending": len(self._pending),
+            }
+
+
+location_buffer = LocationWriteBuffer(
+    window_seconds=settings.LOCATION_WRITE_WINDOW_SECONDS,
+    max_batch=settings.LOCATION_WRITE_MAX_BATCH,
+)
@@ -0,0 +1,36 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api.daily_metrics import first_day, rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild DailyMetric rollups from rides, users and admin wallet transactions. "
+        "Migration 0021 runs it once over all history; run it again for any range whose rollups drifted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=30, help="Rebuild the last N days (default 30)")
+        parser.add_argument("--start", help="First day to rebuild, YYYY-MM-DD")
+        parser.add_argument("--end", help="Last day to rebuild, YYYY-MM-DD (default today)")
+        parser.add_argument("--all", action="store_true", help="Rebuild from the first ride or user sign-up")
+
+    def handle(self, *args, **options):
+        try:
+            end = date.fromisoformat(options["end"]) if options["end"] else timezone.localdate()
+            if options["all"]:
+                start = first_day() or end
+            elif options["start"]:
+                start = date.fromisoformat(options["start"])
+            else:
+                start = end - timedelta(days=options["days"] - 1)
+        except ValueError as e:
+            raise CommandError(f"Invalid date: {e}")
+        if start > end:
+            raise CommandError("--start must not be after --end")
+
+        rows = rebuild(start, end)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} daily metric rows for {start} to {end}"))
@@ -0,0 +1,55 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.batch_dispatch import INFEASIBLE, build_cost_matrix, greedy_assignment, hungarian
+
+
+class Command(BaseCommand):
+    help = "Compare batch (Hungarian) ride assignment with greedy nearest-driver matching on synthetic data"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rides", type=int, default=150)
+        parser.add_argument("--drivers", type=int, default=200)
+        parser.add_argument("--rounds", type=int, default=5)
+        parser.add_argument("--spread-km", type=float, default=20.0, help="Side of the square rides and drivers are scattered over")
+        parser.add_argument("--max-pickup-km", type=float, default=10.0)
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        center_lat, center_lng = 12.9716, 77.5946
+        spread = options["spread_km"] / 111.32 / 2
+        vehicle_types = ["Car", "Car", "Bike", "Auto"]
+
+        def point():
+            return center_lat + rng.uniform(-spread, spread), center_lng + rng.uniform(-spread, spread)
+
+        totals = {"greedy": [0, 0.0, 0.0], "hungarian": [0, 0.0, 0.0]}  # matched, pickup km, seconds
+        for _ in range(options["rounds"]):
+            rides = [(*point(), rng.choice(vehicle_types)) for _ in range(options["rides"])]
+            drivers = [(*point(), rng.choice(vehicle_types)) for _ in range(options["drivers"])]
+            cost = build_cost_matrix(rides, drivers, options["max_pickup_km"])
+            for name, solve in (("greedy", greedy_assignment), ("hungarian", hungarian)):
+                started = time.perf_counter()
+                pairs = [(r, c) for r, c in solve(cost) if cost[r, c] < INFEASIBLE]
+                totals[name][2] += time.perf_counter() - started
+                totals[name][0] += len(pairs)
+                totals[name][1] += sum(cost[r, c] for r, c in pairs)
+
+        self.stdout.write(
+            f"rides={options['rides']} drivers={options['drivers']} rounds={options['rounds']} "
+            f"max_pickup={options['max_pickup_km']}km"
+        )
+        for name, (matched, km, seconds) in totals.items():
+            self.stdout.write(
+                f"{name:10s} matched={matched:5d} pickup_km={km:9.1f} "
+                f"km/ride={km / max(matched, 1):6.3f} time={seconds / options['rounds'] * 1000:8.1f} ms/round"
+            )
+        greedy_avg = totals["greedy"][1] / max(totals["greedy"][0], 1)
+        batch_avg = totals["hungarian"][1] / max(totals["hungarian"][0], 1)
+        self.stdout.write(
+            f"pickup km per matched ride reduced by {(1 - batch_avg / greedy_avg) * 100:.1f}% "
+            f"({totals['hungarian'][0] - totals['greedy'][0]:+d} rides matched)"
+        )
@@ -0,0 +1,78 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.distance import rank_by_distance
+from api.driver_index import DriverGridIndex
+from api.utils import haversine
+
+
+class Command(BaseCommand):
+    help = "Benchmark the driver grid index against the full haversine scan used before it"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--drivers", type=int, default=5000)
+        parser.add_argument("--queries", type=int, default=500)
+        parser.add_argument("--radius", type=float, default=5.0)
+        parser.add_argument("--spread-km", type=float, default=30.0, help="Side of the square drivers are scattered over")
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        center_lat, center_lng = 12.9716, 77.5946
+        spread = options["spread_km"] / 111.32 / 2
+        radius = options["radius"]
+
+        drivers = [
+            (driver_id, center_lat + rng.uniform(-spread, spread), center_lng + rng.uniform(-spread, spread))
+            for driver_id in range(1, options["drivers"] + 1)
+        ]
+        queries = [
+            (center_lat + rng.uniform(-spread, spread), center_lng + rng.uniform(-spread, spread))
+            for _ in range(options["queries"])
+        ]
+
+        index = DriverGridIndex()
+        started = time.perf_counter()
+        index.rebuild(drivers)
+        build_ms = (time.perf_counter() - started) * 1000
+
+        # Full scan, as get_nearby_driver_tokens / get_nearest_driver_distance did per booking
+        started = time.perf_counter()
+        scan_radius, scan_nearest = [], []
+        for lat, lng in queries:
+            dists = [(haversine(lat, lng, d_lat, d_lng), driver_id) for driver_id, d_lat, d_lng in drivers]
+            scan_radius.append(sorted(match for match in dists if match[0] <= radius))
+            scan_nearest.append(min(dists))
+        scan_s = time.perf_counter() - started
+
+        # Same full scan through the vectorized kernel
+        ids, lats, lngs = zip(*drivers)
+        started = time.perf_counter()
+        for lat, lng in queries:
+            rank_by_distance(lat, lng, lats, lngs, radius_km=radius)
+            rank_by_distance(lat, lng, lats, lngs, k=1)
+        numpy_scan_s = time.perf_counter() - started
+
+        started = time.perf_counter()
+        grid_radius = [index.within_radius(lat, lng, radius) for lat, lng in queries]
+        grid_radius_s = time.perf_counter() - started
+
+        started = time.perf_counter()
+        grid_nearest = [index.nearest(lat, lng, k=1)[0] for lat, lng in queries]
+        grid_nearest_s = time.perf_counter() - started
+
+        radius_ok = all(
+            [d for _, d in a] == [d for _, d in b] for a, b in zip(scan_radius, grid_radius)
+        )
+        nearest_ok = all(a[1] == b[1] for a, b in zip(scan_nearest, grid_nearest))
+
+        per_query = lambda seconds: seconds / len(queries) * 1000
+        self.stdout.write(f"drivers={len(drivers)} queries={len(queries)} radius={radius}km")
+        self.stdout.write(f"index build:              {build_ms:.1f} ms")
+        self.stdout.write(f"full scan (radius+nearest): {per_query(scan_s):.3f} ms/query")
+        self.stdout.write(f"numpy full scan:          {per_query(numpy_scan_s):.3f} ms/query")
+        self.stdout.write(f"grid radius query:        {per_query(grid_radius_s):.3f} ms/query")
+        self.stdout.write(f"grid nearest query:       {per_query(grid_nearest_s):.3f} ms/query")
+        self.stdout.write(f"results match full scan:  radius={radius_ok} nearest={nearest_ok}")
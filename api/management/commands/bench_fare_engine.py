@@ -0,0 +1,78 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.fare_tables import FARE_KEYS, FareTable
+from api.models import FareRule
+
+
+def legacy_quote(rules, distance):
+    """The float slab walk calculate_fare used before fare tables, with the int() casts of the booking path"""
+    totals = dict.fromkeys(FARE_KEYS, 0)
+    remaining = distance
+    for rule in rules:
+        if remaining <= 0:
+            break
+        max_dist = rule.max_distance if rule.max_distance else remaining + rule.min_distance
+        applicable = min(remaining, max_dist - rule.min_distance)
+        if applicable <= 0:
+            continue
+        slab = rule.calculate_fare(applicable)
+        for key in FARE_KEYS:
+            totals[key] += slab[key]
+        remaining -= applicable
+    return {key: int(value) for key, value in totals.items()}
+
+
+class Command(BaseCommand):
+    help = "Time the integer-paise fare engine against the float slab walk and report how far the old int() casts drift"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--quotes", type=int, default=100000)
+        parser.add_argument("--slabs", type=int, default=4)
+        parser.add_argument("--max-km", type=float, default=60.0)
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        rules, start = [], 0
+        for index in range(options["slabs"]):
+            end = None if index == options["slabs"] - 1 else start + rng.choice([2, 3, 5, 7.5])
+            rules.append(FareRule(
+                vehicle_type="Bench", min_distance=start, max_distance=end,
+                per_km_rate=rng.choice([9.5, 12, 14.75, 18]),
+                gst_percentage=rng.choice([5, 12, 18]),
+                commission_percentage=rng.choice([10, 12.5, 20]),
+            ))
+            start = end
+        table = FareTable(rules)
+        distances = [round(rng.uniform(0.1, options["max_km"]), 2) for _ in range(options["quotes"])]
+
+        timings = {}
+        for name, quote in (
+            ("float walk", lambda d: legacy_quote(rules, d)),
+            ("table dict", table.quote),
+            ("table paise", table.quote_paise),
+        ):
+            started = time.perf_counter()
+            for distance in distances:
+                quote(distance)
+            timings[name] = time.perf_counter() - started
+
+        # Rupees the old casts lost: fare charged minus what was posted to the wallets
+        leaked = 0
+        unbalanced = 0
+        for distance in distances:
+            old = legacy_quote(rules, distance)
+            leaked += old["total_user_pays"] - (old["driver_earnings"] + old["commission_amount"] + old["gst_amount"])
+            new = table.quote_paise(distance)
+            unbalanced += new.total_user_pays != new.driver_earnings + new.commission_amount + new.gst_amount
+
+        self.stdout.write(f"quotes={options['quotes']} slabs={options['slabs']} max_km={options['max_km']}")
+        for name, seconds in timings.items():
+            self.stdout.write(f"{name:12s} {seconds / len(distances) * 1e6:8.2f} us/quote")
+        self.stdout.write(
+            f"float walk: ₹{leaked} charged but never posted to a wallet; "
+            f"paise engine: {unbalanced} unbalanced quotes"
+        )
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from api.rating_aggregate import rebuild_rating_aggregates
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute DriverRatingAggregate rows from DriverRating. "
+        "Run once after deploying, and again if an aggregate looks wrong."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--driver", type=int, action="append", help="Only this driver id (repeatable)")
+
+    def handle(self, *args, **options):
+        written = rebuild_rating_aggregates(options["driver"])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} driver rating aggregates"))
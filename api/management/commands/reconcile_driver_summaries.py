@@ -0,0 +1,48 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+
+from api.driver_summary import reconcile
+from api.models import Ride
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare DriverDailySummary rows with completed rides and driver wallet refunds, "
+        "report any drift and rebuild the range. Run with --all after deploying."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=31, help="Reconcile the last N days (default 31)")
+        parser.add_argument("--start", help="First day to reconcile, YYYY-MM-DD")
+        parser.add_argument("--end", help="Last day to reconcile, YYYY-MM-DD (default today)")
+        parser.add_argument("--all", action="store_true", help="Reconcile from the first ride")
+        parser.add_argument("--check", action="store_true", help="Only report drift, do not rebuild")
+        parser.add_argument("--show", type=int, default=50, help="Print at most N drifted fields (default 50)")
+
+    def handle(self, *args, **options):
+        try:
+            end = date.fromisoformat(options["end"]) if options["end"] else timezone.localdate()
+            if options["all"]:
+                first = Ride.objects.aggregate(first=Min("created_at"))["first"]
+                start = timezone.localdate(first) if first else end
+            elif options["start"]:
+                start = date.fromisoformat(options["start"])
+            else:
+                start = end - timedelta(days=options["days"] - 1)
+        except ValueError as e:
+            raise CommandError(f"Invalid date: {e}")
+        if start > end:
+            raise CommandError("--start must not be after --end")
+
+        drift = reconcile(start, end, fix=not options["check"])
+        for driver_id, day, field, stored, expected in drift[:options["show"]]:
+            self.stdout.write(f"Driver #{driver_id} {day} {field}: stored {stored}, expected {expected}")
+        if len(drift) > options["show"]:
+            self.stdout.write(f"... and {len(drift) - options['show']} more")
+
+        action = "checked" if options["check"] else "rebuilt"
+        message = f"Driver summaries {action} for {start} to {end}: {len(drift)} drifted fields"
+        self.stdout.write(self.style.WARNING(message) if drift else self.style.SUCCESS(message))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_alter_user_plate_number'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['is_driver', 'is_online', 'is_available', 'current_lat', 'current_lng'], name='user_driver_match_idx'),
+        ),
+    ]
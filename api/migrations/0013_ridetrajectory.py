@@ -0,0 +1,26 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_user_user_driver_match_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RideTrajectory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('polyline', models.TextField(blank=True, default='')),
+                ('point_count', models.PositiveIntegerField(default=0)),
+                ('distance_km', models.FloatField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('ride', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='trajectory', to='api.ride')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_ridetrajectory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ride',
+            name='measured_distance_km',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
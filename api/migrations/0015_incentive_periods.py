@@ -0,0 +1,27 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_ride_measured_distance_km'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='driverincentive',
+            name='period',
+            field=models.CharField(choices=[('day', 'Daily'), ('week', 'Weekly (Monday to Sunday)'), ('days', 'Every `days` days from creation')], default='day', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='driverincentiveprogress',
+            name='period_start',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='driverincentiveprogress',
+            index=models.Index(fields=['driver', 'incentive_rule', 'period_start'], name='api_driveri_driver__d75f9f_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:53
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_incentive_periods'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AdminWalletShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveSmallIntegerField()),
+                ('balance', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('total_commission', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('total_gst', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='api.adminwallet')),
+            ],
+            options={
+                'unique_together': {('wallet', 'index')},
+            },
+        ),
+    ]
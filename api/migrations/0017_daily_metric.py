@@ -0,0 +1,34 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:56
+
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_admin_wallet_shards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyMetric',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('vehicle_type', models.CharField(blank=True, default='', max_length=50)),
+                ('rides_created', models.IntegerField(default=0)),
+                ('rides_completed', models.IntegerField(default=0)),
+                ('rides_cancelled', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('commission', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('gst', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('new_users', models.IntegerField(default=0)),
+                ('new_drivers', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['date', 'vehicle_type'],
+                'unique_together': {('date', 'vehicle_type')},
+            },
+        ),
+    ]
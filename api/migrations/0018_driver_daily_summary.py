@@ -0,0 +1,32 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:03
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_daily_metric'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DriverDailySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('rides_completed', models.IntegerField(default=0)),
+                ('fare_total', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('driver_earnings', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('refunds', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('driver', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_summaries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['driver', 'date'],
+                'unique_together': {('driver', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_driver_daily_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DriverRatingAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rating_count', models.IntegerField(default=0)),
+                ('stars_sum', models.IntegerField(default=0)),
+                ('stars_1', models.IntegerField(default=0)),
+                ('stars_2', models.IntegerField(default=0)),
+                ('stars_3', models.IntegerField(default=0)),
+                ('stars_4', models.IntegerField(default=0)),
+                ('stars_5', models.IntegerField(default=0)),
+                ('recent_rating_ids', models.JSONField(blank=True, default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('driver', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='rating_aggregate', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:17
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def split_window_length(apps, schema_editor):
+    """
+    `days` was both the ride-count target and the window length of 'days'
+    rules; keep the length those rules had in period_days. Lifetime rules
+    count in a single window dated from their creation, so their progress
+    rows (period_start still NULL from before windows) move into it. Any
+    duplicate rows for one window keep the most progressed and the rest go,
+    so the unique constraint can be added.
+    """
+    DriverIncentive = apps.get_model('api', 'DriverIncentive')
+    DriverIncentiveProgress = apps.get_model('api', 'DriverIncentiveProgress')
+    DriverIncentive.objects.filter(period='days', period_days__isnull=True).update(period_days=models.F('days'))
+    for rule in DriverIncentive.objects.filter(period='lifetime'):
+        DriverIncentiveProgress.objects.filter(incentive_rule=rule, period_start__isnull=True).update(
+            period_start=timezone.localdate(rule.created_at)
+        )
+
+    seen = set()
+    duplicates = []
+    rows = DriverIncentiveProgress.objects.order_by('-earned', '-rides_completed', '-travelled_distance', 'id')
+    for row_id, *key in rows.values_list('id', 'driver_id', 'incentive_rule_id', 'period_start'):
+        key = tuple(key)
+        if key in seen:
+            duplicates.append(row_id)
+        seen.add(key)
+    DriverIncentiveProgress.objects.filter(id__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_driver_rating_aggregate'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='driverincentiveprogress',
+            name='api_driveri_driver__d75f9f_idx',
+        ),
+        migrations.AddField(
+            model_name='driverincentive',
+            name='period_days',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(split_window_length, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='driverincentiveprogress',
+            constraint=models.UniqueConstraint(fields=('driver', 'incentive_rule', 'period_start'), name='unique_incentive_window'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations
+from django.utils import timezone
+
+
+def backfill(apps, schema_editor):
+    """Build the DailyMetric rollups for all history, as backfill_daily_metrics --all does"""
+    from api.daily_metrics import first_day, rebuild
+    start = first_day(apps)
+    if start is not None:
+        rebuild(start, timezone.localdate(), apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_incentive_window_constraint'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
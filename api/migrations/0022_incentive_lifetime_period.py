@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_backfill_daily_metrics'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='driverincentive',
+            name='period',
+            field=models.CharField(choices=[('lifetime', 'Lifetime (never resets)'), ('day', 'Daily'), ('week', 'Weekly (Monday to Sunday)'), ('days', 'Every `period_days` days from creation')], default='day', max_length=10),
+        ),
+    ]
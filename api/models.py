@@ -50,6 +50,15 @@ class User(AbstractUser):
     )
     suspended_until = models.DateTimeField(null=True, blank=True)
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Nearby-driver lookups: equality on the flags, range on the position
+            models.Index(
+                fields=["is_driver", "is_online", "is_available", "current_lat", "current_lng"],
+                name="user_driver_match_idx",
+            ),
+        ]
+
     @property
     def is_suspended(self):
         """Check if user is currently suspended and auto-reactivate if expired"""
@@ -87,6 +96,7 @@ class Ride(models.Model):
     pickup_mode = models.CharField(max_length=10, default="NOW", choices=[("NOW", "now"), ("LATER", "later")])
     pickup_time = models.DateTimeField(default=timezone.now)
     distance_km = models.FloatField(default=0)  
+    measured_distance_km = models.FloatField(null=True, blank=True)  # from the GPS trace, see trip_distance
     vehicle_type = models.CharField(max_length=20,default='Car')
     payment_type = models.CharField(max_length=20, null=True, blank=True)
     fare = models.FloatField(default=0)  
@@ -118,6 +128,40 @@ class Ride(models.Model):
         return f"Ride {self.id} - {self.user.username} ({self.status})"
 
 
+class RideTrajectory(models.Model):
+    """GPS path of a ride stored as one encoded polyline instead of a row per point"""
+    ride = models.OneToOneField(Ride, on_delete=models.CASCADE, related_name='trajectory')
+    polyline = models.TextField(blank=True, default='')
+    point_count = models.PositiveIntegerField(default=0)
+    distance_km = models.FloatField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def points(self):
+        from .trajectory import decode_polyline
+        return decode_polyline(self.polyline)
+
+    def append_points(self, points):
+        """
+        Extend the stored path with a segment (saved whenever the consumer's
+        buffer fills, and when a driver reconnects mid-ride); the new points
+        are encoded onto the end of the polyline.
+        """
+        from .trajectory import encode_polyline, path_distance_km
+        points = list(points)
+        if not points:
+            return
+        stored = self.points()
+        self.polyline += encode_polyline(points, start=stored[-1] if stored else None)
+        path = stored + points
+        self.point_count = len(path)
+        self.distance_km = round(path_distance_km(path), 3)
+        self.save()
+
+    def __str__(self):
+        return f"Trajectory for Ride {self.ride_id} ({self.point_count} points)"
+
+
 
 class DriverLocation(models.Model):
     driver = models.OneToOneField(User, on_delete=models.CASCADE, related_name='location')
@@ -259,12 +303,24 @@ class DriverIncentive(models.Model):
         null=True, blank=True,
         related_name="incentives"
     )
+    PERIOD_CHOICES = [
+        ('lifetime', 'Lifetime (never resets)'),
+        ('day', 'Daily'),
+        ('week', 'Weekly (Monday to Sunday)'),
+        ('days', 'Every `period_days` days from creation'),
+    ]
+
     ride_type = models.CharField(max_length=20)
     distance = models.FloatField(null=True, blank=True)
     max_distance = models.FloatField(null=True, blank=True)
     rides_count = models.IntegerField(null=True, blank=True)
+    # Ride-count target (exposed as min_rides), not a number of days
     days = models.IntegerField(null=True, blank=True)
     driver_incentive = models.DecimalField(max_digits=10, decimal_places=2)
+    # Window progress is counted in; each window gets its own progress row
+    period = models.CharField(max_length=10, choices=PERIOD_CHOICES, default='day')
+    # Window length for period 'days'
+    period_days = models.PositiveIntegerField(null=True, blank=True)
     details = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -365,64 +421,17 @@ class DriverWallet(models.Model):
 
     def deposit(self, amount, description="Deposit", transaction_type="deposit"):
         """Add amount to wallet safely and log transaction"""
-        if not isinstance(self.balance, Decimal):
-            self.balance = Decimal(self.balance)
-        if not isinstance(amount, Decimal):
-            amount = Decimal(amount)
-
-        self.balance += amount
-        self.save(update_fields=["balance", "updated_at"])
-        
-        # Log transaction
-        UserWalletTransaction.objects.create(
-            wallet=self,
-            transaction_type=transaction_type,
-            amount=amount,
-            description=description,
-            balance_after=self.balance
-        )
-        
-        return self.balance
+        from .wallet_ledger import credit
+        return credit(self, amount, transaction_type, description)
 
     def withdraw(self, amount, description="Withdrawal", transaction_type="withdrawal"):
-        if not isinstance(self.balance, Decimal):
-            self.balance = Decimal(self.balance)
-        if not isinstance(amount, Decimal):
-            amount = Decimal(amount)
-
-        if self.balance >= amount:
-            self.balance -= amount
-            self.save(update_fields=["balance", "updated_at"])
-            # Log transaction
-            UserWalletTransaction.objects.create(
-                wallet=self,
-                transaction_type=transaction_type,
-                amount=-amount,  
-                description=description,
-                balance_after=self.balance
-            )
-            
-            return self.balance
-        raise ValueError("Insufficient balance")
+        from .wallet_ledger import debit
+        return debit(self, amount, transaction_type, description)
     
     def add_incentive(self, amount,transaction_type ,ride=None, description="Driver Incentive"):
-        if not isinstance(amount, Decimal):
-            amount = Decimal(amount)
-
-        self.balance += amount
-        self.save(update_fields=["balance", "updated_at"])
-
-        # Log transaction
-        UserWalletTransaction.objects.create(
-            wallet=self,
-            transaction_type=transaction_type,  # or "cashback"
-            amount=amount,
-            description=description,
-            balance_after=self.balance,
-            related_ride=ride if ride else None
-        )
+        from .wallet_ledger import credit
+        return credit(self, amount, transaction_type, description, related_ride=ride)
 
-        return self.balance
     def add_cashback(self, amount, ride, description="Cashback Reward"):
         """
         Add a cashback amount to the driver's wallet.
@@ -430,23 +439,8 @@ class DriverWallet(models.Model):
             - Cashback on ride completion
             - Promotional wallet recharge cashback
         """
-        if not isinstance(amount, Decimal):
-            amount = Decimal(amount)
-
-        self.balance += amount
-        self.save(update_fields=["balance", "updated_at"])
-
-        # Log transaction
-        UserWalletTransaction.objects.create(
-            wallet=self,
-            transaction_type="cashback",
-            amount=amount,
-            description=description,
-            balance_after=self.balance,
-            related_ride=ride if ride else None
-        )
-
-        return self.balance
+        from .wallet_ledger import credit
+        return credit(self, amount, "cashback", description, related_ride=ride)
 
     def __str__(self):
         return f"{self.driver.username}'s Wallet - Balance: {self.balance}"
@@ -494,7 +488,14 @@ class DriverIncentiveProgress(models.Model):
     rides_completed = models.IntegerField(default=0)
     earned = models.BooleanField(default=False)
     start_date = models.DateField(auto_now_add=True)
-    
+    # First day of the incentive window this row counts (see DriverIncentive.period)
+    period_start = models.DateField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['driver', 'incentive_rule', 'period_start'], name='unique_incentive_window'),
+        ]
+
     @property
     def progress_percent(self):
         target = self.incentive_rule.days or 1
@@ -524,95 +525,79 @@ class AdminWallet(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     def deposit(self, amount, description="Deposit", transaction_type="deposit"):
-        if not isinstance(amount, Decimal):
-            amount = Decimal(amount)
-        self.balance += amount
-        self.save(update_fields=["balance", "updated_at"])
-        AdminWalletTransaction.objects.create(
-            wallet=self,
-            transaction_type=transaction_type,
-            amount=amount,
-            description=description,
-            balance_after=self.balance
-        )
-        return self.balance
+        from .wallet_ledger import credit
+        return credit(self, amount, transaction_type, description)
 
     def withdraw(self, amount, description="Withdrawal", transaction_type="withdrawal"):
-        if not isinstance(amount, Decimal):
-            amount = Decimal(amount)
-        if self.balance >= amount:
-            self.balance -= amount
-            self.save(update_fields=["balance", "updated_at"])
-            AdminWalletTransaction.objects.create(
-                wallet=self,
-                transaction_type=transaction_type,
-                amount=-amount,
-                description=description,
-                balance_after=self.balance
-            )
-            return self.balance
-        raise ValueError("Insufficient balance")
+        from .wallet_ledger import debit
+        return debit(self, amount, transaction_type, description)
 
     def collect_commission(self, amount, ride=None, description="Commission Collected"):
-        if not isinstance(amount, Decimal):
-            amount = Decimal(amount)
-        self.total_commission += amount
-        self.balance += amount
-        self.save(update_fields=["balance", "total_commission", "updated_at"])
-        AdminWalletTransaction.objects.create(
-            wallet=self,
-            transaction_type="commission",
-            amount=amount,
-            description=description,
-            balance_after=self.balance,
-            related_ride=ride
+        from .wallet_ledger import credit
+        return credit(
+            self, amount, "commission", description,
+            totals={"total_commission": amount}, related_ride=ride
         )
-        return self.balance
 
     def collect_gst(self, amount, ride=None, description="GST Collected"):
-        if not isinstance(amount, Decimal):
-            amount = Decimal(amount)
-        self.total_gst += amount
-        self.balance += amount
-        self.save(update_fields=["balance", "total_gst", "updated_at"])
-        AdminWalletTransaction.objects.create(
-            wallet=self,
-            transaction_type="gst",
-            amount=amount,
-            description=description,
-            balance_after=self.balance,
-            related_ride=ride
+        from .wallet_ledger import credit
+        return credit(
+            self, amount, "gst", description,
+            totals={"total_gst": amount}, related_ride=ride
         )
-        return self.balance
+
+    def totals(self):
+        """balance, total_commission and total_gst including the uncompacted shards"""
+        from .wallet_ledger import admin_wallet_totals
+        return admin_wallet_totals(self)
 
     def refund_to_user(self, amount, user_wallet, description="Refund", ride=None, refund_gst=Decimal("0.00"), refund_commission=Decimal("0.00")):
         """Refund from admin wallet to user wallet, optionally splitting GST + commission"""
-        if not isinstance(amount, Decimal):
-            amount = Decimal(amount)
-
-        # Deduct GST and Commission from admin wallet
-        if refund_commission > 0:
-            self.total_commission -= refund_commission
-        if refund_gst > 0:
-            self.total_gst -= refund_gst
-
-        self.withdraw(
-            amount=amount,
-            description=f"Refund to {user_wallet.driver.username}: {description}",
-            transaction_type="refund_payout"
-        )
+        from django.db import transaction
+        from .wallet_ledger import debit
+
+        with transaction.atomic():
+            # Deduct GST and Commission from admin wallet
+            balance = debit(
+                self, amount, "refund_payout",
+                f"Refund to {user_wallet.driver.username}: {description}",
+                totals={
+                    "total_commission": -max(refund_commission, Decimal("0.00")),
+                    "total_gst": -max(refund_gst, Decimal("0.00")),
+                },
+            )
 
-        # Deposit into user wallet
-        user_wallet.deposit(
-            amount=amount,
-            description=f"Refund: {description}",
-            transaction_type="refund"
-        )
-        return self.balance
+            # Deposit into user wallet
+            user_wallet.deposit(
+                amount=amount,
+                description=f"Refund: {description}",
+                transaction_type="refund"
+            )
+        return balance
 
     def __str__(self):
         return f"{self.name} - Balance: ₹{self.balance}"
 
+class AdminWalletShard(models.Model):
+    """
+    One stripe of an AdminWallet's running totals. Credits go to a random
+    shard so concurrent ride completions do not all update the one wallet
+    row; the wallet's true totals are its own columns plus the sum of its
+    shards, and compact_admin_wallets() periodically folds shards back in.
+    """
+    wallet = models.ForeignKey(AdminWallet, on_delete=models.CASCADE, related_name='shards')
+    index = models.PositiveSmallIntegerField()
+    balance = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal("0.00"))
+    total_commission = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal("0.00"))
+    total_gst = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal("0.00"))
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('wallet', 'index')
+
+    def __str__(self):
+        return f"{self.wallet.name} shard {self.index} - ₹{self.balance}"
+
 class AdminWalletTransaction(models.Model):
     TRANSACTION_TYPES = [
         ('deposit', 'Deposit'),
@@ -663,3 +648,81 @@ class CancellationPolicy(models.Model):
 
     def __str__(self):
         return f"Charge: {self.charge_amount}, Free cancellations: {self.free_cancellations}"
+
+
+class DailyMetric(models.Model):
+    """
+    Per-day (and per ride vehicle_type) counters behind the admin dashboard,
+    kept current by api.daily_metrics and rebuilt by backfill_daily_metrics.
+    Rows with vehicle_type "" hold events with no vehicle type (user sign-ups,
+    revenue not tied to a ride).
+    """
+    date = models.DateField()
+    vehicle_type = models.CharField(max_length=50, blank=True, default='')
+    rides_created = models.IntegerField(default=0)
+    rides_completed = models.IntegerField(default=0)
+    rides_cancelled = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
+    commission = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
+    gst = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
+    new_users = models.IntegerField(default=0)
+    new_drivers = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('date', 'vehicle_type')
+        ordering = ['date', 'vehicle_type']
+
+    def __str__(self):
+        return f"{self.date} {self.vehicle_type or 'all'}: {self.rides_completed} rides, ₹{self.revenue}"
+
+
+class DriverDailySummary(models.Model):
+    """
+    Per-driver, per-day completed trips and earnings behind the driver
+    earnings and dashboard endpoints, kept current by api.driver_summary on
+    ride completion and refund and rebuilt by reconcile_driver_summaries.
+    Refunds are counted on the day they were taken from the driver's wallet.
+    """
+    driver = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_summaries')
+    date = models.DateField()
+    rides_completed = models.IntegerField(default=0)
+    fare_total = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal("0.00"))
+    driver_earnings = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal("0.00"))
+    refunds = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal("0.00"))
+
+    class Meta:
+        unique_together = ('driver', 'date')
+        ordering = ['driver', 'date']
+
+    def __str__(self):
+        return f"Driver #{self.driver_id} {self.date}: {self.rides_completed} rides, ₹{self.fare_total}"
+
+
+class DriverRatingAggregate(models.Model):
+    """
+    Running totals of a driver's DriverRating rows, kept by
+    api.rating_aggregate when a rating is submitted or changed and rebuilt
+    by rebuild_rating_aggregates. recent_rating_ids holds the newest
+    ratings' ids, newest first.
+    """
+    driver = models.OneToOneField(User, on_delete=models.CASCADE, related_name='rating_aggregate')
+    rating_count = models.IntegerField(default=0)
+    stars_sum = models.IntegerField(default=0)
+    stars_1 = models.IntegerField(default=0)
+    stars_2 = models.IntegerField(default=0)
+    stars_3 = models.IntegerField(default=0)
+    stars_4 = models.IntegerField(default=0)
+    stars_5 = models.IntegerField(default=0)
+    recent_rating_ids = models.JSONField(default=list, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def average(self):
+        return self.stars_sum / self.rating_count if self.rating_count else 0
+
+    @property
+    def distribution(self):
+        return {stars: getattr(self, f"stars_{stars}") for stars in range(1, 6)}
+
+    def __str__(self):
+        return f"Driver #{self.driver_id}: {self.average:.2f} over {self.rating_count} ratings"
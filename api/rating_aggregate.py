@@ -0,0 +1,115 @@
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from .models import DriverRating, DriverRatingAggregate
+
+logger = logging.getLogger(__name__)
+
+
+def lock_aggregate(driver_id):
+    """The driver's aggregate row, created if missing and locked until the transaction ends"""
+    DriverRatingAggregate.objects.get_or_create(driver_id=driver_id)
+    return DriverRatingAggregate.objects.select_for_update().get(driver_id=driver_id)
+
+
+def apply_rating(aggregate, rating, previous_stars=None):
+    """
+    Count `rating` on the locked `aggregate`: a new rating adds to the
+    count, sum and its star bucket; a re-rating (previous_stars given) moves
+    the difference and switches buckets. New ratings go to the front of the
+    recent feedback; re-ratings keep their place.
+    """
+    stars = int(rating.stars)
+    if previous_stars is None:
+        aggregate.rating_count += 1
+        aggregate.stars_sum += stars
+        recent = [rating.id] + [rating_id for rating_id in aggregate.recent_rating_ids if rating_id != rating.id]
+        aggregate.recent_rating_ids = recent[:settings.DRIVER_RATING_RECENT_FEEDBACK]
+    else:
+        aggregate.stars_sum += stars - previous_stars
+        field = f"stars_{previous_stars}"
+        setattr(aggregate, field, getattr(aggregate, field) - 1)
+    field = f"stars_{stars}"
+    setattr(aggregate, field, getattr(aggregate, field) + 1)
+    aggregate.save()
+    return aggregate
+
+
+def submit_rating(ride, user, stars, feedback=""):
+    """
+    Create or update the rating of `ride` and its driver's aggregate in one
+    transaction. The aggregate row is locked first, so concurrent ratings of
+    the same driver apply one after another, and the previous stars of a
+    re-rating are read under that lock. Returns (rating, created).
+    """
+    with transaction.atomic():
+        aggregate = lock_aggregate(ride.driver_id)
+        previous_stars = DriverRating.objects.filter(ride=ride).values_list("stars", flat=True).first()
+        rating, created = DriverRating.objects.update_or_create(
+            ride=ride,
+            user=user,
+            driver=ride.driver,
+            defaults={"stars": stars, "feedback": feedback}
+        )
+        apply_rating(aggregate, rating, None if created else previous_stars)
+    return rating, created
+
+
+def get_aggregate(driver_id):
+    """The driver's aggregate, built from their ratings on first use (e.g. before any backfill)"""
+    aggregate = DriverRatingAggregate.objects.filter(driver_id=driver_id).first()
+    if aggregate is None:
+        rebuild_rating_aggregates([driver_id])
+        aggregate = DriverRatingAggregate.objects.get(driver_id=driver_id)
+    return aggregate
+
+
+def recent_ratings(aggregate):
+    """The aggregate's recent DriverRating rows, newest first, in one query"""
+    ratings = DriverRating.objects.filter(id__in=aggregate.recent_rating_ids).select_related("user", "driver")
+    by_id = {rating.id: rating for rating in ratings}
+    return [by_id[rating_id] for rating_id in aggregate.recent_rating_ids if rating_id in by_id]
+
+
+def rebuild_rating_aggregates(driver_ids=None):
+    """
+    Recompute the aggregates of `driver_ids` (every rated driver when None)
+    from DriverRating. Each driver's row is locked while it is replaced.
+    Returns the number of aggregates written.
+    """
+    ratings = DriverRating.objects.all()
+    if driver_ids is not None:
+        ratings = ratings.filter(driver_id__in=driver_ids)
+    totals = {
+        row["driver_id"]: row for row in ratings.values("driver_id").annotate(
+            rating_count=Count("id"),
+            stars_sum=Sum("stars"),
+            **{f"stars_{stars}": Count("id", filter=Q(stars=stars)) for stars in range(1, 6)},
+        ).order_by()
+    }
+    recent = {}
+    keep = settings.DRIVER_RATING_RECENT_FEEDBACK
+    for driver_id, rating_id in ratings.order_by("driver_id", "-created_at", "-id").values_list("driver_id", "id").iterator():
+        ids = recent.setdefault(driver_id, [])
+        if len(ids) < keep:
+            ids.append(rating_id)
+
+    written = 0
+    for driver_id in (driver_ids if driver_ids is not None else totals):
+        row = totals.get(driver_id, {})
+        values = {
+            field: row.get(field) or 0
+            for field in ("rating_count", "stars_sum", "stars_1", "stars_2", "stars_3", "stars_4", "stars_5")
+        }
+        with transaction.atomic():
+            lock_aggregate(driver_id)
+            DriverRatingAggregate.objects.filter(driver_id=driver_id).update(
+                recent_rating_ids=recent.get(driver_id, []), updated_at=timezone.now(), **values
+            )
+        written += 1
+    logger.info(f"Rebuilt {written} driver rating aggregates")
+    return written
@@ -0,0 +1,19 @@
+import redis
+from django.conf import settings
+
+_client = None
+
+
+def get_redis():
+    """Shared client for the Redis instance that also backs CHANNEL_LAYERS"""
+    global _client
+    if _client is None:
+        _client = redis.Redis(
+            host=settings.REDIS_HOST,
+            port=int(settings.REDIS_PORT),
+            db=settings.REDIS_STORE_DB,
+            decode_responses=True,
+            socket_timeout=2,
+            socket_connect_timeout=2,
+        )
+    return _client
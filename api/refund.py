@@ -3,6 +3,7 @@ from django.db import transaction
 from decimal import Decimal
 from .models import *
 from .serializers import *
+from .driver_summary import record_refund
 
 class PaymentRefundView(generics.GenericAPIView):
     """Create a refund request for a ride"""
@@ -54,6 +55,7 @@ class PaymentRefundView(generics.GenericAPIView):
             description=f"Refund for Ride {ride.booking_id}",
             transaction_type="refund"
         )
+        record_refund(driver, refund_amount)
 
         user_wallet.deposit(
             amount=refund_amount,
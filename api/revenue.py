@@ -46,6 +46,10 @@ class AdminWalletTransactionListAPI(generics.ListAPIView):
             total_commission=Sum('commission_amount') or 0,
             total_gst=Sum('gst_amount') or 0,
         )
+        # Current platform wallet totals, summed over its shards
+        wallet = AdminWallet.objects.filter(name="Platform Wallet").first()
+        if wallet:
+            totals['wallet'] = wallet.totals()
 
         
         page = self.paginate_queryset(queryset)
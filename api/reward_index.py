@@ -0,0 +1,112 @@
+from bisect import bisect_right
+
+from django.db.models import Q
+
+from .local_cache import VersionedLocalCache
+
+
+class RewardIndex:
+    """
+    DistanceReward rules of one lookup compiled into a sorted interval
+    structure.
+
+    `intervals` is [(min_km, max_km, payload)] in priority order (the first
+    rule covering a distance wins, as the old scans did); max_km may be inf.
+    Every rule bound is a breakpoint, and the winner is precomputed for each
+    breakpoint and for each open gap between two breakpoints, so a lookup is
+    one bisect and the payload is built once per rule, not per request.
+    """
+
+    def __init__(self, intervals):
+        intervals = list(intervals)
+        self.bounds = sorted({b for lo, hi, _ in intervals for b in (lo, hi) if b != float("inf")})
+        self.at_bound, self.after_bound = [], []
+        for i, bound in enumerate(self.bounds):
+            self.at_bound.append(self._winner(intervals, bound))
+            if i + 1 < len(self.bounds):
+                # Membership is constant inside an open gap, so its midpoint decides it
+                probe = (bound + self.bounds[i + 1]) / 2
+            else:
+                probe = bound + 1
+            self.after_bound.append(self._winner(intervals, probe))
+
+    @staticmethod
+    def _winner(intervals, distance):
+        for lo, hi, payload in intervals:
+            if lo <= distance <= hi:
+                return payload
+        return None
+
+    def lookup(self, distance):
+        """Payload of the reward that applies to `distance` km, or None"""
+        i = bisect_right(self.bounds, distance) - 1
+        if i < 0:
+            return None
+        if self.bounds[i] == distance:
+            return self.at_bound[i]
+        return self.after_bound[i]
+
+
+def reward_payload(rule):
+    """Serializable fields of a DistanceReward, with the image URL resolved once"""
+    return {
+        "cashback": rule.cashback,
+        "water_bottles": rule.water_bottles,
+        "tea": rule.tea,
+        "discount": rule.discount,
+        "heading": rule.heading,
+        "message": rule.message,
+        "vehicle_image": rule.vehicle_image.url if rule.vehicle_image else None,
+    }
+
+
+def _cashback_intervals(vehicle_type):
+    # book.Usercashback: same vehicle type (case-insensitive), table order,
+    # a falsy max_distance means open-ended
+    from .models import DistanceReward
+    rules = DistanceReward.objects.filter(vehicle_type__iexact=vehicle_type).order_by("id")
+    return [(r.min_distance, r.max_distance or float("inf"), reward_payload(r)) for r in rules]
+
+
+def _incentive_intervals(vehicle_type):
+    # views.calculate_incentives_and_rewards: this vehicle type or any, nearest slab first
+    from .models import DistanceReward
+    rules = DistanceReward.objects.filter(
+        Q(vehicle_type=vehicle_type) | Q(vehicle_type__isnull=True)
+    ).order_by("min_distance", "id")
+    return [
+        (r.min_distance, float("inf") if r.max_distance is None else r.max_distance, reward_payload(r))
+        for r in rules
+    ]
+
+
+def _customer_intervals(_vehicle_type):
+    # views.calculate_customer_rewards: every rule, table order
+    from .models import DistanceReward
+    rules = DistanceReward.objects.order_by("id")
+    return [
+        (r.min_distance, float("inf") if r.max_distance is None else r.max_distance, reward_payload(r))
+        for r in rules
+    ]
+
+
+SCOPES = {
+    "cashback": _cashback_intervals,
+    "incentive": _incentive_intervals,
+    "customer": _customer_intervals,
+}
+
+
+def _compile(key):
+    scope, vehicle_type = key
+    return RewardIndex(SCOPES[scope](vehicle_type))
+
+
+reward_indexes = VersionedLocalCache("distance_rewards", _compile)
+
+
+def find_reward(scope, distance, vehicle_type=None):
+    """Payload of the DistanceReward that applies under `scope` (see SCOPES), or None"""
+    if scope == "cashback" and vehicle_type:
+        vehicle_type = vehicle_type.lower()
+    return reward_indexes.get((scope, vehicle_type)).lookup(distance)
@@ -0,0 +1,94 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+
+from .dashboard_cache import invalidate_dashboards
+from .daily_metrics import record_ride_completed
+from .driver_summary import record_ride_completed as record_driver_completion
+from .incentive_engine import update_driver_incentive_progress
+from .models import AdminWallet, AdminWalletTransaction, User, UserWalletTransaction
+from .ride_state import try_complete_ride
+from .wallet_ledger import add_to_admin_totals, add_to_driver_balance
+
+
+def post_completion_ledger(ride, driver):
+    """
+    Ledger entries of a completed ride: driver earnings and the ride's
+    incentive to the driver's wallet, commission and GST to the platform
+    wallet. Balances move with one set-based update per wallet and the
+    transaction rows are written with one bulk_create per table. Returns the
+    platform revenue transaction (None when there was nothing to collect).
+    """
+    reference = ride.booking_id or ride.id
+    earnings = Decimal(ride.driver_earnings)
+    incentive = Decimal(ride.driver_incentive or 0)
+    commission = Decimal(ride.commission_amount)
+    gst = Decimal(ride.gst_amount)
+
+    wallet_id, balance = add_to_driver_balance(driver, earnings + incentive)
+    entries = [UserWalletTransaction(
+        wallet_id=wallet_id,
+        transaction_type="ride_payment",
+        amount=earnings,
+        description=f"Earnings for Ride {reference}",
+        balance_after=balance - incentive,
+        related_ride=ride,
+    )]
+    if incentive:
+        entries.append(UserWalletTransaction(
+            wallet_id=wallet_id,
+            transaction_type="driver_incentive",
+            amount=incentive,
+            description=f"Incentive for Ride {reference}",
+            balance_after=balance,
+            related_ride=ride,
+        ))
+    UserWalletTransaction.objects.bulk_create(entries)
+
+    total = commission + gst
+    if total > 0:
+        admin_wallet, _ = AdminWallet.objects.get_or_create(name="Platform Wallet")
+        admin_balance = add_to_admin_totals(
+            admin_wallet, total, {"total_commission": commission, "total_gst": gst}
+        )
+        revenue, = AdminWalletTransaction.objects.bulk_create([AdminWalletTransaction(
+            wallet=admin_wallet,
+            transaction_type="revenue",
+            amount=total,
+            commission_amount=commission,
+            gst_amount=gst,
+            description=f"Commission ₹{commission} + GST ₹{gst} collected for Ride {reference}",
+            balance_after=admin_balance,
+            related_ride=ride,
+            related_user_id=ride.user_id,
+        )])
+        return revenue
+    return None
+
+
+def complete_ride(ride, driver, **fields):
+    """
+    Complete an accepted/ongoing ride and post everything that follows from
+    it in one short transaction: the conditional status UPDATE with
+    `fields` (which must include driver_earnings, commission_amount and
+    gst_amount), freeing the driver, the wallet postings, incentive
+    progress, the daily metrics and the driver's daily summary. With
+    DASHBOARD_CACHE_INVALIDATE_ON_COMPLETION the cached dashboards are
+    marked stale once it commits. Returns False (and posts nothing) if the
+    ride was already completed.
+    """
+    with transaction.atomic():
+        if not try_complete_ride(ride.id, driver, **fields):
+            return False
+        ride.status = "completed"
+        for field, value in fields.items():
+            setattr(ride, field, value)
+        User.objects.filter(id=driver.id).update(is_available=True)
+        revenue = post_completion_ledger(ride, driver)
+        update_driver_incentive_progress(driver, ride)
+        record_ride_completed(ride, revenue)
+        record_driver_completion(ride, driver)
+        if settings.DASHBOARD_CACHE_INVALIDATE_ON_COMPLETION:
+            transaction.on_commit(invalidate_dashboards)
+    return True
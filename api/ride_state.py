@@ -0,0 +1,33 @@
+from django.utils import timezone
+
+from .models import Ride, User
+
+
+def try_accept_ride(ride_id, driver, **fields):
+    """
+    Assign a pending ride to driver with a single conditional
+    UPDATE ... WHERE status = 'pending' AND driver_id IS NULL.
+    Returns True if this driver won the ride; exactly one concurrent caller can.
+    """
+    won = Ride.objects.filter(id=ride_id, status='pending', driver__isnull=True).update(
+        status='accepted',
+        driver=driver,
+        updated_at=timezone.now(),
+        **fields
+    ) == 1
+    if won:
+        User.objects.filter(id=driver.id).update(is_available=False)
+    return won
+
+
+def try_complete_ride(ride_id, driver, **fields):
+    """
+    Mark the driver's accepted/ongoing ride completed in one conditional UPDATE.
+    Returns False if it was already completed (or not theirs), so the fare and
+    wallet postings that follow run only once per ride.
+    """
+    return Ride.objects.filter(id=ride_id, driver=driver, status__in=['accepted', 'ongoing']).update(
+        status='completed',
+        updated_at=timezone.now(),
+        **fields
+    ) == 1
@@ -191,9 +191,18 @@ class GetDriverIncentiveSerializer(serializers.ModelSerializer):
             'driver_incentive',
             'max_distance',
             'rides_count',
+            'period',
+            'period_days',
             'details',
             'created_at',
         ]
+
+    def validate(self, attrs):
+        period = attrs.get('period', getattr(self.instance, 'period', None))
+        period_days = attrs.get('period_days', getattr(self.instance, 'period_days', None))
+        if period == 'days' and not period_days:
+            raise serializers.ValidationError({"period_days": "Required when period is 'days'."})
+        return attrs
 from .models import Payment, RefundRequest,VehicleType
 
 class PaymentSerializer(serializers.ModelSerializer):
@@ -235,8 +244,8 @@ class VehicleTypeSerializer(serializers.ModelSerializer):
             return request.build_absolute_uri(obj.vehicleImage.url)
         return None  
     def get_pricing_rules(self, obj):
-        rules = FareRule.objects.filter(vehicle_type=obj.name).order_by('min_distance')
-        return FareRuleSerializer(rules, many=True).data 
+        from .fare_tables import get_fare_table
+        return FareRuleSerializer(get_fare_table(obj.name).rules, many=True).data 
         
 class PaymentSerializer(serializers.ModelSerializer):
     class Meta:
@@ -0,0 +1,60 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .fare_tables import fare_matrix, fare_tables
+from .incentive_engine import incentive_rules
+from .daily_metrics import record_revenue, record_ride_created, record_user_deleted, record_user_joined
+from .models import AdminWalletTransaction, DistanceReward, DriverIncentive, FareRule, Ride, User, VehicleType
+from .reward_index import reward_indexes
+
+
+# Caches are invalidated once the change commits: bumping the version earlier
+# lets another process reload the old rows and keep them under the new version.
+
+def _invalidate_fare_tables():
+    fare_tables.invalidate()
+    fare_matrix.invalidate()
+
+
+@receiver([post_save, post_delete], sender=FareRule)
+def invalidate_fare_tables(sender, **kwargs):
+    transaction.on_commit(_invalidate_fare_tables)
+
+
+@receiver([post_save, post_delete], sender=VehicleType)
+def invalidate_fare_matrix(sender, **kwargs):
+    transaction.on_commit(fare_matrix.invalidate)
+
+
+@receiver([post_save, post_delete], sender=DistanceReward)
+def invalidate_reward_indexes(sender, **kwargs):
+    transaction.on_commit(reward_indexes.invalidate)
+
+
+@receiver([post_save, post_delete], sender=DriverIncentive)
+def invalidate_incentive_rules(sender, **kwargs):
+    transaction.on_commit(incentive_rules.invalidate)
+
+
+@receiver(post_save, sender=Ride)
+def count_ride_created(sender, instance, created, **kwargs):
+    if created:
+        record_ride_created(instance)
+
+
+@receiver(post_save, sender=User)
+def count_user_joined(sender, instance, created, **kwargs):
+    if created:
+        record_user_joined(instance)
+
+
+@receiver(post_delete, sender=User)
+def count_user_deleted(sender, instance, **kwargs):
+    record_user_deleted(instance)
+
+
+@receiver(post_save, sender=AdminWalletTransaction)
+def count_revenue(sender, instance, created, **kwargs):
+    if created and instance.transaction_type == "revenue":
+        record_revenue(instance, instance.related_ride.vehicle_type if instance.related_ride_id else "")
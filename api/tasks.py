@@ -23,54 +23,100 @@ def auto_reactivate_users():
 
             logger.info(f" Auto reactivated user {user.id}")
 from celery import shared_task
-from .models import DriverIncentiveProgress
+from django.conf import settings
+from .incentive_engine import prune_incentive_progress
 
 @shared_task
-def reset_earned_field():
-    # Reset all earned fields to False
-    DriverIncentiveProgress.objects.update(earned=False)
-    return "DriverIncentiveProgress earned field reset to False"
+def prune_incentive_windows():
+    """Drop incentive progress of windows older than INCENTIVE_PROGRESS_KEEP_DAYS"""
+    deleted = prune_incentive_progress(settings.INCENTIVE_PROGRESS_KEEP_DAYS)
+    return f"Deleted {deleted} old incentive progress rows"
 
 from celery import shared_task
 from django.utils import timezone
+from django.conf import settings
 from .models import Ride
-from .utils import get_nearby_driver_tokens
-from ApniRide.firebase_app import send_multicast
+from .dispatch import clear_offers, find_dispatch_candidates, offered_driver_ids, record_offers, send_ride_offer
+from .batch_dispatch import plan_batch_assignment
+from .wallet_ledger import compact_admin_wallets
+from .daily_metrics import record_ride_cancelled
+from redis.exceptions import RedisError
 import logging
 
 logger = logging.getLogger(__name__)
 
 @shared_task
 def send_scheduled_ride_notification(ride_id):
-    try:
-        print("working in ")
-        ride = Ride.objects.get(id=ride_id)
-        tokens = get_nearby_driver_tokens(ride.pickup_lat, ride.pickup_lng)
-        if not tokens:
-            logger.warning(f"No drivers found for scheduled ride {ride.id}.")
-            return
-
-        notification = {
-            "title": "New Ride Request 🚖",
-            "body": f"Pickup near you: {ride.pickup} - {ride.drop}"
-        }
-        data_payload = {
-            "ride_id": str(ride.id),
-            "booking_id": str(ride.booking_id),
-            "pickup_location": str(ride.pickup),
-            "drop_location": str(ride.drop),
-            "driver_to_pickup_km": "0",
-            "pickup_to_drop_km": str(round(ride.distance_km, 2)),
-            "action": "NEW_RIDE"
-        }
+    """Start offering a scheduled ride to drivers at its pickup time"""
+    return dispatch_ride_wave(ride_id)
 
-        response = send_multicast(tokens, notification=notification, data=data_payload)
-        logger.info(f"Scheduled ride notification sent for ride {ride.id}: {response}")
 
-    except Ride.DoesNotExist:
-        logger.error(f"Ride {ride_id} not found for scheduled notification.")
-    except Exception as e:
-        logger.error(f"Error sending scheduled ride notification for ride {ride_id}: {e}")
+@shared_task
+def dispatch_ride_wave(ride_id, wave=1):
+    """
+    Offer a pending ride to the next DISPATCH_WAVE_SIZE best drivers, skipping
+    drivers already offered or who rejected it, and schedule the next wave.
+    Stops once the ride is accepted or no longer pending (e.g. auto-cancelled).
+    If Redis is unavailable the wave still goes out, without skipping drivers
+    offered in earlier waves, and the next wave is still scheduled.
+    """
+    ride = Ride.objects.select_related("user").filter(id=ride_id, status="pending", driver__isnull=True).first()
+    if ride is None:
+        try:
+            clear_offers(ride_id)
+        except RedisError as e:
+            logger.warning(f"Could not clear offers of ride {ride_id}: {e}")
+        return f"Ride {ride_id} is no longer pending, dispatch stopped after {wave - 1} waves."
+
+    try:
+        offered = offered_driver_ids(ride_id)
+    except RedisError as e:
+        logger.error(f"Offer state unavailable for ride {ride_id} wave {wave}, earlier offers may repeat: {e}")
+        offered = set()
+    skip_ids = offered | set(ride.rejected_by.values_list("id", flat=True))
+    candidates = find_dispatch_candidates(
+        ride.pickup_lat, ride.pickup_lng,
+        vehicle_type=ride.vehicle_type,
+        k=settings.DISPATCH_WAVE_SIZE,
+        exclude_ids=skip_ids,
+    )
+    if candidates:
+        try:
+            response = send_ride_offer(ride, candidates)
+            logger.info(f"Ride {ride.id} wave {wave} offered to {[c['driver_id'] for c in candidates]}: {response}")
+        except Exception as e:
+            logger.error(f"FCM send error for ride {ride.id} wave {wave}: {e}")
+        try:
+            record_offers(ride_id, [candidate["driver_id"] for candidate in candidates])
+        except RedisError as e:
+            logger.error(f"Could not record wave {wave} offers of ride {ride_id}: {e}")
+    else:
+        logger.warning(f"No new drivers to offer ride {ride.id} in wave {wave}.")
+
+    dispatch_ride_wave.apply_async(args=[ride_id, wave + 1], countdown=settings.DISPATCH_WAVE_INTERVAL_SECONDS)
+    return f"Ride {ride_id} wave {wave}: offered to {len(candidates)} drivers."
+
+@shared_task
+def batch_dispatch_rides():
+    """
+    Offer pending rides to idle drivers as one global assignment (minimum total
+    pickup distance) instead of first-come nearest driver. Offers are recorded
+    like wave offers so dispatch_ride_wave does not repeat them.
+    """
+    if not settings.BATCH_DISPATCH_ENABLED:
+        return "Batch dispatch disabled."
+    plan = plan_batch_assignment()
+    for ride, driver_id, fcm_token, pickup_km in plan:
+        candidate = {"driver_id": driver_id, "fcm_token": fcm_token, "distance_km": pickup_km}
+        try:
+            send_ride_offer(ride, [candidate])
+        except Exception as e:
+            logger.error(f"FCM send error for batch offer of ride {ride.id} to driver {driver_id}: {e}")
+        try:
+            record_offers(ride.id, [driver_id])
+        except RedisError as e:
+            logger.error(f"Could not record batch offer of ride {ride.id}: {e}")
+    return f"Batch dispatch offered {len(plan)} rides, {round(sum(p[3] for p in plan), 2)} pickup km in total."
 
 from datetime import timedelta
 
@@ -84,7 +130,9 @@ def auto_cancel_pending_rides():
     count = 0
     for ride in pending_rides:
         ride.status = 'auto_cancelled'
-        ride.save(update_fields=['status'])
+        ride.cancelled_at = timezone.now()
+        ride.save(update_fields=['status', 'cancelled_at', 'updated_at'])
+        record_ride_cancelled(ride)
         logger.info(f"Ride {ride.id} auto-cancelled (user={ride.user.username})")
         count += 1
 
@@ -101,4 +149,54 @@ def notify_ride_status(ride):
             "type": "ride_status_update",
             "status": ride.status
         }
-    )
\ No newline at end of file
+    )
+
+from .live_location import live_locations
+from django.db import DatabaseError
+from .location_buffer import write_locations
+
+@shared_task
+def flush_driver_locations():
+    """
+    Write the latest live position of every driver that pinged since the last
+    run back to the user rows (one bulk UPDATE per LOCATION_WRITE_MAX_BATCH
+    drivers), then mark drivers whose live location expired
+    (no ping within LIVE_LOCATION_TTL_SECONDS) as offline. If the database
+    write fails the drivers are marked dirty again for the next run.
+    """
+    latest = live_locations.take_dirty()
+    try:
+        written = write_locations(
+            {driver_id: (loc["lat"], loc["lng"], loc["ts"]) for driver_id, loc in latest.items()},
+            settings.LOCATION_WRITE_MAX_BATCH,
+        )
+    except DatabaseError as e:
+        live_locations.mark_dirty(list(latest))
+        logger.error(f"Could not write {len(latest)} driver locations, keeping them for the next flush: {e}")
+        raise
+    live_locations.record_flush(written)
+
+    stale = live_locations.sweep_stale()
+    if stale:
+        User.objects.filter(id__in=stale, is_online=True).update(is_online=False)
+        logger.info(f"Marked {len(stale)} drivers offline after missing location pings: {stale}")
+
+    return f"Flushed {written} driver locations, {len(stale)} went offline"
+
+
+@shared_task
+def compact_admin_wallet_shards():
+    """Fold AdminWalletShard totals into their AdminWallet rows"""
+    return compact_admin_wallets()
+
+
+from datetime import date
+from . import dashboard_cache
+
+@shared_task
+def refresh_dashboard_snapshot(start, end, granularity, custom_chart):
+    """Recompute a cached admin dashboard snapshot that was served stale"""
+    from .views import AdminDashboardView
+    chart_range = (date.fromisoformat(start), date.fromisoformat(end), granularity)
+    dashboard_cache.refresh(chart_range, custom_chart, AdminDashboardView().build_dashboard)
+    return f"Refreshed dashboard snapshot {dashboard_cache.snapshot_key(chart_range, custom_chart)}"
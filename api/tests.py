@@ -1,3 +1,1616 @@
-from django.test import TestCase
+import importlib
+import itertools
+import math
+import random
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import fakeredis
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, OperationalError, connection
+from django.db.models import Count, Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+import numpy as np
+from redis.exceptions import RedisError
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .batch_dispatch import INFEASIBLE, build_cost_matrix, hungarian, plan_batch_assignment
+from .daily_metrics import all_time_totals, daily_totals
+from .dashboard_cache import get_snapshot, invalidate_dashboards
+from .dispatch import find_dispatch_candidates, send_ride_offer
+from .distance import bounding_box, haversine_km, haversine_many, rank_by_distance
+from .driver_index import DriverGridIndex, driver_index
+from .driver_summary import period_totals, reconcile, record_refund
+from .fare_tables import FareMatrix, FareTable, fare_matrix, fare_tables, to_meters, to_paise
+from .incentive_engine import incentive_rules, prune_incentive_progress, update_driver_incentive_progress
+from .live_location import GEO_KEY, LiveLocationStore
+from .location_buffer import LocationWriteBuffer, write_locations
+from .models import (
+    AdminWallet, AdminWalletShard, DailyMetric, DriverDailySummary, DriverIncentive, DriverIncentiveProgress, DriverRating, DriverRatingAggregate,
+    DriverWallet, FareRule, Ride, RideTrajectory, User, VehicleType,
+)
+from .rating_aggregate import get_aggregate, rebuild_rating_aggregates, submit_rating
+from .reward_index import RewardIndex
+from .ride_completion import complete_ride
+from .ride_state import try_accept_ride, try_complete_ride
+from .routing import websocket_urlpatterns
+from .tasks import auto_cancel_pending_rides, dispatch_ride_wave, flush_driver_locations
+from .timeseries import GRANULARITIES, bucket_of, time_series
+from .trajectory import TrajectoryBuffer, decode_polyline, encode_polyline
+from .trip_distance import TripDistanceMeter, resolve_trip_distance, trip_meter
+from .utils import get_nearby_driver_rows, get_nearest_driver_distance
+from .wallet_ledger import add_to_admin_totals, compact_admin_wallets, credit, debit
+
+
+def random_rules(rng):
+    """A vehicle type's FareRule slabs (unsaved) with awkward rates and percentages"""
+    rules, start = [], 0
+    count = rng.randint(1, 5)
+    for index in range(count):
+        end = None if index == count - 1 and rng.random() < 0.7 else round(start + rng.uniform(0.5, 12), 2)
+        rules.append(FareRule(
+            vehicle_type="Test", min_distance=start, max_distance=end,
+            per_km_rate=round(rng.uniform(3, 40), rng.choice([0, 1, 2])),
+            gst_percentage=rng.choice([0, 5, 12, 18, 28]),
+            commission_percentage=round(rng.uniform(0, 30), rng.choice([0, 1, 2])),
+        ))
+        if end is None:
+            break
+        start = end
+    return rules
+
+
+def slab_walk(rules, distance):
+    """
+    The original calculate_fare loop over min_distance-ordered slabs, in
+    metres and paise: each slab line's base is rounded to the paisa and its
+    GST and commission are taken from that base. [(metres, base, gst, commission)].
+    """
+    lines = []
+    remaining = to_meters(distance) if distance > 0 else 0
+    for rule in rules:
+        if remaining <= 0:
+            break
+        start = to_meters(rule.min_distance)
+        end = to_meters(rule.max_distance) if rule.max_distance else remaining + start
+        applicable = min(remaining, end - start)
+        if applicable <= 0:
+            continue
+        base = int((Decimal(applicable) * to_paise(rule.per_km_rate) / 1000).to_integral_value("ROUND_HALF_UP"))
+        lines.append((
+            applicable,
+            base,
+            int((Decimal(base) * to_paise(rule.gst_percentage) / 10000).to_integral_value("ROUND_HALF_UP")),
+            int((Decimal(base) * to_paise(rule.commission_percentage) / 10000).to_integral_value("ROUND_HALF_UP")),
+        ))
+        remaining -= applicable
+    return lines
+
+
+class FareEngineTests(TestCase):
+    """Randomized (seeded) checks that fares are exact in paise end to end"""
+
+    def test_table_matches_slab_walk(self):
+        rng = random.Random(12)
+        for _ in range(300):
+            rules = random_rules(rng)
+            if rng.random() < 0.2:
+                # Empty and inverted slabs are skipped, as the walk skips them
+                rules.insert(rng.randrange(len(rules)), FareRule(
+                    vehicle_type="Test", min_distance=5, max_distance=rng.choice([5, 3]),
+                    per_km_rate=99, gst_percentage=5, commission_percentage=5,
+                ))
+            table = FareTable(rules)
+            for _ in range(20):
+                distance = round(rng.uniform(-1, 80), rng.choice([0, 1, 2, 3]))
+                lines = slab_walk(rules, distance)
+                paise = table.quote_paise(distance)
+                self.assertEqual(
+                    (paise.base_fare, paise.gst_amount, paise.commission_amount),
+                    tuple(sum(line[i] for line in lines) for i in (1, 2, 3)),
+                )
+                self.assertEqual(
+                    [(line["distance"], Decimal(str(line["fare"]))) for line in table.quote(distance)["breakdown"]],
+                    [(meters / 1000, Decimal(base + gst) / 100) for meters, base, gst, _ in lines],
+                )
+
+    def test_invalidation_waits_for_commit(self):
+        with mock.patch.object(fare_tables, "invalidate") as invalidate:
+            with self.captureOnCommitCallbacks() as callbacks:
+                FareRule.objects.create(
+                    vehicle_type="Late", min_distance=0, per_km_rate=10, gst_percentage=5, commission_percentage=10,
+                )
+                invalidate.assert_not_called()
+            for callback in callbacks:
+                callback()
+        invalidate.assert_called_once()
+
+    def test_slab_lines_add_up_to_quote(self):
+        rng = random.Random(14)
+        for _ in range(300):
+            table = FareTable(random_rules(rng))
+            for _ in range(20):
+                distance = round(rng.uniform(0, 80), rng.choice([0, 1, 2, 3]))
+                paise = table.quote_paise(distance)
+                self.assertEqual(paise.total_user_pays, paise.base_fare + paise.gst_amount)
+                self.assertEqual(
+                    paise.total_user_pays,
+                    paise.driver_earnings + paise.commission_amount + paise.gst_amount,
+                )
+                quote = table.quote(distance)
+                self.assertEqual(
+                    sum(Decimal(str(line["fare"])) for line in quote["breakdown"]),
+                    paise.rupees("total_user_pays"),
+                )
+                self.assertEqual(Decimal(str(quote["total_user_pays"])), paise.rupees("total_user_pays"))
+
+    def test_matrix_matches_table(self):
+        rng = random.Random(15)
+        tables = [FareTable(random_rules(rng)) for _ in range(12)]
+        matrix = FareMatrix([str(i) for i in range(len(tables))], tables)
+        for _ in range(300):
+            distance = round(rng.uniform(0, 80), rng.choice([0, 1, 2]))
+            for (_, quote), table in zip(matrix.quote_all(distance), tables):
+                self.assertEqual(quote, table.quote(distance))
+
+    def test_wallet_postings_equal_fare(self):
+        rng = random.Random(16)
+        driver = User.objects.create(email="fare-driver@example.com", is_driver=1)
+        driver_wallet = DriverWallet.objects.create(driver=driver)
+        admin_wallet = AdminWallet.objects.create(name="Platform Wallet")
+        charged = Decimal("0.00")
+        for _ in range(100):
+            table = FareTable(random_rules(rng))
+            paise = table.quote_paise(round(rng.uniform(0.1, 80), 2))
+            charged += paise.rupees("total_user_pays")
+            driver_wallet.deposit(paise.rupees("driver_earnings"), transaction_type="ride_payment")
+            admin_wallet.collect_commission(paise.rupees("commission_amount"))
+            admin_wallet.collect_gst(paise.rupees("gst_amount"))
+
+        driver_wallet.refresh_from_db()
+        admin_totals = admin_wallet.totals()
+        self.assertEqual(driver_wallet.balance + admin_totals["balance"], charged)
+        self.assertEqual(admin_totals["balance"], admin_totals["total_commission"] + admin_totals["total_gst"])
+
+        compact_admin_wallets()
+        admin_wallet.refresh_from_db()
+        self.assertEqual(admin_wallet.totals(), admin_totals)
+        self.assertEqual(admin_wallet.balance, admin_totals["balance"])
+
+
+class FareQuoteViewTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(email="quote@example.com", username="quote", is_user=1))
+        with self.captureOnCommitCallbacks(execute=True):
+            VehicleType.objects.create(name="Bike", seating_capacity=1)
+            FareRule.objects.create(
+                vehicle_type="Bike", min_distance=0, max_distance=None,
+                per_km_rate=8, gst_percentage=5, commission_percentage=10,
+            )
+        # Rolled back with the test; later tests must not quote from it
+        self.addCleanup(fare_matrix.invalidate)
+        cache.clear()
+
+    def quote(self, **data):
+        return self.client.post("/api/rides/fare-quote/", data, format="json")
+
+    def test_quote_for_distance(self):
+        response = self.quote(distance_km="12.5")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["distance_km"], 12.5)
+        bike = next(quote for quote in response.data["quotes"] if quote["vehicle_type"] == "Bike")
+        self.assertEqual(bike["total_user_pays"], 105.0)
+
+    def test_invalid_distances_are_rejected(self):
+        for distance in ("inf", "-inf", "nan", "1e400", -1, "abc"):
+            response = self.quote(distance_km=distance)
+            self.assertEqual(response.status_code, 400, distance)
+            self.assertEqual(response.data["statusCode"], "0")
+        self.assertEqual(self.quote(pickup_lat=12.9).status_code, 400)
+
+    def test_quotes_without_cache(self):
+        with mock.patch("api.fare_tables.cache.get", side_effect=RedisError("down")):
+            response = self.quote(distance_km=3)
+        self.assertEqual(response.status_code, 200)
+        with mock.patch("api.fare_tables.cache.set", side_effect=RedisError("down")):
+            response = self.quote(distance_km=4)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data["quotes"])
+
+
+class RewardIndexTests(TestCase):
+    def test_lookup_matches_first_covering_rule(self):
+        rng = random.Random(15)
+        for _ in range(200):
+            intervals = []
+            for payload in range(rng.randint(0, 8)):
+                lo = rng.choice([0, 2, 5, 7.5, 10, 15, 20])
+                hi = rng.choice([lo, lo + 2.5, lo + 5, float("inf")])
+                intervals.append((lo, hi, payload))
+            index = RewardIndex(intervals)
+            for distance in [rng.uniform(-1, 40) for _ in range(30)] + [0, 2, 5, 7.5, 10, 12.5, 20, 25]:
+                expected = next((p for lo, hi, p in intervals if lo <= distance <= hi), None)
+                self.assertEqual(index.lookup(distance), expected)
+
+
+class RideCompletionTests(TestCase):
+    def setUp(self):
+        self.rider = User.objects.create(email="rider@example.com", is_user=1)
+        self.driver = User.objects.create(email="driver@example.com", is_driver=1, is_available=False)
+
+    def accepted_ride(self, **fields):
+        fields.setdefault("status", "accepted")
+        return Ride.objects.create(
+            user=self.rider, driver=self.driver, pickup="A", drop="B",
+            distance_km=8, driver_incentive=Decimal("10.00"), **fields
+        )
+
+    def complete(self, ride):
+        return complete_ride(
+            ride, self.driver,
+            fare=Decimal("210.00"), gst_amount=Decimal("10.00"),
+            commission_amount=Decimal("20.00"), driver_earnings=Decimal("180.00"),
+        )
+
+    def test_completion_query_count_is_fixed(self):
+        # First completion creates the wallets and shard rows
+        self.assertTrue(self.complete(self.accepted_ride()))
+        ride = self.accepted_ride()
+        # Savepoint + release, status CAS, driver freed, driver wallet update +
+        # read-back, one bulk insert, admin wallet lookup, shard update,
+        # totals read, one bulk insert, daily metric and driver summary
+        # updates (incentive rules are cached, none match)
+        with self.assertNumQueries(13):
+            self.assertTrue(self.complete(ride))
+        self.assertFalse(self.complete(ride))
+
+        wallet = DriverWallet.objects.get(driver=self.driver)
+        self.assertEqual(wallet.balance, Decimal("380.00"))
+        self.assertEqual(
+            list(wallet.transactions.filter(related_ride=ride).order_by("id").values_list("transaction_type", "amount", "balance_after")),
+            [("ride_payment", Decimal("180.00"), Decimal("370.00")), ("driver_incentive", Decimal("10.00"), Decimal("380.00"))],
+        )
+        totals = AdminWallet.objects.get(name="Platform Wallet").totals()
+        self.assertEqual(totals, {"balance": Decimal("60.00"), "total_commission": Decimal("40.00"), "total_gst": Decimal("20.00")})
+        self.assertTrue(User.objects.get(id=self.driver.id).is_available)
+
+    def test_driver_summary_matches_rides_and_refunds(self):
+        for _ in range(3):
+            self.complete(self.accepted_ride())
+        DriverWallet.objects.get(driver=self.driver).withdraw(Decimal("50.00"), transaction_type="refund")
+        record_refund(self.driver, Decimal("50.00"))
+
+        today = timezone.localdate()
+        totals = period_totals(self.driver, {"today": (today, today)})["today"]
+        self.assertEqual(
+            totals,
+            {"rides_completed": 3, "fare_total": Decimal("630.00"), "driver_earnings": Decimal("540.00"), "refunds": Decimal("50.00")},
+        )
+        self.assertEqual(reconcile(today, today, fix=False), [])
+
+        DriverDailySummary.objects.filter(driver=self.driver).update(rides_completed=7)
+        self.assertEqual(reconcile(today, today), [(self.driver.id, today, "rides_completed", 7, 3)])
+        self.assertEqual(reconcile(today, today), [])
+
+    def test_driver_views_report_fares_and_todays_trips(self):
+        for _ in range(2):
+            self.complete(self.accepted_ride())
+        record_refund(self.driver, Decimal("50.00"))
+        self.accepted_ride(status="ongoing")
+        yesterday = self.accepted_ride(status="ongoing")
+        Ride.objects.filter(id=yesterday.id).update(created_at=timezone.now() - timedelta(days=1))
+        client = APIClient()
+        client.force_authenticate(self.driver)
+
+        earnings = client.get(f"/api/earnings/{self.driver.id}").data["data"]
+        # Fares of completed rides, refunds are not taken off
+        self.assertEqual(
+            [(row["period"], row["total_earnings"], row["total_rides"]) for row in earnings],
+            [("daily", 420.0, 2), ("weekly", 420.0, 2), ("monthly", 420.0, 2)],
+        )
+        dashboard = client.get("/api/driver/dashboard/").data["data"]
+        # Rides created today that are completed or ongoing
+        self.assertEqual((dashboard["today_earnings"], dashboard["trips_today"]), (420.0, 3))
+
+
+class RideStatusUpdateViewTests(TestCase):
+    def setUp(self):
+        self.rider = User.objects.create(email="status-rider@example.com", username="status-rider", is_user=1)
+        self.driver = User.objects.create(email="status-driver@example.com", username="status-driver", is_driver=1)
+        FareRule.objects.create(
+            vehicle_type="Sedan", min_distance=0, max_distance=None,
+            per_km_rate=12, gst_percentage=5, commission_percentage=10,
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.driver)
+
+    def post_status(self, ride, **data):
+        return self.client.post(f"/api/rides/{ride.id}/status/", data, format="json")
+
+    def test_status_changes_are_not_saved_again(self):
+        ride = Ride.objects.create(user=self.rider, pickup="A", drop="B", status="pending")
+        with mock.patch.object(Ride, "save") as save:
+            response = self.post_status(ride, status="accepted")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data["ride"]["status"], "accepted")
+
+            response = self.post_status(ride, status="completed", distance=10, vehicle_type="Sedan")
+            self.assertEqual(response.status_code, 200, response.data)
+            self.assertEqual(response.data["ride"]["status"], "completed")
+        save.assert_not_called()
+
+        ride.refresh_from_db()
+        self.assertEqual((ride.status, ride.driver_id, ride.fare), ("completed", self.driver.id, Decimal("126.00")))
+
+
+class RideRaceTests(TestCase):
+    """Two requests that both saw the ride in its old state: only the first may act on it"""
+
+    def setUp(self):
+        self.rider = User.objects.create(email="race-rider@example.com", username="race-rider", is_user=1)
+        self.drivers = [
+            User.objects.create(email=f"race-driver{i}@example.com", username=f"race-driver{i}", is_driver=1, is_available=True)
+            for i in range(2)
+        ]
+        FareRule.objects.create(
+            vehicle_type="Sedan", min_distance=0, max_distance=None,
+            per_km_rate=12, gst_percentage=5, commission_percentage=10,
+        )
+        self.ride = Ride.objects.create(user=self.rider, pickup="A", drop="B", status="pending")
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def ride_payments(self):
+        return DriverWallet.objects.get(driver=self.drivers[0]).transactions.filter(transaction_type="ride_payment").count()
+
+    def test_second_accept_and_complete_lose(self):
+        first, second = self.drivers
+        self.assertTrue(try_accept_ride(self.ride.id, first))
+        self.assertFalse(try_accept_ride(self.ride.id, second))
+        self.assertTrue(try_complete_ride(self.ride.id, first))
+        self.assertFalse(try_complete_ride(self.ride.id, first))
+        self.ride.refresh_from_db()
+        self.assertEqual((self.ride.status, self.ride.driver_id), ("completed", first.id))
+        self.assertEqual(
+            list(User.objects.filter(id__in=[first.id, second.id]).order_by("id").values_list("is_available", flat=True)),
+            [False, True],
+        )
+
+    def test_accept_ride_view_conflict(self):
+        first, second = self.drivers
+        responses = [self.client_for(driver).post(f"/api/rides/accept/{self.ride.id}/") for driver in self.drivers]
+        self.assertEqual([response.status_code for response in responses], [200, 409])
+        self.assertEqual(Ride.objects.get(id=self.ride.id).driver_id, first.id)
+
+    def test_status_view_accept_conflict(self):
+        first, second = self.drivers
+
+        def accepted_meanwhile(ride_id, driver, **fields):
+            # The other driver's accept lands after this request read the ride as pending
+            try_accept_ride(ride_id, second)
+            return try_accept_ride(ride_id, driver, **fields)
+
+        with mock.patch("api.views.try_accept_ride", side_effect=accepted_meanwhile):
+            response = self.client_for(first).post(f"/api/rides/{self.ride.id}/status/", {"status": "accepted"}, format="json")
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Ride.objects.get(id=self.ride.id).driver_id, second.id)
+
+    def test_status_view_complete_conflict(self):
+        first = self.drivers[0]
+        try_accept_ride(self.ride.id, first)
+        client = self.client_for(first)
+        data = {"status": "completed", "distance": 10, "vehicle_type": "Sedan"}
+
+        def completed_meanwhile(ride_id, driver, **fields):
+            # A retried request completes the ride after this one passed the status check
+            patched.side_effect = try_complete_ride
+            complete_ride(Ride.objects.get(id=ride_id), driver, **fields)
+            return try_complete_ride(ride_id, driver, **fields)
+
+        with mock.patch("api.ride_completion.try_complete_ride", side_effect=completed_meanwhile) as patched:
+            response = client.post(f"/api/rides/{self.ride.id}/status/", data, format="json")
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.ride_payments(), 1)
+
+        response = client.post(f"/api/rides/{self.ride.id}/status/", data, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.ride_payments(), 1)
+
+
+class IncentiveEngineTests(TestCase):
+    START = timezone.make_aware(timezone.datetime(2026, 3, 2, 9))  # a Monday
+
+    def setUp(self):
+        self.rider = User.objects.create(email="inc-rider@example.com", username="inc-rider", is_user=1)
+        self.driver = User.objects.create(email="inc-driver@example.com", username="inc-driver", is_driver=1)
+        # Rolled-back rules must not stay in the process cache for other tests
+        self.addCleanup(incentive_rules.invalidate)
+
+    def at(self, days):
+        return mock.patch("django.utils.timezone.now", return_value=self.START + timedelta(days=days))
+
+    def rule(self, **fields):
+        fields.setdefault("days", 2)
+        with self.at(0), self.captureOnCommitCallbacks(execute=True):
+            return DriverIncentive.objects.create(ride_type="city", driver_incentive=Decimal("50.00"), details="", **fields)
+
+    def ride_on(self, days):
+        with self.at(days):
+            ride = Ride.objects.create(user=self.rider, driver=self.driver, pickup="A", drop="B", distance_km=5)
+            return update_driver_incentive_progress(self.driver, ride)
+
+    def payouts(self):
+        return DriverWallet.objects.get(driver=self.driver).transactions.filter(transaction_type="driver_incentive").count()
+
+    def test_each_window_pays_once(self):
+        rule = self.rule(period="days", period_days=3)
+        paid = [bool(self.ride_on(day)) for day in (0, 0, 1, 2, 3, 4, 5, 6)]
+        # Target 2 rides: reached on the second ride of days 0-2 and of days 3-5; day 6 starts a third window
+        self.assertEqual(paid, [False, True, False, False, False, True, False, False])
+        self.assertEqual(self.payouts(), 2)
+        rows = DriverIncentiveProgress.objects.filter(incentive_rule=rule).order_by("period_start")
+        self.assertEqual(
+            list(rows.values_list("period_start", "rides_completed", "earned")),
+            [(self.START.date(), 4, True), (self.START.date() + timedelta(days=3), 3, True), (self.START.date() + timedelta(days=6), 1, False)],
+        )
+
+    def test_daily_and_weekly_windows_roll_over(self):
+        daily, weekly = self.rule(period="day"), self.rule(period="week")
+        for day in (0, 0, 1, 6, 7, 7):
+            self.ride_on(day)
+        starts = lambda rule: list(DriverIncentiveProgress.objects.filter(incentive_rule=rule).order_by("period_start").values_list("rides_completed", "earned"))
+        self.assertEqual(starts(daily), [(2, True), (1, False), (1, False), (2, True)])
+        self.assertEqual(starts(weekly), [(4, True), (2, True)])
+        self.assertEqual(self.payouts(), 4)
+
+    def test_rules_pay_daily_by_default(self):
+        rule = self.rule(days=1)
+        self.assertEqual(rule.period, "day")
+        self.assertEqual([bool(self.ride_on(day)) for day in (0, 0, 1)], [True, False, True])
+
+    def test_lifetime_target_never_resets(self):
+        rule = self.rule(period="lifetime", days=3)
+        paid = [bool(self.ride_on(day)) for day in (0, 40, 200, 201)]
+        self.assertEqual(paid, [False, False, True, False])
+        progress = DriverIncentiveProgress.objects.get(incentive_rule=rule)
+        self.assertEqual((progress.period_start, progress.rides_completed), (self.START.date(), 4))
+
+        with self.at(400):
+            prune_incentive_progress(keep_days=90)
+        self.assertTrue(DriverIncentiveProgress.objects.filter(incentive_rule=rule).exists())
+
+    def test_prune_drops_only_old_windows(self):
+        rule = self.rule(period="day")
+        for day in (0, 10, 95, 100):
+            self.ride_on(day)
+        DriverIncentiveProgress.objects.create(driver=self.driver, incentive_rule=rule, period_start=None)
+        with self.at(100):
+            self.assertEqual(prune_incentive_progress(keep_days=90), 2)
+        self.assertEqual(
+            list(DriverIncentiveProgress.objects.values_list("period_start", flat=True).order_by("period_start")),
+            [self.START.date() + timedelta(days=day) for day in (10, 95, 100)],
+        )
+
+    def test_window_row_created_concurrently_is_kept(self):
+        rule = self.rule(period="day", days=1)
+        bulk_create = DriverIncentiveProgress.objects.bulk_create
+
+        def racing_bulk_create(rows, **kwargs):
+            # Another completion inserts the window row after this one looked for it
+            DriverIncentiveProgress.objects.create(driver=self.driver, incentive_rule=rule, period_start=self.START.date())
+            return bulk_create(rows, **kwargs)
+
+        with mock.patch.object(DriverIncentiveProgress.objects, "bulk_create", side_effect=racing_bulk_create):
+            self.assertEqual(self.ride_on(0), [rule])
+        progress = DriverIncentiveProgress.objects.get(incentive_rule=rule)
+        self.assertEqual((progress.rides_completed, progress.earned), (1, True))
+
+
+class TimeSeriesTests(TestCase):
+    def test_grouped_series_matches_per_bucket_filters(self):
+        rng = random.Random(22)
+        rider = User.objects.create(email="series@example.com", is_user=1)
+        now = timezone.now()
+        for _ in range(60):
+            ride = Ride.objects.create(user=rider, pickup="A", drop="B", fare=Decimal(rng.randint(50, 500)))
+            Ride.objects.filter(id=ride.id).update(created_at=now - timedelta(hours=rng.uniform(0, 24 * 70)))
+        rides = list(Ride.objects.values_list("created_at", "fare"))
+
+        start, end = timezone.localdate() - timedelta(days=60), timezone.localdate()
+        for granularity in GRANULARITIES:
+            if granularity == "hour":
+                start = end - timedelta(days=2)
+            with self.assertNumQueries(1):
+                series = time_series(
+                    Ride.objects.all(), "created_at", start, end, granularity,
+                    rides=Count("id"), fare=Sum("fare"),
+                )
+            keys = [bucket for bucket, _ in series]
+            self.assertEqual(keys, sorted(set(keys)))
+            self.assertEqual(keys[0], bucket_of(start, granularity))
+            if granularity == "hour":
+                # A date end runs through that day's last hour
+                self.assertEqual(len(keys), 72)
+            else:
+                self.assertEqual(keys[-1], bucket_of(end, granularity))
+            for bucket, values in series:
+                inside = [fare for created_at, fare in rides if bucket_of(created_at, granularity) == bucket]
+                self.assertEqual(values["rides"], len(inside))
+                self.assertEqual(values["fare"], sum(inside))
+
+
+class DailyMetricTests(TestCase):
+    MONDAY = timezone.make_aware(timezone.datetime(2026, 3, 2, 10))
+    backfill = staticmethod(importlib.import_module("api.migrations.0021_backfill_daily_metrics").backfill)
+
+    def at(self, days, hours=0):
+        return mock.patch("django.utils.timezone.now", return_value=self.MONDAY + timedelta(days=days, hours=hours))
+
+    def assert_matches_rebuild(self, days=5):
+        start = self.MONDAY.date()
+        end = start + timedelta(days=days)
+        kept = daily_totals(start, end), all_time_totals("new_users", "new_drivers")
+        with self.at(days):
+            self.backfill(apps, None)
+        self.assertEqual((daily_totals(start, end), all_time_totals("new_users", "new_drivers")), kept)
+        return kept[0]
+
+    def test_cancellations_are_dated_when_they_happen(self):
+        with self.at(0):
+            rider = User.objects.create(email="dm-rider@example.com", username="dm-rider", is_user=1)
+            driver = User.objects.create(email="dm-driver@example.com", username="dm-driver", is_driver=1)
+            cancelled = Ride.objects.create(user=rider, pickup="A", drop="B", vehicle_type="Sedan")
+            stuck = Ride.objects.create(user=rider, pickup="A", drop="B", vehicle_type="Sedan")
+            try_accept_ride(cancelled.id, driver)
+        client = APIClient()
+        client.force_authenticate(rider)
+        with self.at(2):
+            self.assertEqual(client.post(f"/api/rides/{cancelled.id}/cancel/").status_code, 200)
+        with self.at(3):
+            auto_cancel_pending_rides()
+
+        for ride, day in ((cancelled, 2), (stuck, 3)):
+            ride.refresh_from_db()
+            self.assertEqual((ride.cancelled_at, ride.updated_at), (self.MONDAY + timedelta(days=day),) * 2)
+        totals = self.assert_matches_rebuild()
+        self.assertEqual(
+            [totals[self.MONDAY.date() + timedelta(days=day)]["rides_cancelled"] for day in range(5)],
+            [0, 0, 1, 1, 0],
+        )
+
+    def test_completions_are_dated_by_completed_at(self):
+        with self.at(0):
+            rider = User.objects.create(email="dm-late@example.com", username="dm-late", is_user=1)
+            driver = User.objects.create(email="dm-late-d@example.com", username="dm-late-d", is_driver=1)
+            ride = Ride.objects.create(
+                user=rider, driver=driver, pickup="A", drop="B", vehicle_type="Sedan", status="accepted", distance_km=8
+            )
+        # Completed just before midnight, processed just after it
+        with self.at(1, hours=2):
+            self.assertTrue(complete_ride(
+                ride, driver, completed_at=self.MONDAY + timedelta(hours=13, minutes=59),
+                fare=Decimal("210.00"), gst_amount=Decimal("10.00"),
+                commission_amount=Decimal("20.00"), driver_earnings=Decimal("180.00"),
+            ))
+
+        totals = self.assert_matches_rebuild()
+        monday, tuesday = self.MONDAY.date(), self.MONDAY.date() + timedelta(days=1)
+        self.assertEqual((totals[monday]["rides_completed"], totals[tuesday]["rides_completed"]), (1, 0))
+        self.assertEqual((totals[monday]["revenue"], totals[tuesday]["revenue"]), (0, Decimal("30.00")))
+
+    def test_deleted_users_leave_the_totals(self):
+        with self.at(0):
+            users = [User.objects.create(email=f"dm{i}@example.com", username=f"dm{i}", is_user=1) for i in range(3)]
+            driver = User.objects.create(email="dm-d@example.com", username="dm-d", is_driver=1)
+        self.assertEqual(all_time_totals("new_users", "new_drivers"), {"new_users": 3, "new_drivers": 1})
+        with self.at(1):
+            users[0].delete()
+            driver.delete()
+        self.assertEqual(all_time_totals("new_users", "new_drivers"), {"new_users": 2, "new_drivers": 0})
+        self.assert_matches_rebuild()
+
+    def test_migration_backfills_rollups(self):
+        with self.at(0):
+            rider = User.objects.create(email="bf-rider@example.com", username="bf-rider", is_user=1, date_joined=self.MONDAY)
+            Ride.objects.create(user=rider, pickup="A", drop="B", vehicle_type="Auto")
+        DailyMetric.objects.all().delete()
+        with self.at(1):
+            self.backfill(apps, None)
+        day = daily_totals(self.MONDAY.date(), self.MONDAY.date())[self.MONDAY.date()]
+        self.assertEqual((day["rides_created"], day["new_users"]), (1, 1))
+
+
+class DashboardCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.builds = 0
+        today = timezone.localdate()
+        self.chart_range = (today - timedelta(days=6), today, "day")
+
+    def build(self, chart_range, custom_chart):
+        self.builds += 1
+        return {"build": self.builds}
+
+    @mock.patch("api.tasks.refresh_dashboard_snapshot.delay")
+    def test_stale_snapshot_is_served_while_refreshing(self, delay):
+        self.assertEqual(get_snapshot(self.chart_range, False, self.build), ({"build": 1}, 0, False))
+        payload, _, stale = get_snapshot(self.chart_range, False, self.build)
+        self.assertEqual((payload, stale, self.builds), ({"build": 1}, False, 1))
+        delay.assert_not_called()
+
+        invalidate_dashboards()
+        for _ in range(3):
+            payload, _, stale = get_snapshot(self.chart_range, False, self.build)
+            self.assertEqual((payload, stale, self.builds), ({"build": 1}, True, 1))
+        # One refresh enqueued however many requests saw the stale snapshot
+        start, end, granularity = self.chart_range
+        delay.assert_called_once_with(start.isoformat(), end.isoformat(), granularity, False)
+
+        # Another range is a separate snapshot
+        get_snapshot(self.chart_range, True, self.build)
+        self.assertEqual(self.builds, 2)
+
+    @mock.patch("api.tasks.refresh_dashboard_snapshot.delay")
+    def test_refresh_task_replaces_snapshot(self, delay):
+        from .tasks import refresh_dashboard_snapshot
+        get_snapshot(self.chart_range, False, self.build)
+        start, end, granularity = self.chart_range
+        with mock.patch("api.views.AdminDashboardView.build_dashboard", lambda view, *args: {"build": "task"}):
+            refresh_dashboard_snapshot(start.isoformat(), end.isoformat(), granularity, False)
+        payload, age, stale = get_snapshot(self.chart_range, False, self.build)
+        self.assertEqual((payload, stale), ({"build": "task"}, False))
+        self.assertLess(age, 5)
+        with override_settings(DASHBOARD_CACHE_FRESH_SECONDS=-1):
+            self.assertTrue(get_snapshot(self.chart_range, False, self.build)[2])
+        delay.assert_called_once()
+
+
+class RatingAggregateTests(TestCase):
+    def test_aggregate_follows_ratings_and_re_ratings(self):
+        rng = random.Random(25)
+        rider = User.objects.create(email="rates@example.com", is_user=1)
+        driver = User.objects.create(email="rated@example.com", is_driver=1)
+        rides = [
+            Ride.objects.create(user=rider, driver=driver, pickup="A", drop="B", status="completed")
+            for _ in range(15)
+        ]
+        for _ in range(40):
+            submit_rating(rng.choice(rides), rider, rng.randint(1, 5), "ok")
+
+        aggregate = get_aggregate(driver.id)
+        stars = list(DriverRating.objects.filter(driver=driver).values_list("stars", flat=True))
+        self.assertEqual(aggregate.rating_count, len(stars))
+        self.assertEqual(aggregate.stars_sum, sum(stars))
+        self.assertEqual(aggregate.distribution, {n: stars.count(n) for n in range(1, 6)})
+        self.assertEqual(
+            aggregate.recent_rating_ids,
+            list(DriverRating.objects.filter(driver=driver).order_by("-created_at", "-id").values_list("id", flat=True)[:10]),
+        )
+
+        before = {field: getattr(aggregate, field) for field in ("rating_count", "stars_sum", "recent_rating_ids")}
+        DriverRatingAggregate.objects.filter(driver=driver).delete()
+        self.assertEqual(rebuild_rating_aggregates(), 1)
+        rebuilt = get_aggregate(driver.id)
+        self.assertEqual({field: getattr(rebuilt, field) for field in before}, before)
+        self.assertEqual(rebuilt.distribution, aggregate.distribution)
+
+
+def fake_redis(module):
+    """Patch `module`.get_redis with a fresh in-memory Redis; returns (patcher, client)"""
+    client = fakeredis.FakeRedis(decode_responses=True)
+    return mock.patch(f"{module}.get_redis", return_value=client), client
+
+
+class TripDistanceTests(TestCase):
+    # About 1.1 m of latitude per 1e-5 degrees
+    LAT, LNG = 12.97, 77.59
+
+    def setUp(self):
+        patcher, self.redis = fake_redis("api.trip_distance")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.meter = TripDistanceMeter(min_step_m=10, max_speed_kmph=150, smoothing=0.5, reseed_after=3)
+
+    def test_speed_outliers_are_rejected(self):
+        self.assertTrue(self.meter.add_point(1, self.LAT, self.LNG, ts=1000))
+        # 5 km in 10 s is 1800 km/h
+        self.assertFalse(self.meter.add_point(1, self.LAT + 0.045, self.LNG, ts=1010))
+        self.assertTrue(self.meter.add_point(1, self.LAT + 0.0005, self.LNG, ts=1020))
+        summary = self.meter.summary(1)
+        self.assertEqual((summary["points"], summary["rejected"]), (2, 1))
+        # Only the smoothed half of the real 55 m step is counted, none of the jump
+        self.assertAlmostEqual(summary["km"], 0.0278, places=3)
+
+    def test_bad_first_fix_is_replaced(self):
+        # The first fix is 5 km off; the real drive then moves 111 m every 10 s
+        self.meter.add_point(1, self.LAT + 0.045, self.LNG, ts=1000)
+        accepted = [self.meter.add_point(1, self.LAT + 0.001 * i, self.LNG, ts=1010 + 10 * i) for i in range(12)]
+        self.assertEqual(accepted, [False, False] + [True] * 10)
+        summary = self.meter.summary(1)
+        self.assertEqual((summary["points"], summary["rejected"]), (11, 2))
+        # Counted from the re-seed at i=2, none of the 5 km jump
+        self.assertAlmostEqual(summary["km"], 8 * 0.1112, delta=0.06)
+
+    def test_isolated_outliers_do_not_reseed(self):
+        self.meter.add_point(1, self.LAT, self.LNG, ts=1000)
+        for i in range(1, 7):
+            self.meter.add_point(1, self.LAT + 0.0005 * i, self.LNG, ts=1000 + 10 * i)
+            if i % 2:
+                self.assertFalse(self.meter.add_point(1, self.LAT + 0.045, self.LNG, ts=1005 + 10 * i))
+        summary = self.meter.summary(1)
+        self.assertEqual((summary["points"], summary["rejected"]), (7, 3))
+        self.assertLess(summary["km"], 0.3)
+
+    def test_points_are_smoothed(self):
+        self.meter.add_point(1, self.LAT, self.LNG, ts=1000)
+        self.meter.add_point(1, self.LAT + 0.001, self.LNG + 0.002, ts=1030)
+        state = self.redis.hgetall("ride:1:meter")
+        self.assertAlmostEqual(float(state["lat"]), self.LAT + 0.0005)
+        self.assertAlmostEqual(float(state["lng"]), self.LNG + 0.001)
+
+    def test_jitter_below_min_step_is_not_counted(self):
+        rng = random.Random(7)
+        for i in range(40):
+            self.meter.add_point(1, self.LAT + rng.uniform(-3e-5, 3e-5), self.LNG + rng.uniform(-3e-5, 3e-5), ts=1000 + 5 * i)
+        self.assertEqual(self.meter.summary(1), {"km": 0.0, "points": 40, "rejected": 0})
+
+    def test_straight_drive_is_measured(self):
+        # 30 points 0.001 deg (~111 m) apart every 10 s, ~40 km/h
+        for i in range(30):
+            self.meter.add_point(1, self.LAT + 0.001 * i, self.LNG, ts=1000 + 10 * i)
+        km = self.meter.summary(1)["km"]
+        # The smoothed position trails the last raw point by about one step
+        self.assertAlmostEqual(km, 28 * 0.1112, delta=0.02)
+
+    def test_concurrent_point_is_not_overwritten(self):
+        self.meter.add_point(1, self.LAT, self.LNG, ts=1000)
+        advance = self.meter.advance
+        calls = []
+
+        def interleaved(state, lat, lng, ts):
+            calls.append(ts)
+            if len(calls) == 1:
+                # Another worker's point lands between this one's read and write
+                self.meter.add_point(1, self.LAT + 0.0002, self.LNG, ts=1005)
+            return advance(state, lat, lng, ts)
+
+        with mock.patch.object(self.meter, "advance", side_effect=interleaved):
+            self.meter.add_point(1, self.LAT + 0.0004, self.LNG, ts=1010)
+        # The outer point was retried on the state the inner one wrote
+        self.assertEqual(calls, [1010, 1005, 1010])
+        self.assertEqual(self.meter.summary(1)["points"], 3)
+
+    @override_settings(TRIP_METER_MIN_POINTS=10)
+    def test_resolve_falls_back_to_client_distance(self):
+        for i in range(9):
+            trip_meter.add_point(5, self.LAT + 0.001 * i, self.LNG, ts=1000 + 10 * i)
+        self.assertEqual(resolve_trip_distance(5, "3.5"), ("3.5", None))
+
+        trip_meter.add_point(5, self.LAT + 0.009, self.LNG, ts=1090)
+        distance, measured = resolve_trip_distance(5, "3.5")
+        self.assertEqual(distance, measured)
+        self.assertAlmostEqual(measured, trip_meter.summary(5)["km"], places=3)
+
+        with mock.patch("api.trip_distance.get_redis", side_effect=RedisError("down")):
+            self.assertEqual(resolve_trip_distance(5, "3.5"), ("3.5", None))
+
+    @override_settings(TRIP_METER_MIN_POINTS=10, TRIP_METER_MAX_REJECTED_SHARE=0.3)
+    def test_resolve_falls_back_when_many_points_rejected(self):
+        for i in range(10):
+            trip_meter.add_point(6, self.LAT + 0.001 * i, self.LNG, ts=1000 + 10 * i)
+            if i % 2:
+                trip_meter.add_point(6, self.LAT + 0.045, self.LNG, ts=1005 + 10 * i)
+        summary = trip_meter.summary(6)
+        self.assertEqual((summary["points"], summary["rejected"]), (10, 5))
+        self.assertEqual(resolve_trip_distance(6, "3.5"), ("3.5", round(summary["km"], 3)))
+
+
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+class RideLocationSocketTests(TestCase):
+    def setUp(self):
+        patcher, _ = fake_redis("api.trip_distance")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.rider = User.objects.create(email="socket-rider@example.com", username="socket-rider", is_user=1)
+        self.driver = User.objects.create(email="socket-driver@example.com", username="socket-driver", is_driver=1)
+        self.stranger = User.objects.create(email="socket-x@example.com", username="socket-x", is_driver=1)
+        self.ride = Ride.objects.create(user=self.rider, driver=self.driver, pickup="A", drop="B", status="ongoing")
+
+    def communicator(self, user=None):
+        path = f"/ws/ride/{self.ride.id}/location/"
+        if user:
+            path += f"?token={AccessToken.for_user(user)}"
+        return WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+
+    def test_only_participants_connect(self):
+        async def run():
+            results = []
+            for user in (None, self.stranger, self.rider, self.driver):
+                communicator = self.communicator(user)
+                connected, _ = await communicator.connect()
+                results.append(connected)
+                await communicator.disconnect()
+            return results
+
+        self.assertEqual(async_to_sync(run)(), [False, False, True, True])
+
+    def test_only_driver_points_are_metered(self):
+        async def run():
+            driver, rider = self.communicator(self.driver), self.communicator(self.rider)
+            await driver.connect()
+            await rider.connect()
+            await rider.send_json_to({"lat": 13.5, "lng": 78.0, "kilo": 1})
+            self.assertTrue(await rider.receive_nothing())
+            for step in range(3):
+                await driver.send_json_to({"lat": 12.97 + 0.0001 * step, "lng": 77.59, "kilo": 1})
+                # Metering happens before the broadcast
+                self.assertEqual((await rider.receive_json_from())["lat"], 12.97 + 0.0001 * step)
+            await driver.disconnect()
+            await rider.disconnect()
+
+        async_to_sync(run)()
+        self.assertEqual(trip_meter.summary(self.ride.id)["points"], 3)
+
+
+class TrajectoryTests(TestCase):
+    def test_polyline_round_trip(self):
+        # The example from Google's polyline format documentation
+        points = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+        self.assertEqual(encode_polyline(points), "_p~iF~ps|U_ulLnnqC_mqNvxq`@")
+        self.assertEqual(decode_polyline("_p~iF~ps|U_ulLnnqC_mqNvxq`@"), points)
+
+        rng = random.Random(6)
+        for _ in range(200):
+            points = [(round(rng.uniform(-90, 90), 5), round(rng.uniform(-180, 180), 5)) for _ in range(rng.randint(0, 30))]
+            self.assertEqual(decode_polyline(encode_polyline(points)), points)
+            split = rng.randint(0, len(points))
+            head, tail = points[:split], points[split:]
+            self.assertEqual(encode_polyline(head) + encode_polyline(tail, start=head[-1] if head else None), encode_polyline(points))
+
+    def test_ring_wraps_and_reports_full(self):
+        buffer = TrajectoryBuffer(4)
+        full = [buffer.append(12.0 + i / 1000, 77.0) for i in range(3)]
+        # Standing still is not stored
+        full.append(buffer.append(12.002, 77.0))
+        full.append(buffer.append(12.003, 77.0))
+        self.assertEqual(full, [False, False, False, False, True])
+        self.assertTrue(buffer.append(12.004, 77.0))
+        self.assertTrue(buffer.append(12.005, 77.0))
+        self.assertEqual(buffer.points(), [(12.0 + i / 1000, 77.0) for i in range(2, 6)])
+        buffer.clear()
+        self.assertEqual((len(buffer), buffer.points()), (0, []))
+        buffer.append(1, 2)
+        self.assertEqual(buffer.points(), [(1.0, 2.0)])
+
+    @override_settings(
+        TRAJECTORY_MAX_POINTS=4,
+        CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    )
+    def test_long_trip_is_saved_in_segments(self):
+        patcher, _ = fake_redis("api.trip_distance")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        rider = User.objects.create(email="traj-rider@example.com", username="traj-rider", is_user=1)
+        driver = User.objects.create(email="traj-driver@example.com", username="traj-driver", is_driver=1)
+        ride = Ride.objects.create(user=rider, driver=driver, pickup="A", drop="B", status="ongoing")
+        points = [(12.97 + 0.0003 * i, 77.59 + 0.0001 * i) for i in range(11)]
+
+        async def run():
+            communicator = WebsocketCommunicator(
+                URLRouter(websocket_urlpatterns), f"/ws/ride/{ride.id}/location/?token={AccessToken.for_user(driver)}"
+            )
+            await communicator.connect()
+            for lat, lng in points:
+                await communicator.send_json_to({"lat": lat, "lng": lng, "kilo": 1})
+                await communicator.receive_json_from()
+            await communicator.disconnect()
+
+        async_to_sync(run)()
+        trajectory = RideTrajectory.objects.get(ride=ride)
+        self.assertEqual(trajectory.points(), [(round(lat, 5), round(lng, 5)) for lat, lng in points])
+        self.assertEqual(trajectory.point_count, 11)
+
+
+class LocationWriteTests(TestCase):
+    def setUp(self):
+        self.drivers = [
+            User.objects.create(email=f"loc{i}@example.com", username=f"loc{i}", is_driver=1) for i in range(5)
+        ]
+
+    def test_write_locations_in_chunks(self):
+        latest = {
+            driver.id: (12.9 + i / 100, 77.5 + i / 100, 1_700_000_000 + i) for i, driver in enumerate(self.drivers)
+        }
+        latest[10 ** 6] = (0, 0, 1_700_000_000)  # no such user
+        with self.assertNumQueries(3):
+            self.assertEqual(write_locations(latest, max_batch=2), 5)
+        for i, driver in enumerate(self.drivers):
+            driver.refresh_from_db()
+            self.assertEqual((driver.current_lat, driver.current_lng), (12.9 + i / 100, 77.5 + i / 100))
+            self.assertEqual(driver.last_location_update.timestamp(), 1_700_000_000 + i)
+
+    def test_buffer_keeps_latest_ping_and_flushes_full_batch(self):
+        buffer = LocationWriteBuffer(window_seconds=60, max_batch=3)
+        self.addCleanup(buffer.flush)
+        first, second, third = self.drivers[:3]
+        buffer.add(first.id, 1, 1)
+        buffer.add(first.id, 2, 2)
+        buffer.add(second.id, 3, 3)
+        self.assertEqual(buffer.stats(), {"pings_received": 3, "rows_written": 0, "flushes": 0, "pending": 2})
+        buffer.add(third.id, 4, 4)
+        self.assertEqual(buffer.stats(), {"pings_received": 4, "rows_written": 3, "flushes": 1, "pending": 0})
+        first.refresh_from_db()
+        self.assertEqual((first.current_lat, first.current_lng), (2.0, 2.0))
+
+    def test_last_pings_are_written_without_another_ping(self):
+        buffer = LocationWriteBuffer(window_seconds=0.05, max_batch=100)
+        written = threading.Event()
+        with mock.patch("api.location_buffer.write_locations", side_effect=lambda pending, _: written.set() or len(pending)) as write:
+            buffer.add(self.drivers[0].id, 1, 2, ts=100)
+            self.assertTrue(written.wait(5))
+        write.assert_called_once_with({self.drivers[0].id: (1.0, 2.0, 100)}, 100)
+        self.assertEqual(buffer.stats()["pending"], 0)
+
+    def test_failed_write_keeps_window(self):
+        buffer = LocationWriteBuffer(window_seconds=60, max_batch=100)
+        self.addCleanup(buffer.flush)
+        buffer.add(self.drivers[0].id, 1, 1)
+        with mock.patch("api.location_buffer.write_locations", side_effect=DatabaseError("gone")):
+            with self.assertRaises(DatabaseError):
+                buffer.flush()
+        self.assertEqual(buffer.stats()["pending"], 1)
+        self.assertEqual(buffer.flush(), 1)
+
+    def test_flush_task_keeps_drivers_dirty_when_write_fails(self):
+        patcher, redis = fake_redis("api.live_location")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        store = LiveLocationStore(ttl_seconds=60)
+        with mock.patch("api.tasks.live_locations", store):
+            for i, driver in enumerate(self.drivers[:2]):
+                store.update(driver.id, 12.9 + i, 77.5, ts=1_700_000_000)
+            with mock.patch("api.tasks.write_locations", side_effect=DatabaseError("gone")):
+                with self.assertRaises(DatabaseError):
+                    flush_driver_locations()
+            self.assertEqual(sorted(int(driver_id) for driver_id in redis.smembers("drivers:dirty")), [d.id for d in self.drivers[:2]])
+            self.assertIn("Flushed 2 driver locations", flush_driver_locations())
+        self.assertEqual(User.objects.get(id=self.drivers[1].id).current_lat, 13.9)
+        self.assertEqual(redis.scard("drivers:dirty"), 0)
+
+    def test_flush_runs_once_per_window(self):
+        schedule = settings.CELERY_BEAT_SCHEDULE["flush-driver-locations"]["schedule"]
+        self.assertEqual(schedule, timedelta(seconds=settings.LOCATION_WRITE_WINDOW_SECONDS))
+
+    def test_stats_endpoint(self):
+        admin = User.objects.create(email="loc-admin@example.com", username="loc-admin", is_staff=True)
+        client = APIClient()
+        client.force_authenticate(self.drivers[0])
+        self.assertEqual(client.get("/api/admin/location-write-stats/").status_code, 403)
+        client.force_authenticate(admin)
+        with mock.patch("api.views.live_locations.stats", return_value={"pings_received": 9, "rows_written": 2}):
+            response = client.get("/api/admin/location-write-stats/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["liveStore"], {"pings_received": 9, "rows_written": 2})
+        self.assertEqual(set(response.data["writeBuffer"]), {"pings_received", "rows_written", "flushes", "pending"})
+
+
+class LiveLocationTests(TestCase):
+    def setUp(self):
+        patcher, self.redis = fake_redis("api.live_location")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.store = LiveLocationStore(ttl_seconds=60)
+
+    def expire(self, driver_id):
+        # What Redis does once a driver's hash outlives LIVE_LOCATION_TTL_SECONDS
+        self.redis.delete(f"driver:{driver_id}:location")
+
+    def test_take_dirty_returns_latest_once(self):
+        self.store.update(1, 12.9, 77.5, ts=100)
+        self.store.update(1, 12.91, 77.51, heading=90, ts=105)
+        self.store.update(2, 13.0, 77.6, ts=101)
+        self.store.update(3, 13.1, 77.7, ts=102)
+        self.expire(3)
+        self.assertEqual(self.store.take_dirty(), {
+            1: {"lat": 12.91, "lng": 77.51, "heading": 90.0, "ts": 105.0},
+            2: {"lat": 13.0, "lng": 77.6, "ts": 101.0},
+        })
+        self.assertEqual(self.store.take_dirty(), {})
+        self.store.update(2, 13.2, 77.6, ts=110)
+        self.assertEqual(list(self.store.take_dirty()), [2])
+
+    def test_sweep_drops_expired_drivers(self):
+        for driver_id in (1, 2, 3):
+            self.store.update(driver_id, 12.9 + driver_id / 100, 77.5, ts=100)
+        self.assertEqual(self.redis.ttl("driver:1:location"), 60)
+        self.expire(2)
+        self.assertEqual(self.store.sweep_stale(), [2])
+        self.assertEqual(sorted(driver_id for driver_id, _, _ in self.store.positions()), [1, 3])
+        self.assertEqual(self.redis.zcard(GEO_KEY), 2)
+        self.assertEqual(self.store.sweep_stale(), [])
+
+    @override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+    def test_socket_indexes_only_online_drivers(self):
+        driver = User.objects.create(
+            email="live-driver@example.com", username="live-driver", is_driver=1, approval_state="approved", is_online=False
+        )
+        self.addCleanup(driver_index.remove, driver.id)
+        client = APIClient()
+        client.force_authenticate(driver)
+
+        async def run():
+            communicator = WebsocketCommunicator(
+                URLRouter(websocket_urlpatterns), f"/ws/driver/location/?token={AccessToken.for_user(driver)}"
+            )
+            await communicator.connect()
+            await communicator.receive_json_from()
+            positions = []
+            for lat, online in ((12.9, None), (12.95, True), (13.0, False)):
+                if online is not None:
+                    response = await sync_to_async(client.patch)(
+                        f"/api/driver/{driver.id}/online-status/", {"is_online": online}, format="json"
+                    )
+                    self.assertEqual(response.status_code, 200)
+                await communicator.send_json_to({"latitude": lat, "longitude": 77.5})
+                await communicator.receive_json_from()
+                geo = await sync_to_async(self.store.positions)()
+                positions.append((driver_index.position(driver.id), [driver_id for driver_id, _, _ in geo]))
+            await communicator.disconnect()
+            return positions
+
+        self.assertEqual(async_to_sync(run)(), [(None, []), ((12.95, 77.5), [driver.id]), (None, [])])
+        # The periodic rebuild from the GEO set does not bring the offline driver back
+        driver_index.rebuild(self.store.positions())
+        self.assertIsNone(driver_index.position(driver.id))
+        self.assertEqual(self.store.get(driver.id)["lat"], 13.0)
+
+    def test_offline_pings_stay_out_of_geo_set(self):
+        self.store.update(1, 12.9, 77.5, ts=100)
+        self.store.update(2, 13.0, 77.6, ts=100, online=False)
+        self.assertEqual([driver_id for driver_id, _, _ in self.store.positions()], [1])
+        self.store.update(1, 12.91, 77.5, ts=101, online=False)
+        self.assertEqual(self.store.positions(), [])
+        # Their positions are still written back to the user rows
+        self.assertEqual(sorted(self.store.take_dirty()), [1, 2])
+
+
+@override_settings(DRIVER_INDEX_ENABLED=False, DISPATCH_RINGS_KM=(1, 2, 5, 10), DISPATCH_SCORE_WEIGHTS={})
+class DispatchCandidateTests(TestCase):
+    def setUp(self):
+        self.drivers = {}
+        for km in (0.5, 0.8, 1.5, 3, 7, 12):
+            lat, lng = destination(12.9, 77.5, 90, km)
+            self.drivers[km] = User.objects.create(
+                email=f"cand{km}@example.com", username=f"cand{km}", is_driver=1, is_online=True, is_available=True,
+                fcm_token=f"token{km}", current_lat=lat, current_lng=lng,
+            )
+        patcher = mock.patch("api.dispatch.get_nearby_driver_rows", wraps=get_nearby_driver_rows)
+        self.rows = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def candidates(self, **kwargs):
+        self.rows.reset_mock()
+        candidates = find_dispatch_candidates(12.9, 77.5, **kwargs)
+        radii = [call.args[2] for call in self.rows.call_args_list]
+        return [c["distance_km"] for c in candidates], radii
+
+    def test_rings_widen_until_k_drivers(self):
+        self.assertEqual(self.candidates(k=2), ([0.5, 0.8], [1]))
+        self.assertEqual(self.candidates(k=3), ([0.5, 0.8, 1.5], [1, 2]))
+        self.assertEqual(self.candidates(k=4), ([0.5, 0.8, 1.5, 3], [1, 2, 5]))
+
+    def test_k_cuts_off_a_full_ring(self):
+        self.assertEqual(self.candidates(k=1), ([0.5], [1]))
+        self.assertEqual(self.candidates(k=1, exclude_ids=[self.drivers[0.5].id]), ([0.8], [1]))
+
+    def test_last_ring_caps_the_search(self):
+        self.assertEqual(self.candidates(k=10), ([0.5, 0.8, 1.5, 3, 7], [1, 2, 5, 10]))
+        User.objects.filter(is_driver=1).exclude(id=self.drivers[12].id).update(is_available=False)
+        self.assertEqual(self.candidates(k=10), ([], [1, 2, 5, 10]))
+
+    @override_settings(DISPATCH_SCORE_WEIGHTS={"rating": 2.0, "idle": 1.0}, DISPATCH_IDLE_CAP_MINUTES=60)
+    def test_scorers_reorder_by_rating_and_idle_time(self):
+        now = timezone.now()
+        rider = User.objects.create(email="cand-rider@example.com", username="cand-rider", is_user=1)
+        # 0.5 km: rated 1 star, just finished a ride; 0.8 km: unrated, idle 30 minutes;
+        # 1.5 km: rated 5 stars, never completed a ride
+        DriverRatingAggregate.objects.create(driver=self.drivers[0.5], rating_count=2, stars_sum=2, stars_1=2)
+        DriverRatingAggregate.objects.create(driver=self.drivers[1.5], rating_count=1, stars_sum=5, stars_5=1)
+        for km, minutes in ((0.5, 0), (0.8, 30)):
+            Ride.objects.create(
+                user=rider, driver=self.drivers[km], pickup="A", drop="B", status="completed",
+                completed_at=now - timedelta(minutes=minutes),
+            )
+        with mock.patch("django.utils.timezone.now", return_value=now):
+            candidates = find_dispatch_candidates(12.9, 77.5, k=3)
+        self.assertEqual([(c["distance_km"], c["score"]) for c in candidates], [
+            (1.5, round(1.5 - 2 * 1.0 - 1 * 1.0, 3)),
+            (0.8, round(0.8 - 2 * 0.5 - 1 * 0.5, 3)),
+            (0.5, round(0.5 - 2 * 0.0 - 1 * 0.0, 3)),
+        ])
+
+    def test_offer_tells_each_driver_their_own_distance(self):
+        rider = User.objects.create(email="offer-rider@example.com", username="offer-rider", is_user=1, mobile="98")
+        ride = Ride.objects.create(user=rider, pickup="A", drop="B", distance_km=4.25, driver_earnings=Decimal("80"))
+        candidates = [
+            {"driver_id": 1, "fcm_token": "a", "distance_km": 0.512},
+            {"driver_id": 2, "fcm_token": "b", "distance_km": 1.5},
+            {"driver_id": 3, "fcm_token": "c", "distance_km": 0.509},
+        ]
+        with mock.patch("api.dispatch.send_multicast", side_effect=lambda tokens, **kwargs: tokens) as send:
+            self.assertEqual(send_ride_offer(ride, candidates), [["a", "c"], ["b"]])
+        sent = {tuple(call.args[0]): call.kwargs["data"]["driver_to_pickup_km"] for call in send.call_args_list}
+        self.assertEqual(sent, {("a", "c"): "0.51", ("b",): "1.5"})
+        self.assertEqual(send.call_args.kwargs["data"]["pickup_to_drop_km"], "4.25")
+
+
+class DispatchWaveTests(TestCase):
+    def setUp(self):
+        patcher, self.redis = fake_redis("api.dispatch")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        rider = User.objects.create(email="wave-rider@example.com", username="wave-rider", is_user=1)
+        self.ride = Ride.objects.create(user=rider, pickup="A", drop="B", pickup_lat=12.9, pickup_lng=77.5)
+        self.offered = []
+
+        def candidates(lat, lng, vehicle_type=None, k=5, exclude_ids=()):
+            drivers = [driver_id for driver_id in range(1, 10) if driver_id not in exclude_ids][:2]
+            return [{"driver_id": driver_id, "fcm_token": f"t{driver_id}", "distance_km": 1.0} for driver_id in drivers]
+
+        for target, kwargs in (
+            ("api.tasks.find_dispatch_candidates", {"side_effect": candidates}),
+            ("api.tasks.send_ride_offer", {"side_effect": lambda ride, found: self.offered.append([c["driver_id"] for c in found])}),
+            ("api.tasks.dispatch_ride_wave.apply_async", {}),
+        ):
+            patcher = mock.patch(target, **kwargs)
+            setattr(self, target.rsplit(".", 1)[-1], patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def test_waves_skip_drivers_already_offered(self):
+        dispatch_ride_wave(self.ride.id)
+        dispatch_ride_wave(self.ride.id, wave=2)
+        self.assertEqual(self.offered, [[1, 2], [3, 4]])
+        self.assertEqual(self.apply_async.call_args.kwargs["args"], [self.ride.id, 3])
+
+    def test_waves_continue_without_redis(self):
+        with mock.patch("api.dispatch.get_redis", side_effect=RedisError("down")):
+            dispatch_ride_wave(self.ride.id)
+            dispatch_ride_wave(self.ride.id, wave=2)
+        # Without the offer set the same best drivers are offered again
+        self.assertEqual(self.offered, [[1, 2], [1, 2]])
+        self.assertEqual([call.kwargs["args"] for call in self.apply_async.call_args_list], [[self.ride.id, 2], [self.ride.id, 3]])
+
+        Ride.objects.filter(id=self.ride.id).update(status="cancelled")
+        with mock.patch("api.dispatch.get_redis", side_effect=RedisError("down")):
+            self.assertIn("dispatch stopped", dispatch_ride_wave(self.ride.id, wave=3))
+        self.assertEqual(self.apply_async.call_count, 2)
+
+
+def best_assignment(cost):
+    """(-matched pairs, total km) of the best assignment, by trying every one: most feasible pairs, then least distance"""
+    cost = np.asarray(cost)
+    if cost.shape[0] > cost.shape[1]:
+        cost = cost.T
+    n, m = cost.shape
+    best = (0, 0.0)
+    for cols in itertools.permutations(range(m), n):
+        feasible = [cost[row, col] for row, col in enumerate(cols) if cost[row, col] < INFEASIBLE]
+        best = min(best, (-len(feasible), sum(feasible)))
+    return best
+
+
+def assignment_score(cost, pairs):
+    feasible = [cost[row, col] for row, col in pairs if cost[row, col] < INFEASIBLE]
+    return -len(feasible), sum(feasible)
+
+
+class BatchDispatchTests(TestCase):
+    def test_hungarian_matches_brute_force(self):
+        rng = np.random.default_rng(11)
+        for _ in range(300):
+            n, m = rng.integers(1, 7, size=2)
+            cost = rng.random((n, m)) * 10
+            cost[rng.random((n, m)) < rng.choice([0, 0.3, 0.7, 1])] = INFEASIBLE
+            pairs = hungarian(cost)
+            self.assertEqual(len(pairs), min(n, m))
+            self.assertEqual(len({row for row, _ in pairs}), len(pairs))
+            self.assertEqual(len({col for _, col in pairs}), len(pairs))
+            matched, km = assignment_score(cost, pairs)
+            best_matched, best_km = best_assignment(cost)
+            self.assertEqual(matched, best_matched)
+            self.assertAlmostEqual(km, best_km, places=9)
+
+    def test_cost_matrix_matches_pairwise_rules(self):
+        rng = random.Random(11)
+        types = ["Car", "Bike", "Auto", None]
+        for _ in range(50):
+            rides = [(12.9 + rng.uniform(-0.1, 0.1), 77.5 + rng.uniform(-0.1, 0.1), rng.choice(types + ["any"])) for _ in range(rng.randint(0, 5))]
+            drivers = [(12.9 + rng.uniform(-0.1, 0.1), 77.5 + rng.uniform(-0.1, 0.1), rng.choice(types)) for _ in range(rng.randint(0, 5))]
+            blocked = [(row, col) for row in range(len(rides)) for col in range(len(drivers)) if rng.random() < 0.1]
+            cost = build_cost_matrix(rides, drivers, 8, blocked)
+            self.assertEqual(cost.shape, (len(rides), len(drivers)))
+            for (row, (lat, lng, ride_type)), (col, (d_lat, d_lng, driver_type)) in itertools.product(enumerate(rides), enumerate(drivers)):
+                km = haversine_km(lat, lng, d_lat, d_lng)
+                feasible = (
+                    km <= 8 and (row, col) not in blocked
+                    and (not ride_type or ride_type == "any" or ride_type.lower() == (driver_type or "").lower())
+                )
+                if feasible:
+                    self.assertAlmostEqual(cost[row, col], km, places=9)
+                else:
+                    self.assertEqual(cost[row, col], INFEASIBLE)
+
+    @override_settings(BATCH_DISPATCH_MAX_PICKUP_KM=6, BATCH_DISPATCH_MAX_RIDES=50)
+    def test_plan_is_optimal(self):
+        rng = random.Random(12)
+        rider = User.objects.create(email="batch-rider@example.com", username="batch-rider", is_user=1)
+        rides = [
+            Ride.objects.create(
+                user=rider, pickup="A", drop="B", vehicle_type=rng.choice(["Car", "Bike"]),
+                pickup_lat=12.9 + rng.uniform(-0.03, 0.03), pickup_lng=77.5 + rng.uniform(-0.03, 0.03),
+            )
+            for _ in range(5)
+        ]
+        drivers = [
+            User.objects.create(
+                email=f"batch{i}@example.com", username=f"batch{i}", is_driver=1, is_online=True, is_available=True,
+                fcm_token=f"token{i}", vehicle_type=rng.choice(["Car", "Bike"]),
+                current_lat=12.9 + rng.uniform(-0.04, 0.04), current_lng=77.5 + rng.uniform(-0.04, 0.04),
+            )
+            for i in range(6)
+        ]
+        rides[0].rejected_by.add(drivers[0], drivers[1])
+
+        with mock.patch.object(driver_index, "ensure_fresh"), mock.patch.object(driver_index, "position", return_value=None):
+            plan = plan_batch_assignment()
+
+        cost = np.full((len(rides), len(drivers)), INFEASIBLE)
+        for (row, ride), (col, driver) in itertools.product(enumerate(rides), enumerate(drivers)):
+            km = haversine_km(ride.pickup_lat, ride.pickup_lng, driver.current_lat, driver.current_lng)
+            if km <= 6 and ride.vehicle_type == driver.vehicle_type and not (row == 0 and col < 2):
+                cost[row, col] = km
+        column = {driver.id: col for col, driver in enumerate(drivers)}
+        self.assertEqual(len({driver_id for _, driver_id, _, _ in plan}), len(plan))
+        for ride, driver_id, token, km in plan:
+            self.assertEqual(token, f"token{column[driver_id]}")
+            self.assertAlmostEqual(km, cost[rides.index(ride), column[driver_id]], places=9)
+        matched, km = -len(plan), sum(km for _, _, _, km in plan)
+        best_matched, best_km = best_assignment(cost)
+        # Most rides can be served, some by more than one driver
+        self.assertLessEqual(best_matched, -3)
+        self.assertEqual(matched, best_matched)
+        self.assertAlmostEqual(km, best_km, places=9)
+
+
+def random_points(rng, n, lat, lng, spread):
+    return [(lat + rng.uniform(-spread, spread), lng + rng.uniform(-spread, spread)) for _ in range(n)]
+
+
+def destination(lat, lng, bearing, km):
+    """(lat, lng) `km` from (lat, lng) along `bearing` degrees on the haversine sphere"""
+    phi, lam, theta = math.radians(lat), math.radians(lng), math.radians(bearing)
+    d = km / 6371.0
+    phi2 = math.asin(math.sin(phi) * math.cos(d) + math.cos(phi) * math.sin(d) * math.cos(theta))
+    lam2 = lam + math.atan2(math.sin(theta) * math.sin(d) * math.cos(phi), math.cos(d) - math.sin(phi) * math.sin(phi2))
+    return math.degrees(phi2), (math.degrees(lam2) + 540) % 360 - 180
+
+
+def in_box(box, lat, lng):
+    min_lat, max_lat, min_lng, max_lng = box
+    if min_lng <= max_lng:
+        return min_lat <= lat <= max_lat and min_lng <= lng <= max_lng
+    return min_lat <= lat <= max_lat and (lng >= min_lng or lng <= max_lng)
+
+
+def scan(lat, lng, points, radius_km=None):
+    """[(distance_km, index)] of `points` within radius_km of (lat, lng), nearest first, by a plain haversine loop"""
+    matches = [(haversine_km(lat, lng, p_lat, p_lng), i) for i, (p_lat, p_lng) in enumerate(points)]
+    return sorted(match for match in matches if radius_km is None or match[0] <= radius_km)
+
+
+class DistanceTests(TestCase):
+    def test_haversine_many_matches_haversine(self):
+        rng = random.Random(21)
+        points = random_points(rng, 200, 0, 0, 90) + [(90, 0), (-90, 180), (0, 180), (0, -180)]
+        lats, lngs = zip(*points)
+        for lat, lng in random_points(rng, 20, 0, 0, 90) + [(0, 179.999), (89.999, 0)]:
+            expected = [haversine_km(lat, lng, p_lat, p_lng) for p_lat, p_lng in points]
+            np.testing.assert_allclose(haversine_many(lat, lng, lats, lngs), expected, rtol=1e-9, atol=1e-9)
+
+    def test_rank_by_distance_matches_scan(self):
+        rng = random.Random(22)
+        for _ in range(100):
+            points = random_points(rng, rng.randint(1, 40), 12.9, 77.5, 0.1)
+            lats, lngs = zip(*points)
+            lat, lng = random_points(rng, 1, 12.9, 77.5, 0.1)[0]
+            radius_km = rng.choice([None, 0.5, 3, 8, 50])
+            # k past the number of points (and past the number in range) skips argpartition
+            k = rng.choice([None, 1, 2, len(points) - 1, len(points), len(points) + 5])
+            expected = scan(lat, lng, points, radius_km)
+            if k is not None:
+                expected = expected[:k]
+            indices, distances = rank_by_distance(lat, lng, lats, lngs, radius_km=radius_km, k=k)
+            self.assertEqual(list(indices), [i for _, i in expected])
+            np.testing.assert_allclose(distances, [km for km, _ in expected], rtol=1e-9)
+
+    def test_rank_by_distance_edges(self):
+        indices, distances = rank_by_distance(0, 0, [], [], radius_km=5, k=3)
+        self.assertEqual((indices.size, distances.size), (0, 0))
+        indices, _ = rank_by_distance(0, 0, [0.01, 0.01, 0.02], [0, 0, 0], k=2)
+        self.assertEqual(list(indices), [0, 1])
+        indices, _ = rank_by_distance(0, 0, [1, 2], [0, 0], radius_km=0.5, k=1)
+        self.assertEqual(list(indices), [])
+
+    def test_bounding_box_holds_every_point_in_range(self):
+        rng = random.Random(23)
+        centers = random_points(rng, 40, 0, 0, 89.9) + [
+            (12.9, 179.99), (12.9, -179.99), (-33.9, 180.0), (89.99, 10), (-89.99, -170), (90, 0), (84, 179.9), (0, 0),
+        ]
+        for lat, lng in centers:
+            for radius_km in (0.5, 5, 50, 800):
+                box = bounding_box(lat, lng, radius_km)
+                self.assertTrue(-90 <= box[0] <= box[1] <= 90)
+                self.assertTrue(-180 <= box[2] <= 180 and -180 <= box[3] <= 180)
+                for _ in range(50):
+                    point = destination(lat, lng, rng.uniform(0, 360), radius_km * rng.choice([rng.random(), 0.999999]))
+                    self.assertLessEqual(haversine_km(lat, lng, *point), radius_km)
+                    self.assertTrue(in_box(box, *point), (lat, lng, radius_km, point, box))
+
+    def test_bounding_box_wraps_and_clamps(self):
+        min_lat, max_lat, min_lng, max_lng = bounding_box(12.9, 179.99, 5)
+        self.assertGreater(min_lng, max_lng)
+        self.assertTrue(in_box((min_lat, max_lat, min_lng, max_lng), 12.9, -179.99))
+        self.assertFalse(in_box((min_lat, max_lat, min_lng, max_lng), 12.9, 0))
+        # Every longitude is within reach once the radius covers the pole
+        self.assertEqual(bounding_box(89.99, 10, 5), (89.99 - 5 / (6371.0 * math.pi / 180), 90.0, -180.0, 180.0))
+        self.assertEqual(bounding_box(-90, 0, 1)[::2], (-90.0, -180.0))
+        # Away from the edges the box stays tight
+        min_lat, max_lat, min_lng, max_lng = bounding_box(12.9, 77.5, 5)
+        self.assertAlmostEqual(haversine_km(min_lat, 77.5, 12.9, 77.5), 5, places=6)
+        self.assertLess(haversine_km(12.9, max_lng, 12.9, 77.5), 5.1)
+
+    def test_nearby_drivers_across_antimeridian(self):
+        for i, lng in enumerate((179.99, -179.99, -179.9, 170.0)):
+            User.objects.create(
+                email=f"far{i}@example.com", username=f"far{i}", is_driver=1, is_online=True, is_available=True,
+                fcm_token=f"far{i}", current_lat=-17.0, current_lng=lng,
+            )
+        with override_settings(DRIVER_INDEX_ENABLED=False):
+            rows = get_nearby_driver_rows(-17.0, 179.995, radius_km=15)
+            driver, km = get_nearest_driver_distance(-17.0, -179.999)
+        self.assertEqual([token for _, token, _ in rows], ["far0", "far1", "far2"])
+        self.assertEqual((driver.username, km), ("far1", 0.96))
+
+
+class DriverGridIndexTests(TestCase):
+    def assertMatchesScan(self, found, points, lat, lng, radius_km, k=None):
+        expected = scan(lat, lng, points, radius_km)[:k]
+        self.assertEqual([driver_id for _, driver_id in found], [i for _, i in expected], (lat, lng, radius_km, k))
+        np.testing.assert_allclose([km for km, _ in found], [km for km, _ in expected], rtol=1e-9)
+
+    def check(self, index, points, queries, radii, ks=(1, 3, 10)):
+        for lat, lng in queries:
+            for radius_km in radii:
+                self.assertMatchesScan(index.within_radius(lat, lng, radius_km), points, lat, lng, radius_km)
+                for k in ks + (len(points) + 2,):
+                    self.assertMatchesScan(index.nearest(lat, lng, k=k, max_radius_km=radius_km), points, lat, lng, radius_km, k)
+
+    def test_city_matches_scan(self):
+        rng = random.Random(31)
+        index = DriverGridIndex(cell_size_km=1.0)
+        points = random_points(rng, 400, 12.9, 77.5, 0.15)
+        index.rebuild((i, lat, lng) for i, (lat, lng) in enumerate(points))
+        cell = index.cell_size_deg
+        # Queries on cell corners and edges, with radii that are whole numbers of cells
+        queries = random_points(rng, 20, 12.9, 77.5, 0.15) + [
+            (math.floor(12.9 / cell) * cell, math.floor(77.5 / cell) * cell),
+            (math.floor(12.95 / cell) * cell, 77.51),
+            (12.85, math.ceil(77.45 / cell) * cell),
+        ]
+        self.check(index, points, queries, (0.3, 1, 2, 5, 50))
+
+    def test_high_latitudes_and_antimeridian_match_scan(self):
+        rng = random.Random(32)
+        for lat, lng in ((69.6, 18.9), (84.0, -40.0), (89.95, 0), (-89.99, 120), (-17.0, 179.95), (65.0, -179.98)):
+            index = DriverGridIndex(cell_size_km=1.0)
+            points = [destination(lat, lng, rng.uniform(0, 360), rng.uniform(0, 40)) for _ in range(150)]
+            index.rebuild((i, p_lat, p_lng) for i, (p_lat, p_lng) in enumerate(points))
+            queries = [(lat, lng)] + [destination(lat, lng, rng.uniform(0, 360), rng.uniform(0, 5)) for _ in range(5)]
+            self.check(index, points, queries, (1, 5, 20))
+
+    def test_updates_match_scan(self):
+        rng = random.Random(33)
+        index = DriverGridIndex(cell_size_km=0.5)
+        points = {}
+        for _ in range(500):
+            driver_id = rng.randrange(60)
+            if rng.random() < 0.2:
+                index.remove(driver_id)
+                points.pop(driver_id, None)
+            else:
+                points[driver_id] = random_points(rng, 1, 12.9, 77.5, 0.05)[0]
+                index.update(driver_id, *points[driver_id])
+        self.assertEqual(len(index), len(points))
+        # scan() reports list positions; give it every id up to the largest, with absent ones far away
+        ids = range(max(points) + 1)
+        everyone = [points.get(driver_id, (-60.0, 0.0)) for driver_id in ids]
+        self.check(index, everyone, random_points(rng, 10, 12.9, 77.5, 0.05), (0.5, 2, 8), ks=(1, 5))
+
+    def test_nearest_unbounded_reaches_far_drivers(self):
+        index = DriverGridIndex(cell_size_km=1.0)
+        points = [(12.9, 77.5), (12.91, 77.5), (-33.9, 151.2), (51.5, -0.1)]
+        index.rebuild((i, lat, lng) for i, (lat, lng) in enumerate(points))
+        self.assertMatchesScan(index.nearest(13.0, 77.6, k=3), points, 13.0, 77.6, None, 3)
+        self.assertMatchesScan(index.nearest(40.7, -74.0, k=10), points, 40.7, -74.0, None, 10)
+
+
+class NearestDriverTests(TestCase):
+    def setUp(self):
+        # A ring of busy drivers within 1 km of the pickup, more than one batch of candidates
+        for i in range(12):
+            lat, lng = destination(12.9, 77.5, i * 30, 0.2 + i / 20)
+            User.objects.create(
+                email=f"busy{i}@example.com", username=f"busy{i}", is_driver=1, is_online=True, is_available=False,
+                current_lat=lat, current_lng=lng,
+            )
+        lat, lng = destination(12.9, 77.5, 45, 3.34)
+        self.free = User.objects.create(
+            email="free@example.com", username="free", is_driver=1, is_online=True, is_available=True,
+            current_lat=lat, current_lng=lng,
+        )
+        self.index = DriverGridIndex(cell_size_km=1.0)
+        self.index.rebuild(User.objects.values_list("id", "current_lat", "current_lng"))
+        patcher = mock.patch("api.utils.driver_index", self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.index.ensure_fresh = mock.Mock()
+
+    def test_skips_busy_drivers_closer_than_the_free_one(self):
+        for enabled in (True, False):
+            with self.subTest(index=enabled), override_settings(DRIVER_INDEX_ENABLED=enabled):
+                driver, km = get_nearest_driver_distance(12.9, 77.5)
+                self.assertEqual((driver.id, km), (self.free.id, 3.34))
+
+    def test_no_available_driver(self):
+        User.objects.filter(id=self.free.id).update(is_available=False)
+        for enabled in (True, False):
+            with self.subTest(index=enabled), override_settings(DRIVER_INDEX_ENABLED=enabled):
+                self.assertEqual(get_nearest_driver_distance(12.9, 77.5), (None, None))
+                self.assertEqual(get_nearest_driver_distance(12.9, 77.5, max_radius_km=2), (None, None))
+        with override_settings(DRIVER_INDEX_ENABLED=True):
+            User.objects.filter(id=self.free.id).update(is_available=True)
+            self.assertEqual(get_nearest_driver_distance(12.9, 77.5, max_radius_km=2), (None, None))
+
+
+class WalletLedgerTests(TestCase):
+    def setUp(self):
+        driver = User.objects.create(email="ledger-driver@example.com", username="ledger-driver", is_driver=1)
+        self.wallet = DriverWallet.objects.create(driver=driver)
+
+    def test_insufficient_balance_writes_nothing(self):
+        credit(self.wallet, "50.00", "deposit")
+        with self.assertRaisesMessage(ValueError, "Insufficient balance"):
+            debit(self.wallet, "50.01", "withdrawal")
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal("50.00"))
+        self.assertEqual(list(self.wallet.transactions.values_list("transaction_type", flat=True)), ["deposit"])
+        self.assertEqual(debit(self.wallet, "50.00", "withdrawal"), Decimal("0.00"))
+
+    def test_allow_negative_overdraws(self):
+        credit(self.wallet, "10.00", "deposit")
+        self.assertEqual(debit(self.wallet, "25.00", "refund", allow_negative=True), Decimal("-15.00"))
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal("-15.00"))
+        self.assertEqual(self.wallet.transactions.get(transaction_type="refund").balance_after, Decimal("-15.00"))
+
+    def test_debit_checks_the_stored_balance(self):
+        credit(self.wallet, "100.00", "deposit")
+        # Two requests that both loaded the wallet while it held 100
+        first, second = DriverWallet.objects.get(id=self.wallet.id), DriverWallet.objects.get(id=self.wallet.id)
+        self.assertEqual(debit(first, "70.00", "withdrawal"), Decimal("30.00"))
+        with self.assertRaises(ValueError):
+            debit(second, "70.00", "withdrawal")
+        self.assertEqual(second.balance, Decimal("100.00"))
+        self.assertEqual(self.wallet.transactions.filter(transaction_type="withdrawal").count(), 1)
+
+
+class AdminWalletShardTests(TestCase):
+    def setUp(self):
+        self.admin_wallet = AdminWallet.objects.create(name="Ledger Wallet")
+
+    @override_settings(ADMIN_WALLET_SHARDS=4)
+    def test_shard_credits_sum_to_totals(self):
+        postings = [(Decimal("10.25"), Decimal("1.50")), (Decimal("3.10"), Decimal("0")), (Decimal("7.00"), Decimal("2.25"))]
+        with mock.patch("api.wallet_ledger.random.randrange", side_effect=itertools.cycle(range(4))):
+            for commission, gst in postings * 3:
+                self.admin_wallet.collect_commission(commission)
+                self.admin_wallet.collect_gst(gst)
+            add_to_admin_totals(self.admin_wallet, Decimal("5.00"), totals={"total_commission": Decimal("5.00")})
+        commission = sum(c for c, _ in postings) * 3 + Decimal("5.00")
+        gst = sum(g for _, g in postings) * 3
+        self.assertEqual(self.admin_wallet.totals(), {"balance": commission + gst, "total_commission": commission, "total_gst": gst})
+        shards = AdminWalletShard.objects.filter(wallet=self.admin_wallet)
+        self.assertEqual(shards.count(), 4)
+        self.assertEqual(shards.exclude(balance=0).count(), 4)
+        self.assertEqual(AdminWallet.objects.get(id=self.admin_wallet.id).balance, Decimal("0.00"))
+
+    @override_settings(ADMIN_WALLET_SHARDS=4)
+    def test_compaction_moves_shards_into_wallet(self):
+        with mock.patch("api.wallet_ledger.random.randrange", side_effect=itertools.cycle(range(4))):
+            for amount in ("1.00", "2.00", "3.00"):
+                self.admin_wallet.collect_commission(Decimal(amount))
+            self.admin_wallet.collect_gst(Decimal("0.50"))
+        totals = self.admin_wallet.totals()
+        self.assertEqual(compact_admin_wallets(), 4)
+        self.admin_wallet.refresh_from_db()
+        self.assertEqual(
+            (self.admin_wallet.balance, self.admin_wallet.total_commission, self.admin_wallet.total_gst),
+            (Decimal("6.50"), Decimal("6.00"), Decimal("0.50")),
+        )
+        self.assertEqual(self.admin_wallet.totals(), totals)
+        self.assertFalse(
+            AdminWalletShard.objects.filter(wallet=self.admin_wallet)
+            .exclude(balance=0, total_commission=0, total_gst=0).exists()
+        )
+        self.assertEqual(compact_admin_wallets(), 0)
+
+    def test_debit_covered_by_uncompacted_shards(self):
+        self.admin_wallet.deposit(Decimal("100.00"))
+        self.assertEqual(AdminWallet.objects.get(id=self.admin_wallet.id).balance, Decimal("0.00"))
+        self.assertEqual(self.admin_wallet.withdraw(Decimal("60.00")), Decimal("40.00"))
+        with self.assertRaises(ValueError):
+            self.admin_wallet.withdraw(Decimal("40.01"))
+        self.assertEqual(self.admin_wallet.totals()["balance"], Decimal("40.00"))
+        self.assertEqual(self.admin_wallet.transactions.filter(transaction_type="withdrawal").count(), 1)
+        compact_admin_wallets()
+        self.assertEqual(self.admin_wallet.totals()["balance"], Decimal("40.00"))
+
+
+class ConcurrentDebitTests(TransactionTestCase):
+    def test_concurrent_debits_cannot_overdraw(self):
+        driver = User.objects.create(email="debit-driver@example.com", username="debit-driver", is_driver=1)
+        wallet = DriverWallet.objects.create(driver=driver)
+        credit(wallet, "100.00", "deposit")
+        barrier = threading.Barrier(4)
+        results = []
+
+        def withdraw():
+            stale = DriverWallet.objects.get(id=wallet.id)
+            barrier.wait()
+            try:
+                for _ in range(200):
+                    try:
+                        results.append(debit(stale, "40.00", "withdrawal"))
+                    except ValueError:
+                        results.append(None)
+                    except OperationalError:
+                        # SQLite's shared-cache test database fails instead of waiting for the write lock
+                        time.sleep(0.01)
+                        continue
+                    break
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=withdraw) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(results, key=str), [Decimal("20.00"), Decimal("60.00"), None, None])
+        wallet.refresh_from_db()
+        self.assertEqual(wallet.balance, Decimal("20.00"))
+        self.assertEqual(wallet.transactions.filter(transaction_type="withdrawal").count(), 2)
@@ -0,0 +1,124 @@
+from datetime import datetime, time, timedelta
+
+from django.db.models import Count, DateField
+from django.db.models.functions import TruncDay, TruncHour, TruncMonth, TruncWeek
+from django.utils import timezone
+
+TRUNCATIONS = {"hour": TruncHour, "day": TruncDay, "week": TruncWeek, "month": TruncMonth}
+GRANULARITIES = tuple(TRUNCATIONS)
+LABEL_FORMATS = {"hour": "%H:00", "day": "%d %b", "week": "%d %b", "month": "%b %Y"}
+MAX_BUCKETS = 1000
+
+
+def _check(granularity):
+    if granularity not in TRUNCATIONS:
+        raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+
+
+def bucket_of(value, granularity):
+    """The bucket (local-time hour datetime, or date for day/week/month) that `value` falls in"""
+    _check(granularity)
+    if granularity == "hour":
+        if not isinstance(value, datetime):
+            value = datetime.combine(value, time.min)
+        if timezone.is_naive(value):
+            value = timezone.make_aware(value)
+        return timezone.localtime(value).replace(minute=0, second=0, microsecond=0)
+    if isinstance(value, datetime):
+        value = timezone.localdate(value) if timezone.is_aware(value) else value.date()
+    if granularity == "week":
+        return value - timedelta(days=value.weekday())
+    if granularity == "month":
+        return value.replace(day=1)
+    return value
+
+
+def next_bucket(bucket, granularity):
+    if granularity == "hour":
+        return bucket + timedelta(hours=1)
+    if granularity == "week":
+        return bucket + timedelta(days=7)
+    if granularity == "month":
+        return (bucket.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return bucket + timedelta(days=1)
+
+
+def buckets(start, end, granularity):
+    """Every bucket from the one holding `start` to the one holding `end`, inclusive"""
+    if granularity == "hour" and not isinstance(end, datetime):
+        # A date as the end of an hourly range means through its last hour
+        end = datetime.combine(end, time(23))
+    bucket, last = bucket_of(start, granularity), bucket_of(end, granularity)
+    result = []
+    while bucket <= last:
+        result.append(bucket)
+        bucket = next_bucket(bucket, granularity)
+    return result
+
+
+def _as_datetime(bucket):
+    if isinstance(bucket, datetime):
+        return bucket
+    return timezone.make_aware(datetime.combine(bucket, time.min))
+
+
+def label(bucket, granularity, label_format=None):
+    return bucket.strftime(label_format or LABEL_FORMATS[granularity])
+
+
+def time_series(queryset, field, start, end, granularity="day", **aggregates):
+    """
+    [(bucket, {name: value})] for every bucket between `start` and `end`
+    (dates or datetimes, inclusive), computed with one GROUP BY over the
+    truncated `field`. `aggregates` default to a row count; buckets with no
+    rows are filled with 0. The range filter is on `field` itself, not a
+    function of it, so an index on it can be used.
+    """
+    aggregates = aggregates or {"count": Count("pk")}
+    keys = buckets(start, end, granularity)
+    if granularity == "hour":
+        trunc = TruncHour(field)
+    else:
+        trunc = TRUNCATIONS[granularity](field, output_field=DateField())
+    rows = queryset.filter(**{
+        f"{field}__gte": _as_datetime(keys[0]),
+        f"{field}__lt": _as_datetime(next_bucket(keys[-1], granularity)),
+    }).annotate(bucket=trunc).values("bucket").annotate(**aggregates).order_by("bucket")
+
+    filled = {key: dict.fromkeys(aggregates, 0) for key in keys}
+    for row in rows:
+        bucket = row.pop("bucket")
+        if isinstance(bucket, datetime) and granularity != "hour":
+            bucket = bucket.date()
+        filled[bucket] = {name: row[name] or 0 for name in aggregates}
+    return list(filled.items())
+
+
+def parse_range(params, default_days=7):
+    """
+    (start, end, granularity) from `start`/`end` (YYYY-MM-DD) and
+    `granularity` query params; the range defaults to the last
+    `default_days` days and the granularity to day. Raises ValueError.
+    """
+    granularity = params.get("granularity") or "day"
+    _check(granularity)
+    end = params.get("end")
+    end = datetime.strptime(end, "%Y-%m-%d").date() if end else timezone.localdate()
+    start = params.get("start")
+    start = datetime.strptime(start, "%Y-%m-%d").date() if start else end - timedelta(days=default_days - 1)
+    if start > end:
+        raise ValueError("start must not be after end")
+    if len(buckets(start, end, granularity)) > MAX_BUCKETS:
+        raise ValueError(f"range has more than {MAX_BUCKETS} {granularity} buckets")
+    return start, end, granularity
+
+
+def series_payload(series, granularity, label_format=None):
+    """Chart-friendly {"labels", "buckets", <aggregate>: [...]} lists of a time_series() result"""
+    payload = {
+        "labels": [label(bucket, granularity, label_format) for bucket, _ in series],
+        "buckets": [bucket.isoformat() for bucket, _ in series],
+    }
+    for name in (series[0][1] if series else {}):
+        payload[name] = [values[name] for _, values in series]
+    return payload
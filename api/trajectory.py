@@ -0,0 +1,116 @@
+from array import array
+
+from .distance import haversine_km
+
+# Coordinates are stored as integers in 1e-5 degrees (~1.1 m), the precision of
+# the Google encoded polyline format.
+PRECISION = 100000
+
+
+def _to_e5(value):
+    return int(round(float(value) * PRECISION))
+
+
+def encode_polyline(points, start=None):
+    """
+    Encode [(lat, lng)] as a Google polyline: zigzag varints of E5 deltas.
+    With `start`, the last point of an existing polyline, the result
+    continues that one and can be appended to it.
+    """
+    chunks = []
+    prev_lat, prev_lng = (_to_e5(start[0]), _to_e5(start[1])) if start else (0, 0)
+    for lat, lng in points:
+        lat, lng = _to_e5(lat), _to_e5(lng)
+        for delta in (lat - prev_lat, lng - prev_lng):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                chunks.append(chr((0x20 | (value & 0x1F)) + 63))
+                value >>= 5
+            chunks.append(chr(value + 63))
+        prev_lat, prev_lng = lat, lng
+    return "".join(chunks)
+
+
+def decode_polyline(encoded):
+    """Inverse of encode_polyline, returns [(lat, lng)] floats"""
+    points = []
+    index = lat = lng = 0
+    length = len(encoded)
+    while index < length:
+        deltas = []
+        for _ in range(2):
+            result = shift = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1F) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        points.append((lat / PRECISION, lng / PRECISION))
+    return points
+
+
+def path_distance_km(points):
+    """Sum of haversine legs along [(lat, lng)]"""
+    return sum(
+        haversine_km(lat1, lng1, lat2, lng2)
+        for (lat1, lng1), (lat2, lng2) in zip(points, points[1:])
+    )
+
+
+class TrajectoryBuffer:
+    """
+    Fixed-size ring of E5 integer coordinates backed by two array('i').
+
+    Memory stays at 8 bytes per slot however long the ride runs. append
+    reports when the ring is full so the owner can save it as a segment and
+    clear it; only if that does not happen are the oldest points
+    overwritten. Consecutive duplicates (driver standing still) are not
+    stored.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._lats = array("i", bytes(4 * capacity))
+        self._lngs = array("i", bytes(4 * capacity))
+        self._start = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def full(self):
+        return self._size == self.capacity
+
+    def append(self, lat, lng):
+        """Buffer a point; returns True once the ring is full"""
+        lat, lng = _to_e5(lat), _to_e5(lng)
+        if self._size:
+            last = (self._start + self._size - 1) % self.capacity
+            if self._lats[last] == lat and self._lngs[last] == lng:
+                return self.full
+        if self._size < self.capacity:
+            slot = (self._start + self._size) % self.capacity
+            self._size += 1
+        else:
+            slot = self._start
+            self._start = (self._start + 1) % self.capacity
+        self._lats[slot] = lat
+        self._lngs[slot] = lng
+        return self.full
+
+    def points(self):
+        """Buffered points oldest first as (lat, lng) floats"""
+        return [
+            (self._lats[slot] / PRECISION, self._lngs[slot] / PRECISION)
+            for slot in ((self._start + i) % self.capacity for i in range(self._size))
+        ]
+
+    def clear(self):
+        self._start = 0
+        self._size = 0
@@ -0,0 +1,151 @@
+import logging
+import time
+
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from .distance import haversine_km
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+def _meter_key(ride_id):
+    return f"ride:{ride_id}:meter"
+
+
+class TripDistanceMeter:
+    """
+    Driven distance of a ride, accumulated as location points stream in.
+
+    Per point (O(1), one hash per ride in Redis):
+    - points implying a speed above max_speed_kmph since the last accepted
+      point are rejected as GPS outliers; after reseed_after rejections in a
+      row the last accepted point is taken to be the bad one, and the meter
+      restarts from the new point without counting the jump;
+    - accepted points are smoothed with an exponential moving average;
+    - distance is only added once the smoothed position has moved at least
+      min_step_m from the last counted point, so jitter while standing still
+      does not accumulate.
+    Completion then just reads the running total.
+    """
+
+    def __init__(self, min_step_m=10, max_speed_kmph=150, smoothing=0.5, reseed_after=5, ttl_seconds=86400):
+        self.min_step_km = min_step_m / 1000
+        self.max_speed_kmph = max_speed_kmph
+        self.reseed_after = reseed_after
+        self.smoothing = smoothing
+        self.ttl_seconds = ttl_seconds
+
+    def advance(self, state, lat, lng, ts):
+        """
+        (fields to write, accepted) for a new point given the ride's current
+        `state` (empty for the first point). A rejected outlier only bumps the
+        rejected and consecutive-rejection (streak) counters.
+        """
+        if not state:
+            return {
+                "lat": lat, "lng": lng, "anchor_lat": lat, "anchor_lng": lng,
+                "ts": ts, "km": 0, "points": 1, "rejected": 0, "streak": 0,
+            }, True
+
+        prev_lat, prev_lng, prev_ts = float(state["lat"]), float(state["lng"]), float(state["ts"])
+        elapsed_hours = max(ts - prev_ts, 1) / 3600
+        if haversine_km(prev_lat, prev_lng, lat, lng) / elapsed_hours > self.max_speed_kmph:
+            streak = int(state.get("streak", 0)) + 1
+            if streak < self.reseed_after:
+                return {"rejected": int(state["rejected"]) + 1, "streak": streak}, False
+            logger.info(f"Trip meter re-seeded after {streak} rejected points in a row")
+            return {
+                "lat": lat, "lng": lng, "anchor_lat": lat, "anchor_lng": lng,
+                "ts": ts, "points": int(state["points"]) + 1, "streak": 0,
+            }, True
+
+        s_lat = self.smoothing * lat + (1 - self.smoothing) * prev_lat
+        s_lng = self.smoothing * lng + (1 - self.smoothing) * prev_lng
+        update = {"lat": s_lat, "lng": s_lng, "ts": ts, "points": int(state["points"]) + 1, "streak": 0}
+
+        step_km = haversine_km(float(state["anchor_lat"]), float(state["anchor_lng"]), s_lat, s_lng)
+        if step_km >= self.min_step_km:
+            update.update(anchor_lat=s_lat, anchor_lng=s_lng, km=float(state["km"]) + step_km)
+        return update, True
+
+    def add_point(self, ride_id, lat, lng, ts=None):
+        """
+        Feed one raw GPS point; returns False when it was rejected as an outlier.
+        The read-modify-write runs under WATCH/MULTI, so a concurrent point
+        for the same ride makes this one retry on the new state instead of
+        overwriting it.
+        """
+        lat, lng = float(lat), float(lng)
+        ts = ts or time.time()
+        key = _meter_key(ride_id)
+
+        def apply(pipe):
+            update, accepted = self.advance(pipe.hgetall(key), lat, lng, ts)
+            pipe.multi()
+            pipe.hset(key, mapping=update)
+            pipe.expire(key, self.ttl_seconds)
+            return accepted
+
+        return get_redis().transaction(apply, key, value_from_callable=True)
+
+    def summary(self, ride_id):
+        """{km, points, rejected} for a ride, or None if no points were recorded"""
+        state = get_redis().hgetall(_meter_key(ride_id))
+        if not state:
+            return None
+        return {
+            "km": float(state["km"]),
+            "points": int(state["points"]),
+            "rejected": int(state["rejected"]),
+        }
+
+    def clear(self, ride_id):
+        get_redis().delete(_meter_key(ride_id))
+
+
+trip_meter = TripDistanceMeter(
+    min_step_m=settings.TRIP_METER_MIN_STEP_M,
+    max_speed_kmph=settings.TRIP_METER_MAX_SPEED_KMPH,
+    smoothing=settings.TRIP_METER_SMOOTHING,
+    reseed_after=settings.TRIP_METER_RESEED_AFTER,
+)
+
+
+def resolve_trip_distance(ride_id, client_distance):
+    """
+    Distance to bill a completed ride on, and the measured distance (or None).
+    The server-side measurement wins once enough points were recorded and
+    no more than TRIP_METER_MAX_REJECTED_SHARE of them were rejected as
+    outliers; the client's value is the fallback and is otherwise only used
+    as a cross-check.
+    """
+    try:
+        summary = trip_meter.summary(ride_id)
+    except RedisError as e:
+        logger.error(f"Trip meter unavailable for ride {ride_id}: {e}")
+        summary = None
+
+    if not summary or summary["points"] < settings.TRIP_METER_MIN_POINTS:
+        logger.info(f"Ride {ride_id}: not enough GPS points, using client distance {client_distance}")
+        return client_distance, None
+
+    measured_km = round(summary["km"], 3)
+    rejected_share = summary["rejected"] / (summary["points"] + summary["rejected"])
+    if rejected_share > settings.TRIP_METER_MAX_REJECTED_SHARE:
+        logger.warning(
+            f"Ride {ride_id}: {summary['rejected']} of {summary['points'] + summary['rejected']} GPS points rejected, "
+            f"using client distance {client_distance} over measured {measured_km} km"
+        )
+        return client_distance, measured_km
+    try:
+        client_km = float(client_distance)
+    except (TypeError, ValueError):
+        client_km = None
+    if client_km and abs(measured_km - client_km) / client_km > settings.TRIP_METER_DRIFT_WARN:
+        logger.warning(
+            f"Ride {ride_id}: measured distance {measured_km} km differs from client distance "
+            f"{client_km} km ({summary['points']} points, {summary['rejected']} rejected)"
+        )
+    return measured_km, measured_km
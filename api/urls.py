@@ -6,6 +6,7 @@ from .driver_rating import *
 from .users import *
 from .refund import *
 from .book import BookRideView
+from .fare_quote import FareQuoteView
 from .revenue import *
 from django.conf import settings
 from django.conf.urls.static import static
@@ -22,6 +23,7 @@ urlpatterns = [
     path('otp/verify/', VerifyOTPView.as_view()),
 
     path('rides/book/', BookRideView.as_view()),
+    path('rides/fare-quote/', FareQuoteView.as_view()),
     path('rides/history/', RideHistoryView.as_view()),
     path('rides/available/', AvailableRidesView.as_view()),
     path('rides/accept/<int:ride_id>/', AcceptRideView.as_view()),
@@ -50,6 +52,7 @@ urlpatterns = [
     path('profile/', UserProfilePatchView.as_view()),
     #Location
     path('location/update/', DriverLocationUpdate.as_view()),
+    path('admin/location-write-stats/', LocationWriteStatsView.as_view()),
     path('location/<int:driver_id>/', GetDriverLocation.as_view()),
     
     #Add vechical
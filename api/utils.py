@@ -1,5 +1,10 @@
 import math
 
+from django.conf import settings
+from django.db.models import Q
+
+from .distance import bounding_box, haversine_km, rank_by_distance
+
 def calculate_distance(lat1, lon1, lat2, lon2):
     """
     Calculate the distance in kilometers between two GPS coordinates
@@ -7,65 +12,37 @@ def calculate_distance(lat1, lon1, lat2, lon2):
     """
     # Convert strings/floats to float
     lat1, lon1, lat2, lon2 = map(float, [lat1, lon1, lat2, lon2])
-
-    # Radius of the Earth in km
-    R = 6371.0
-    # Convert degrees to radians
-    phi1 = math.radians(lat1)
-    phi2 = math.radians(lat2)
-    delta_phi = math.radians(lat2 - lat1)
-    delta_lambda = math.radians(lon2 - lon1)
-
-    # Haversine formula
-    a = math.sin(delta_phi / 2.0)**2 + \
-        math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2.0)**2
-
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-
-    distance = R * c
-    return round(distance, 2)  # distance in km rounded to 2 decimals
-
-
-# rides/utils.py
-import math
+    return round(haversine_km(lat1, lon1, lat2, lon2), 2)  # distance in km rounded to 2 decimals
 
 
 def haversine_distance(lat1, lng1, lat2, lng2):
     # returns kilometers
-    R = 6371.0
-    phi1 = math.radians(lat1)
-    phi2 = math.radians(lat2)
-    dphi = math.radians(lat2 - lat1)
-    dlambda = math.radians(lng2 - lng1)
-    a = math.sin(dphi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlambda/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-    return R * c
+    return haversine_km(lat1, lng1, lat2, lng2)
 
 
 from .models import User
 
 
 def find_nearby_drivers(pickup_lat, pickup_lng, radius_km=5, limit=10):
-    candidates = User.objects.filter(is_available=True).exclude(fcm_token__isnull=True).exclude(fcm_token='')
-    nearby = []
-    for d in candidates:
-        if d.lat is None or d.lng is None:
-            continue
-        dist = haversine_distance(pickup_lat, pickup_lng, d.lat, d.lng)
-        if dist <= radius_km:
-            nearby.append((dist, d))
-    nearby.sort(key=lambda x: x[0])
-    return [d for _, d in nearby[:limit]]
+    candidates = list(
+        User.objects.filter(is_available=True)
+        .exclude(fcm_token__isnull=True).exclude(fcm_token='')
+        .exclude(current_lat__isnull=True).exclude(current_lng__isnull=True)
+        .values_list('id', 'current_lat', 'current_lng')
+    )
+    if not candidates:
+        return []
+    ids, lats, lngs = zip(*candidates)
+    indices, _ = rank_by_distance(pickup_lat, pickup_lng, lats, lngs, radius_km=radius_km, k=limit)
+    nearest_ids = [ids[i] for i in indices]
+    drivers = User.objects.in_bulk(nearest_ids)
+    return [drivers[driver_id] for driver_id in nearest_ids if driver_id in drivers]
 
 from .models import DriverLocation
+from .driver_index import driver_index
 
 def haversine(lat1, lon1, lat2, lon2):
-    R = 6371  # km
-    phi1, phi2 = math.radians(lat1), math.radians(lat2)
-    dphi = math.radians(lat2 - lat1)
-    dlambda = math.radians(lon2 - lon1)
-    a = math.sin(dphi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlambda/2)**2
-    return R * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    return haversine_km(lat1, lon1, lat2, lon2)
 
 # def get_nearby_driver_tokens(pickup_lat, pickup_lng, radius_km=5):
 #     drivers = User.objects.exclude(fcm_token__isnull=True).exclude(fcm_token="")
@@ -79,49 +56,124 @@ def haversine(lat1, lon1, lat2, lon2):
 #     print("Nearby drivers:", tokens)                
 #     return tokens
 
-def get_nearby_driver_tokens(pickup_lat, pickup_lng, radius_km=5, vehicle_type=None):
+def available_drivers():
+    """Online, available drivers with a known position (served by the user_driver_match_idx index)"""
+    return (
+        User.objects.filter(is_driver=True, is_online=True, is_available=True)
+        .exclude(current_lat__isnull=True)
+        .exclude(current_lng__isnull=True)
+    )
+
+
+def drivers_in_bounding_box(queryset, pickup_lat, pickup_lng, radius_km):
+    """Narrow a driver queryset to the lat/lng box enclosing radius_km around the pickup"""
+    min_lat, max_lat, min_lng, max_lng = bounding_box(float(pickup_lat), float(pickup_lng), radius_km)
+    lng_filter = Q(current_lng__range=(min_lng, max_lng))
+    if min_lng > max_lng:
+        # The box crosses the antimeridian
+        lng_filter = Q(current_lng__gte=min_lng) | Q(current_lng__lte=max_lng)
+    return queryset.filter(lng_filter, current_lat__range=(min_lat, max_lat))
+
+
+def get_nearby_driver_rows(pickup_lat, pickup_lng, radius_km=5, vehicle_type=None, exclude_ids=()):
     """
-    Returns FCM tokens for nearby drivers filtered by vehicle type (if given).
+    [(driver_id, fcm_token, distance_km)] for available drivers within radius_km,
+    nearest first, filtered by vehicle type (if given).
     If vehicle_type == 'any' or None, all drivers are included.
+    With DRIVER_INDEX_ENABLED the grid index (fed from the live location store)
+    supplies candidates and distances and the database only confirms
+    availability; otherwise a bounding-box query on the stored coordinates is
+    ranked with the exact haversine check.
     """
     # Base queryset: only drivers with valid FCM tokens
     drivers = (
-        User.objects.filter(is_driver=True, is_available=True, is_online=True)
-        .exclude(fcm_token__isnull=True)
-        .exclude(fcm_token="")
-        .exclude(current_lat__isnull=True)
-        .exclude(current_lng__isnull=True)
+        User.objects.filter(is_driver=True, is_online=True, is_available=True)
+        .exclude(fcm_token__isnull=True).exclude(fcm_token="")
     )
 
     # Filter by vehicle_type unless it's "any" or empty
     if vehicle_type and vehicle_type.lower() != "any":
         drivers = drivers.filter(vehicle_type__iexact=vehicle_type)
+    if exclude_ids:
+        drivers = drivers.exclude(id__in=exclude_ids)
+
+    ranked = []
+    if settings.DRIVER_INDEX_ENABLED:
+        driver_index.ensure_fresh()
+        candidates = driver_index.within_radius(pickup_lat, pickup_lng, radius_km)
+        if candidates:
+            fcm_tokens = dict(
+                drivers.filter(id__in=[driver_id for _, driver_id in candidates]).values_list("id", "fcm_token")
+            )
+            ranked = [(driver_id, fcm_tokens[driver_id], dist) for dist, driver_id in candidates if driver_id in fcm_tokens]
+    else:
+        rows = list(
+            drivers_in_bounding_box(drivers, pickup_lat, pickup_lng, radius_km)
+            .values_list("id", "fcm_token", "current_lat", "current_lng")
+        )
+        if rows:
+            ids, fcm_tokens, lats, lngs = zip(*rows)
+            indices, distances = rank_by_distance(pickup_lat, pickup_lng, lats, lngs, radius_km=radius_km)
+            ranked = [(ids[i], fcm_tokens[i], float(dist)) for i, dist in zip(indices, distances)]
+    return ranked
+
 
+def get_nearby_driver_tokens(pickup_lat, pickup_lng, radius_km=5, vehicle_type=None):
+    """
+    Returns FCM tokens for nearby drivers filtered by vehicle type (if given).
+    If vehicle_type == 'any' or None, all drivers are included.
+    """
     tokens = []
-    for d in drivers:
-        if d.current_lat and d.current_lng:
-            dist = haversine(pickup_lat, pickup_lng, d.current_lat, d.current_lng)
-            print(f"Driver {d.username}: {dist} km away ({getattr(d, 'vehicle_type', 'N/A')})")
-            if dist <= radius_km:
-                tokens.append(d.fcm_token)
+    for driver_id, fcm_token, dist in get_nearby_driver_rows(pickup_lat, pickup_lng, radius_km, vehicle_type):
+        print(f"Driver {driver_id}: {dist} km away")
+        tokens.append(fcm_token)
 
     print(f"Nearby {vehicle_type or 'all'} drivers:", tokens)
     return tokens
 
 
-def get_nearest_driver_distance(pickup_lat, pickup_lng):
-    drivers = User.objects.filter(is_driver=True,is_available=True,is_online=True)\
-                          .exclude(current_lat__isnull=True, current_lng__isnull=True)
-    nearest_driver = None
-    min_distance = None
-
-    for driver in drivers:
-        dist = calculate_distance(pickup_lat, pickup_lng, driver.current_lat, driver.current_lng)
-        if min_distance is None or dist < min_distance:
-            min_distance = dist
-            nearest_driver = driver
-    
-    return nearest_driver, min_distance
+def get_nearest_driver_distance(pickup_lat, pickup_lng, candidates=10, max_radius_km=None):
+    """
+    Nearest available driver and their distance in km (rounded to 2 decimals),
+    within max_radius_km when given.
+    With the grid index, it proposes the `candidates` closest online drivers and
+    the database only confirms which of them are still available; while all of
+    them are busy the next, twice as many, closest drivers are checked. Without
+    it, the nearest driver is ranked from the available drivers' stored
+    coordinates (prefiltered by a bounding box of max_radius_km).
+    """
+    if settings.DRIVER_INDEX_ENABLED:
+        driver_index.ensure_fresh()
+        checked = set()
+        while True:
+            nearest = driver_index.nearest(pickup_lat, pickup_lng, k=candidates, max_radius_km=max_radius_km)
+            unchecked = [(dist, driver_id) for dist, driver_id in nearest if driver_id not in checked]
+            available = set(
+                User.objects.filter(
+                    id__in=[driver_id for _, driver_id in unchecked],
+                    is_driver=True, is_online=True, is_available=True,
+                ).values_list("id", flat=True)
+            )
+            for dist, driver_id in unchecked:
+                if driver_id in available:
+                    return User.objects.only("id", "username").get(id=driver_id), round(dist, 2)
+            if len(nearest) < candidates:
+                return None, None
+            checked.update(driver_id for _, driver_id in unchecked)
+            candidates *= 2
+
+    drivers = available_drivers()
+    if max_radius_km is not None:
+        drivers = drivers_in_bounding_box(drivers, pickup_lat, pickup_lng, max_radius_km)
+    rows = list(drivers.values_list("id", "current_lat", "current_lng"))
+    if not rows:
+        return None, None
+    ids, lats, lngs = zip(*rows)
+    indices, distances = rank_by_distance(pickup_lat, pickup_lng, lats, lngs, radius_km=max_radius_km, k=1)
+    if not len(indices):
+        return None, None
+    nearest_driver = User.objects.only("id", "username").get(id=ids[indices[0]])
+    return nearest_driver, round(float(distances[0]), 2)
 
 
 from django.template.loader import render_to_string
@@ -143,19 +195,16 @@ from django.db.models import Avg, Count
 from .models import *
 
 def get_driver_rating_summary(driver_id):
-    ratings = DriverRating.objects.filter(driver_id=driver_id)
+    from .rating_aggregate import get_aggregate, recent_ratings
 
-    avg_rating = ratings.aggregate(Avg("stars"))["stars__avg"] or 0
-    total_reviews = ratings.count()
-
-    # Distribution (1-5 stars)
-    distribution = ratings.values("stars").annotate(count=Count("stars"))
+    # One aggregate row instead of an average, a count and a GROUP BY over the ratings
+    aggregate = get_aggregate(driver_id)
 
     return {
-        "avg_rating": round(avg_rating, 1),
-        "total_reviews": total_reviews,
-        "distribution": {d["stars"]: d["count"] for d in distribution},
-        "recent_feedback": ratings.order_by("-created_at")[:10],  # last 10 feedbacks
+        "avg_rating": round(aggregate.average, 1),
+        "total_reviews": aggregate.rating_count,
+        "distribution": aggregate.distribution,
+        "recent_feedback": recent_ratings(aggregate),  # last DRIVER_RATING_RECENT_FEEDBACK feedbacks
     }
 
 from datetime import date
@@ -199,43 +248,6 @@ from django.db import transaction
 
 #         progress.save()
 
-def update_driver_incentive_progress(driver, ride):
-    driver_wallet, _ = DriverWallet.objects.get_or_create(driver=driver)
-    active_incentives = DriverIncentive.objects.all()
-
-    for incentive in active_incentives:
-        ride_type_for_incentive = get_ride_type(ride.distance_km, incentive)
-
-        # Skip incentives that don't match the current ride
-        if ride_type_for_incentive is None:
-            continue
-
-        progress, _ = DriverIncentiveProgress.objects.get_or_create(
-            driver=driver,
-            incentive_rule=incentive,
-        )
-
-        # Update progress
-        progress.rides_completed += 1
-        progress.travelled_distance += ride.distance_km or 0
-
-        # Check if incentive earned
-        incentive_earned = (
-            (incentive.days and progress.rides_completed >= incentive.days) or
-            (incentive.distance and progress.travelled_distance >= incentive.distance)
-        )
-
-        if incentive_earned and not progress.earned:
-            driver_wallet.add_incentive(
-                amount=incentive.driver_incentive,
-                transaction_type="driver_incentive",
-                ride=ride,
-                description=f"Incentive completed by Driver #{driver.id} for Ride #{ride.booking_id}"
-            )
-            progress.earned = True
-        print("Incentive Progress:", progress.rides_completed, progress.travelled_distance, progress.earned)
-        progress.save()
-
 
 def get_ride_type(travelled_distance, incentive):
     """
@@ -169,6 +169,15 @@ from rest_framework.response import Response
 from rest_framework.serializers import ValidationError
 from django.utils import timezone
 from .utils import calculate_distance,get_nearby_driver_tokens,get_nearest_driver_distance
+from .driver_index import driver_index
+from .ride_state import try_accept_ride
+from .fare_tables import get_fare_table, quote_fare
+from .reward_index import find_reward
+from . import wallet_ledger
+from .daily_metrics import record_ride_cancelled
+from .live_location import live_locations
+from .location_buffer import location_buffer
+from redis.exceptions import RedisError
 from ApniRide.firebase_app import send_multicast,send_fcm_notification,send_Offer
 
 class BookRideViews(generics.CreateAPIView):
@@ -218,7 +227,7 @@ class BookRideViews(generics.CreateAPIView):
 
         # Calculate fare and incentives
         try:
-            fare = calculate_fare(vehicle_type, distance_km)
+            fare = quote_fare(vehicle_type, distance_km).rupees('total_user_pays')
             driver_incentive, customer_reward = calculate_incentives_and_rewards(distance_km)
         except Exception as e:
             raise ValidationError(f"Error calculating fare or incentives: {str(e)}")
@@ -354,14 +363,11 @@ class AcceptRideView(APIView):
     def post(self, request, ride_id):
         print("Driver",dir(request))
         try:
-            ride = Ride.objects.get(id=ride_id, status='pending')
-            ride.otp = random.randint(1000,9999)
-            ride.status = 'accepted'
-            ride.driver = request.user
-            ride.driver.is_available = False
-            ride.save()
-            request.user.is_available = False
-            request.user.save()
+            if not try_accept_ride(ride_id, request.user, otp=str(random.randint(1000,9999))):
+                if not Ride.objects.filter(id=ride_id).exists():
+                    return Response({"statusCode":"0", "statusMessage": "Ride not found"}, status=status.HTTP_404_NOT_FOUND)
+                return Response({"statusCode":"0", "statusMessage": "Ride already taken"}, status=status.HTTP_409_CONFLICT)
+            ride = Ride.objects.select_related('user', 'driver').get(id=ride_id)
             customer_token = ride.user.fcm_token 
             if customer_token:
                 notification = {
@@ -430,9 +436,20 @@ class DriverLocationUpdate(APIView):
             #     loc.save(update_fields=["latitude", "longitude"])
             # logger.info(f"Driver location updated: driver={request.user.id}, lat={latitude}, lon={longitude}")
 
-            request.user.current_lat = latitude
-            request.user.current_lng = longitude
-            request.user.save(update_fields=["current_lat", "current_lng"])
+            # Pings go to the live location store; flush_driver_locations writes
+            # the latest position back to the user row in the background.
+            heading = request.data.get('heading')
+            try:
+                heading = float(heading) if heading is not None else None
+            except ValueError:
+                heading = None
+            try:
+                live_locations.update(request.user.id, latitude, longitude, heading=heading, online=request.user.is_online)
+            except RedisError as e:
+                logger.error(f"Live location store unavailable, buffering location write: {e}")
+                location_buffer.add(request.user.id, latitude, longitude)
+            if request.user.is_online:
+                driver_index.update(request.user.id, latitude, longitude)
             
             # Send location update to WebSocket group
             channel_layer = get_channel_layer()
@@ -482,6 +499,27 @@ class DriverLocationUpdate(APIView):
             )
 
 
+class LocationWriteStatsView(APIView):
+    """
+    Pings received vs rows written: the live location store's counters
+    (shared) and the fallback write buffer's (this worker process only).
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        try:
+            live_store = live_locations.stats()
+        except RedisError as e:
+            logger.error(f"Live location store unavailable: {e}")
+            live_store = None
+        return Response({
+            "statusCode": "1",
+            "statusMessage": "Success",
+            "liveStore": live_store,
+            "writeBuffer": location_buffer.stats(),
+        })
+
+
 class GetDriverLocation(APIView):
     def get(self, request, driver_id):
         loc = DriverLocation.objects.get(driver_id=driver_id)
@@ -1218,8 +1256,9 @@ class BookingStatusAPIView(APIView):
         except Ride.DoesNotExist:
             return Response({"error": "Booking not found"}, status=status.HTTP_404_NOT_FOUND)
 
-from .utils import update_driver_incentive_progress  
+from .ride_completion import complete_ride
 from .tasks import notify_ride_status  
+from .trip_distance import resolve_trip_distance
 class RideStatusUpdateView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
@@ -1250,13 +1289,14 @@ class RideStatusUpdateView(APIView):
                     "statusCode": "0",
                     "statusMessage": f"Ride cannot be accepted because it is {ride.status}."
                 }, status=status.HTTP_400_BAD_REQUEST)
-            if ride.driver is not None:
+            if not try_accept_ride(ride.id, user):
                 return Response({
                     "statusCode": "0",
                     "statusMessage": "Ride is already assigned to another driver."
-                }, status=status.HTTP_400_BAD_REQUEST)
-            ride.driver = user
-            ride.status = 'accepted'
+                }, status=status.HTTP_409_CONFLICT)
+            # The conditional UPDATE already saved the ride; reload it for the response
+            ride.refresh_from_db()
+            return self.status_updated(ride)
 
         elif new_status == 'completed':
             print("Entered completed block")
@@ -1276,70 +1316,46 @@ class RideStatusUpdateView(APIView):
                 }, status=status.HTTP_403_FORBIDDEN)
             
             try:
-                distance = request.data.get('distance')
+                # Measured GPS distance when available, client value as fallback
+                distance, measured_distance = resolve_trip_distance(ride.id, request.data.get('distance'))
                 vehicle_type = request.data.get('vehicle_type')
 
                 print("Distance from request:", distance)
                 print("Vehicle type from request:", vehicle_type) 
-                overall = calculate_fare(vehicle_type, distance)
-                fare = int(overall['total_user_pays'])
-                gst_amount =int(overall['gst_amount'])
-                commission_amount = int(overall['commission_amount'])
-                driver_earnings = int(overall['driver_earnings'])
-                company_revenue = int(overall['company_revenue'])
+                # Exact paise amounts, so the wallet postings add up to the fare
+                overall = quote_fare(vehicle_type, distance)
+                fare = overall.rupees('total_user_pays')
+                gst_amount = overall.rupees('gst_amount')
+                commission_amount = overall.rupees('commission_amount')
+                driver_earnings = overall.rupees('driver_earnings')
+                company_revenue = overall.rupees('company_revenue')
                 # driver_incentive, customer_reward = calculate_incentives_and_rewards(distance_km)
             except Exception as e:
                 raise ValidationError(f"Error calculating fare or incentives: {str(e)}")
 
-            ride.status = 'completed'
-            ride.completed = True
-            ride.paid = True
-            ride.fare = fare
-            ride.gst_amount = gst_amount
-            ride.fare_estimate = company_revenue+gst_amount
-            ride.commission_amount = commission_amount
-            ride.completed_at = timezone.now()
-            ride.driver.is_available = True
-            ride.save()
-            ride.driver.save()
-            print("Fare calculated:", ride.fare)
-            # driver_earnings = Decimal(ride.driver_earnings)
-            driver_incentive = Decimal(ride.driver_incentive or 0)  
-
-            earning_amount = driver_earnings + driver_incentive  
-            driver_wallet, created = DriverWallet.objects.get_or_create(driver=user)
-            driver_wallet.deposit(
-                amount=earning_amount,
-                description=f"Earnings for Ride {ride.booking_id or ride.id}",
-                transaction_type="ride_payment"
+            # Status change, wallet postings and incentive progress in one transaction
+            completed = complete_ride(
+                ride, user,
+                completed=True,
+                paid=True,
+                measured_distance_km=measured_distance,
+                fare=fare,
+                gst_amount=gst_amount,
+                fare_estimate=company_revenue+gst_amount,
+                commission_amount=commission_amount,
+                driver_earnings=driver_earnings,
+                completed_at=timezone.now(),
             )
+            if not completed:
+                return Response({
+                    "statusCode": "0",
+                    "statusMessage": "Ride is already completed."
+                }, status=status.HTTP_409_CONFLICT)
+            print("Fare calculated:", ride.fare)
+            # complete_ride wrote the fields with its conditional UPDATE; a full save here
+            # could overwrite a concurrent change with this request's stale copy
+            return self.status_updated(ride)
 
-            admin_wallet,created  = AdminWallet.objects.get_or_create(name="Platform Wallet")  
-            commission_amount = Decimal(ride.commission_amount)
-            gst_amount = Decimal(ride.gst_amount)
-            total_amount = commission_amount + gst_amount
-            if total_amount > 0:
-                
-                admin_wallet.balance += total_amount
-                admin_wallet.total_commission += commission_amount
-                admin_wallet.total_gst += gst_amount
-                admin_wallet.save()
-
-               
-                AdminWalletTransaction.objects.create(
-                    wallet=admin_wallet,
-                    transaction_type='revenue',
-                    amount=total_amount,  
-                    commission_amount=commission_amount,
-                    gst_amount=gst_amount,
-                    description=f"Commission ₹{commission_amount} + GST ₹{gst_amount} collected for Ride {ride.booking_id or ride.id}",
-                    balance_after=admin_wallet.balance,
-                    related_ride=ride,
-                    related_user=ride.user,
-                )
-
-
-            update_driver_incentive_progress(user, ride)
         elif new_status == 'cancelled':
             print("Entered cancelled block")
 
@@ -1365,15 +1381,10 @@ class RideStatusUpdateView(APIView):
 
             # Deduct from user wallet (can go negative)
             if charge > 0:
-                ride_wallet.balance -= charge
-                ride_wallet.save(update_fields=["balance", "updated_at"])
-                # Log user wallet transaction
-                UserWalletTransaction.objects.create(
-                    wallet=ride_wallet,
-                    transaction_type="ride_payment",
-                    amount=-charge,
-                    description=f"Cancellation charge for Ride {ride.id}",
-                    balance_after=ride_wallet.balance,
+                wallet_ledger.debit(
+                    ride_wallet, charge, "ride_payment",
+                    f"Cancellation charge for Ride {ride.id}",
+                    allow_negative=True,
                     related_ride=ride
                 )
                 # Deposit into admin wallet
@@ -1399,6 +1410,7 @@ class RideStatusUpdateView(APIView):
             ride.is_cancelled_by_user = True
             ride.cancelled_at = timezone.now()
             ride.save()
+            record_ride_cancelled(ride)
             notify_ride_status(ride)
 
             return Response({
@@ -1410,7 +1422,7 @@ class RideStatusUpdateView(APIView):
                 "remaining_free_cancellations": max(policy.free_cancellations - cancelled_count - 1, 0)
             }, status=status.HTTP_200_OK)
 
-        ride.save()
+    def status_updated(self, ride):
         notify_ride_status(ride)
         serializer = RideSerializer(ride)
         return Response({
@@ -1422,55 +1434,40 @@ class RideStatusUpdateView(APIView):
 from decimal import Decimal
 from django.utils import timezone
 from datetime import timedelta
-from django.db.models import Sum, Avg
+from django.db.models import Sum, Avg, Count
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import permissions
 
-from .models import Ride, User, AdminWallet, AdminWalletTransaction
+from .models import Ride, User, AdminWallet, AdminWalletTransaction, DailyMetric
+from .daily_metrics import all_time_totals, daily_totals
+from .timeseries import parse_range, series_payload, time_series
+from .dashboard_cache import get_snapshot
 
 
 class AdminDashboardView(APIView):
     permission_classes = [permissions.IsAdminUser]
 
     def get(self, request):
+        # Charts default to the last 7 days; start/end/granularity pick any range
+        custom_chart = any(key in request.query_params for key in ("start", "end", "granularity"))
         try:
-            today = timezone.now().date()
-            week_ago = today - timedelta(days=6)
-
-            admin_wallet = AdminWallet.objects.first()  
-            if not admin_wallet:
-                admin_wallet = AdminWallet.objects.create(
-                    name="Platform Wallet",
-                    balance=Decimal("0.00"),
-                    total_commission=Decimal("0.00"),
-                    total_gst=Decimal("0.00")
-                )
-            dashboard_stats = {
-                "activeRides": Ride.objects.filter(status='accepted').count(),
-                "totalRevenue": self.get_total_revenue(admin_wallet),
-                "totalCommission": admin_wallet.total_commission,
-                "totalGST": admin_wallet.total_gst,
-                "revenueGrowth": self.calculate_revenue_growth(admin_wallet),
-                "totalUsers": User.objects.filter(is_user=True).count(),
-                "newUsersToday": User.objects.filter(is_user=True, date_joined__date=today).count(),
-                "totalDrivers": User.objects.filter(is_driver=True).count(),
-                "onlineDrivers": User.objects.filter(is_online=True).count(),
-                "todayRides": Ride.objects.filter(created_at__date=today).count(),
-                "todayRevenue": self.get_today_revenue(admin_wallet, today),
-                "avgRating": Ride.objects.filter(rating__isnull=False).aggregate(avg=Avg('rating'))['avg'] or 0
-            }
-
-
-            revenue_chart = self.get_revenue_chart_data(admin_wallet, week_ago, today)
-            ride_chart = self.get_ride_chart_data(week_ago, today)
+            chart_range = parse_range(request.query_params)
+        except ValueError as e:
+            return Response({
+                "statusCode": "0",
+                "statusMessage": f"Invalid chart range: {str(e)}"
+            }, status=400)
 
+        try:
+            # Cached snapshot per range; stale ones are served while Celery recomputes them
+            payload, age, stale = get_snapshot(chart_range, custom_chart, self.build_dashboard)
             return Response({
                 "statusCode": "1",
                 "statusMessage": "Dashboard data retrieved successfully",
-                "dashboardStats": dashboard_stats,
-                "revenueChart": revenue_chart,
-                "rideChart": ride_chart
+                **payload,
+                "snapshotAge": round(age, 1),
+                "snapshotStale": stale
             })
 
         except Exception as e:
@@ -1479,37 +1476,64 @@ class AdminDashboardView(APIView):
                 "statusMessage": f"Error retrieving dashboard data: {str(e)}"
             }, status=500)
 
-    # --- Revenue calculations ---
+    def build_dashboard(self, chart_range, custom_chart):
+        today = timezone.localdate()
+        week_ago = today - timedelta(days=6)
+
+        admin_wallet = AdminWallet.objects.first()  
+        if not admin_wallet:
+            admin_wallet = AdminWallet.objects.create(
+                name="Platform Wallet",
+                balance=Decimal("0.00"),
+                total_commission=Decimal("0.00"),
+                total_gst=Decimal("0.00")
+            )
+        # Wallet row plus its uncompacted shards
+        wallet_totals = admin_wallet.totals()
+        # Daily rollups (see daily_metrics.py): two weeks for growth, all-time sums for totals
+        daily = daily_totals(today - timedelta(days=13), today)
+        all_time = all_time_totals("commission", "new_users", "new_drivers")
+        dashboard_stats = {
+            "activeRides": Ride.objects.filter(status='accepted').count(),
+            "totalRevenue": all_time["commission"],
+            "totalCommission": wallet_totals["total_commission"],
+            "totalGST": wallet_totals["total_gst"],
+            "revenueGrowth": self.calculate_revenue_growth(daily, today),
+            "totalUsers": all_time["new_users"],
+            "newUsersToday": daily[today]["new_users"],
+            "totalDrivers": all_time["new_drivers"],
+            "onlineDrivers": User.objects.filter(is_online=True).count(),
+            "todayRides": daily[today]["rides_created"],
+            "todayRevenue": daily[today]["commission"],
+            "avgRating": Ride.objects.filter(rating__isnull=False).aggregate(avg=Avg('rating'))['avg'] or 0
+        }
 
-    def get_total_revenue(self, wallet):
-        return wallet.transactions.filter(transaction_type='revenue').aggregate(
-                total=Sum('commission_amount')
-            )['total'] or Decimal("0.00")
 
-    def get_today_revenue(self, wallet, today):
-        return wallet.transactions.filter(
-            transaction_type='revenue',
-            created_at__date=today
-        ).aggregate(total=Sum('commission_amount'))['total'] or Decimal("0.00")
+        # Rollups only cover whole days and are warm once they reach back past the chart
+        if custom_chart or not DailyMetric.objects.filter(date__lte=week_ago).exists():
+            revenue_chart, ride_chart = self.get_live_chart_data(*chart_range)
+        else:
+            revenue_chart = self.get_revenue_chart_data(daily, week_ago, today)
+            ride_chart = self.get_ride_chart_data(daily, week_ago, today)
 
+        return {
+            "dashboardStats": dashboard_stats,
+            "revenueChart": revenue_chart,
+            "rideChart": ride_chart
+        }
 
-    def calculate_revenue_growth(self, wallet):
-        today = timezone.now().date()
+    # --- Revenue calculations ---
+
+    def calculate_revenue_growth(self, daily, today):
         last_7_days = today - timedelta(days=6)
-        prev_7_days = last_7_days - timedelta(days=7)
 
         # Get current and previous 7-day revenues (only commission part)
-        current_revenue = wallet.transactions.filter(
-            transaction_type='revenue',
-            created_at__date__gte=last_7_days,
-            created_at__date__lte=today
-        ).aggregate(total=Sum('commission_amount'))['total'] or Decimal("0.00")
-
-        previous_revenue = wallet.transactions.filter(
-            transaction_type='revenue',
-            created_at__date__gte=prev_7_days,
-            created_at__date__lte=last_7_days - timedelta(days=1)
-        ).aggregate(total=Sum('commission_amount'))['total'] or Decimal("0.00")
+        current_revenue = sum(
+            (totals["commission"] for day, totals in daily.items() if day >= last_7_days), Decimal("0.00")
+        )
+        previous_revenue = sum(
+            (totals["commission"] for day, totals in daily.items() if day < last_7_days), Decimal("0.00")
+        )
 
         # --- Best practice for dashboards ---
         # If there was no revenue in the previous period,
@@ -1525,39 +1549,34 @@ class AdminDashboardView(APIView):
 
     # --- Charts ---
 
-    def get_revenue_chart_data(self, wallet, start_date, end_date):
+    def get_revenue_chart_data(self, daily, start_date, end_date):
         days = (end_date - start_date).days + 1
-        labels = [(start_date + timedelta(days=x)).strftime('%a') for x in range(days)]
-        revenue_data = []
-
-        for i in range(days):
-            date = start_date + timedelta(days=i)
-            daily_total = wallet.transactions.filter(
-                transaction_type='revenue',
-                created_at__date=date
-            ).aggregate(total=Sum('amount'))['total'] or Decimal("0.00")
-            revenue_data.append(daily_total)
-
+        dates = [start_date + timedelta(days=x) for x in range(days)]
         return {
-            "labels": labels,
-            "revenue": revenue_data
+            "labels": [date.strftime('%a') for date in dates],
+            "revenue": [daily[date]["revenue"] or Decimal("0.00") for date in dates]
         }
 
-    def get_ride_chart_data(self, start_date, end_date):
+    def get_ride_chart_data(self, daily, start_date, end_date):
         days = (end_date - start_date).days + 1
-        labels = [(start_date + timedelta(days=x)).strftime('%a') for x in range(days)]
-        ride_data = []
-
-        for i in range(days):
-            date = start_date + timedelta(days=i)
-            count = Ride.objects.filter(created_at__date=date).count()
-            ride_data.append(count)
-
+        dates = [start_date + timedelta(days=x) for x in range(days)]
         return {
-            "labels": labels,
-            "rides": ride_data
+            "labels": [date.strftime('%a') for date in dates],
+            "rides": [daily[date]["rides_created"] for date in dates]
         }
 
+    def get_live_chart_data(self, start_date, end_date, granularity):
+        """Revenue and ride charts straight from the transaction tables, one GROUP BY query each"""
+        label_format = '%a' if granularity == 'day' and (end_date - start_date).days < 7 else None
+        revenue = time_series(
+            AdminWalletTransaction.objects.filter(transaction_type='revenue'), 'created_at',
+            start_date, end_date, granularity, revenue=Sum('amount')
+        )
+        rides = time_series(
+            Ride.objects.all(), 'created_at', start_date, end_date, granularity, rides=Count('id')
+        )
+        return series_payload(revenue, granularity, label_format), series_payload(rides, granularity, label_format)
+
 from rest_framework import viewsets
 from .models import FareRule
 
@@ -1611,59 +1630,12 @@ class FareRuleViewSet(viewsets.ModelViewSet):
         
 
 def calculate_fare(vehicle_type, distance):
-    from .models import FareRule
-
-    rules = FareRule.objects.filter(vehicle_type=vehicle_type).order_by("min_distance")
-
-    totals = {
-        "distance": distance,
-        "base_fare": 0,
-        "gst_amount": 0,
-        "commission_amount": 0,
-        "driver_earnings": 0,
-        "total_user_pays": 0,
-        "company_revenue": 0,
-        "government_revenue": 0,
-        "breakdown": []
-    }
-
-    remaining_distance = distance
-
-    for rule in rules:
-        if remaining_distance <= 0:
-            break
-
-        # Distance applicable for this slab
-        max_dist = rule.max_distance if rule.max_distance else remaining_distance + rule.min_distance
-        applicable_distance = min(remaining_distance, max_dist - rule.min_distance)
-
-        if applicable_distance <= 0:
-            continue
-
-        # Use model's calculate_fare() for this slab
-        slab_result = rule.calculate_fare(applicable_distance)
-
-        # Add to breakdown
-        totals["breakdown"].append({
-            "range": f"{rule.min_distance}-{rule.max_distance or '∞'} km",
-            "distance": applicable_distance,
-            "fare": round(slab_result["total_user_pays"], 3),
-        })
-
-        # Accumulate totals
-        for key in ["base_fare", "gst_amount", "commission_amount",
-                    "driver_earnings", "total_user_pays",
-                    "company_revenue", "government_revenue"]:
-            totals[key] += slab_result[key]
-
-        remaining_distance -= applicable_distance
-
-    # Round final values
-    for key, value in totals.items():
-        if isinstance(value, (float, int)):
-            totals[key] = round(value, 3)
-
-    return totals
+    """
+    Fare totals and per-slab breakdown for `distance` km of `vehicle_type`.
+    Uses the compiled fare table (fare_tables.py), so there is no database
+    access once the vehicle type's FareRule slabs are cached.
+    """
+    return get_fare_table(vehicle_type).quote(distance)
 
 
         
@@ -1673,26 +1645,20 @@ def calculate_incentives_and_rewards(distance, vehicle_type=None):
     driver_incentive = 0
     customer_reward = {}
 
-    # Filter DistanceReward table dynamically based on distance and vehicle type
-    rewards = DistanceReward.objects.filter(
-        Q(vehicle_type=vehicle_type) | Q(vehicle_type__isnull=True),
-        min_distance__lte=distance
-    ).order_by('min_distance')
-
-    for reward in rewards:
-        if reward.max_distance is None or distance <= reward.max_distance:
-            # Calculate customer reward
-            customer_reward = {
-                "cashback": reward.cashback,
-                "water_bottles": reward.water_bottles,
-                "tea": reward.tea,
-            }
-            if reward.discount:
-                customer_reward["discount"] = reward.discount
+    # First DistanceReward slab for this vehicle type (or any) covering the distance
+    reward = find_reward("incentive", distance, vehicle_type)
+    if reward:
+        # Calculate customer reward
+        customer_reward = {
+            "cashback": reward["cashback"],
+            "water_bottles": reward["water_bottles"],
+            "tea": reward["tea"],
+        }
+        if reward["discount"]:
+            customer_reward["discount"] = reward["discount"]
 
-            # Assume driver incentive is same as cashback * 2 for example
-            driver_incentive += reward.cashback * 2  # you can adjust this logic
-            break  # only take the first matching reward
+        # Assume driver incentive is same as cashback * 2 for example
+        driver_incentive += reward["cashback"] * 2  # you can adjust this logic
 
     return driver_incentive, customer_reward
         
@@ -1779,7 +1745,9 @@ class CancelRideView(APIView):
 
             # Update ride status
             ride.status = 'cancelled'
-            ride.save(update_fields=["status"])
+            ride.cancelled_at = timezone.now()
+            ride.save(update_fields=["status", "cancelled_at", "updated_at"])
+            record_ride_cancelled(ride)
             notify_ride_status(ride)
 
             # Make driver available if cancelled by user
@@ -1844,22 +1812,15 @@ class CancelRideView(APIView):
           
 
 def calculate_customer_rewards(distance):
-    from .models import DistanceReward
-
-    # Fetch all rewards from DB
-    rewards = DistanceReward.objects.all()
+    reward = find_reward("customer", distance)
     applicable_reward = {}
-
-    for reward in rewards:
-        max_dist = reward.max_distance if reward.max_distance is not None else float('inf')
-        if reward.min_distance <= distance <= max_dist:
-            applicable_reward = {
-                "cashback": reward.cashback,
-                "water_bottles": reward.water_bottles,
-                "tea": reward.tea,
-                "discount": reward.discount
-            }
-            break
+    if reward:
+        applicable_reward = {
+            "cashback": reward["cashback"],
+            "water_bottles": reward["water_bottles"],
+            "tea": reward["tea"],
+            "discount": reward["discount"]
+        }
 
     return applicable_reward
 
@@ -2227,7 +2188,19 @@ class DriverOnlineStatusUpdateView(generics.UpdateAPIView):
         data = {"is_online": request.data.get("is_online")}
         serializer = self.get_serializer(driver, data=data, partial=True)
         if serializer.is_valid():
-            serializer.save()
+            driver = serializer.save()
+            if driver.is_online:
+                driver_index.update(driver.id, driver.current_lat, driver.current_lng)
+            else:
+                driver_index.remove(driver.id)
+                try:
+                    live_locations.remove(driver.id)
+                except RedisError as e:
+                    logger.error(f"Failed to drop live location for driver {driver.id}: {e}")
+            # The driver's location socket indexes its pings only while online
+            async_to_sync(get_channel_layer().group_send)(
+                f"driver_{driver.id}", {"type": "online_status", "is_online": driver.is_online}
+            )
             return Response({
                 "StatusCode": 1,
                 "statusMessage": "Driver online status updated successfully",
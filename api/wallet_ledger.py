@@ -0,0 +1,183 @@
+import logging
+import random
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import AdminWallet, AdminWalletShard, DriverWallet
+
+logger = logging.getLogger(__name__)
+
+ADMIN_TOTALS = ("balance", "total_commission", "total_gst")
+CENT = Decimal("0.01")
+
+# Wallet ids whose shard rows this process has already created
+_sharded_wallets = set()
+
+
+def _decimal(value):
+    return value if isinstance(value, Decimal) else Decimal(str(value))
+
+
+def _ensure_shards(wallet_id):
+    if wallet_id in _sharded_wallets:
+        return
+    AdminWalletShard.objects.bulk_create(
+        [AdminWalletShard(wallet_id=wallet_id, index=i) for i in range(settings.ADMIN_WALLET_SHARDS)],
+        ignore_conflicts=True,
+    )
+    _sharded_wallets.add(wallet_id)
+
+
+def admin_wallet_totals(wallet):
+    """{balance, total_commission, total_gst} of an AdminWallet: its own columns plus all shards, one query"""
+    zero = Value(Decimal("0.00"))
+    row = AdminWallet.objects.filter(pk=wallet.pk).annotate(**{
+        f"shard_{field}": Coalesce(Sum(f"shards__{field}"), zero) for field in ADMIN_TOTALS
+    }).values(*ADMIN_TOTALS, *(f"shard_{field}" for field in ADMIN_TOTALS)).get()
+    return {field: (row[field] + row[f"shard_{field}"]).quantize(CENT) for field in ADMIN_TOTALS}
+
+
+def _post_admin_shard(wallet, changes):
+    """Apply F() changes to a random shard of an AdminWallet; returns the aggregated balance"""
+    _ensure_shards(wallet.pk)
+    index = random.randrange(settings.ADMIN_WALLET_SHARDS)
+    if not AdminWalletShard.objects.filter(wallet_id=wallet.pk, index=index).update(**changes):
+        # Shard rows were removed (or ADMIN_WALLET_SHARDS grew) since this process created them
+        _sharded_wallets.discard(wallet.pk)
+        _ensure_shards(wallet.pk)
+        AdminWalletShard.objects.filter(wallet_id=wallet.pk, index=index).update(**changes)
+    return admin_wallet_totals(wallet)["balance"]
+
+
+def _post_admin_debit(wallet, amount, changes):
+    """
+    A covered debit needs the wallet's total, which spans the shards, so it
+    locks the wallet row (as compaction does) and applies the debit there.
+    Credits keep going to the shards without waiting on this lock.
+    """
+    AdminWallet.objects.select_for_update().filter(pk=wallet.pk).get()
+    if admin_wallet_totals(wallet)["balance"] < -amount:
+        raise ValueError("Insufficient balance")
+    AdminWallet.objects.filter(pk=wallet.pk).update(**changes)
+    return admin_wallet_totals(wallet)["balance"]
+
+
+def post(wallet, amount, transaction_type, description="", require_funds=False, totals=None, **transaction_fields):
+    """
+    Apply `amount` (negative for a debit) to a DriverWallet or AdminWallet and
+    log it in the wallet's transaction table, atomically.
+
+    A DriverWallet balance moves with one conditional
+    UPDATE ... SET balance = balance + amount [WHERE balance >= -amount], so
+    concurrent postings never overwrite each other and no row lock is held
+    beyond that statement's. The new balance is read back inside the
+    transaction, stored on `wallet` and returned.
+
+    AdminWallet postings go to a random AdminWalletShard instead of the one
+    platform row; `totals` maps its other running totals (total_commission,
+    total_gst) to deltas applied in the same UPDATE. The returned balance
+    (and balance_after) is the aggregate over the wallet and its shards;
+    the instance's own columns hold only the compacted part and are left
+    untouched.
+
+    Raises ValueError("Insufficient balance") if require_funds and the
+    balance would go negative.
+    """
+    amount = _decimal(amount)
+    totals = {field: _decimal(delta) for field, delta in (totals or {}).items()}
+    changes = {field: F(field) + delta for field, delta in totals.items()}
+    changes["balance"] = F("balance") + amount
+    changes["updated_at"] = timezone.now()
+    debit_check = require_funds and amount < 0
+
+    with transaction.atomic():
+        if isinstance(wallet, AdminWallet):
+            if debit_check:
+                balance = _post_admin_debit(wallet, amount, changes)
+            else:
+                balance = _post_admin_shard(wallet, changes)
+        else:
+            model = type(wallet)
+            rows = model.objects.filter(pk=wallet.pk)
+            if debit_check:
+                rows = rows.filter(balance__gte=-amount)
+            if not rows.update(**changes):
+                raise ValueError("Insufficient balance")
+            for field, value in model.objects.filter(pk=wallet.pk).values("balance", *totals).get().items():
+                setattr(wallet, field, value)
+            balance = wallet.balance
+        wallet.transactions.create(
+            transaction_type=transaction_type,
+            amount=amount,
+            description=description,
+            balance_after=balance,
+            **transaction_fields
+        )
+    return balance
+
+
+def credit(wallet, amount, transaction_type, description="", **transaction_fields):
+    return post(wallet, amount, transaction_type, description, **transaction_fields)
+
+
+def debit(wallet, amount, transaction_type, description="", allow_negative=False, **transaction_fields):
+    """Take `amount` out of the wallet; fails with ValueError unless covered or allow_negative"""
+    return post(wallet, -_decimal(amount), transaction_type, description, require_funds=not allow_negative, **transaction_fields)
+
+
+def add_to_driver_balance(driver, amount):
+    """
+    Credit `amount` to the driver's wallet (created if missing) with one
+    F() UPDATE, without logging a transaction; for callers that bulk-create
+    their own transaction rows. Returns (wallet_id, new balance).
+    """
+    amount = _decimal(amount)
+    if not DriverWallet.objects.filter(driver=driver).update(balance=F("balance") + amount, updated_at=timezone.now()):
+        wallet, created = DriverWallet.objects.get_or_create(driver=driver, defaults={"balance": amount})
+        if not created:
+            return add_to_driver_balance(driver, amount)
+        return wallet.id, wallet.balance
+    wallet = DriverWallet.objects.filter(driver=driver).values("id", "balance").get()
+    return wallet["id"], wallet["balance"]
+
+
+def add_to_admin_totals(wallet, amount, totals=None):
+    """
+    Credit a random shard of an AdminWallet without logging a transaction;
+    for callers that bulk-create their own transaction rows. Returns the
+    aggregated balance.
+    """
+    changes = {field: F(field) + _decimal(delta) for field, delta in (totals or {}).items()}
+    changes["balance"] = F("balance") + _decimal(amount)
+    changes["updated_at"] = timezone.now()
+    return _post_admin_shard(wallet, changes)
+
+
+def compact_admin_wallets():
+    """Fold every AdminWallet's shard totals into the wallet row; returns the number of shards emptied"""
+    emptied = 0
+    for wallet_id in AdminWalletShard.objects.values_list("wallet_id", flat=True).distinct():
+        with transaction.atomic():
+            AdminWallet.objects.select_for_update().filter(pk=wallet_id).get()
+            shards = list(
+                AdminWalletShard.objects.select_for_update().filter(wallet_id=wallet_id)
+                .exclude(balance=0, total_commission=0, total_gst=0)
+                .values("id", *ADMIN_TOTALS)
+            )
+            if not shards:
+                continue
+            AdminWallet.objects.filter(pk=wallet_id).update(**{
+                field: F(field) + sum(shard[field] for shard in shards) for field in ADMIN_TOTALS
+            })
+            for shard in shards:
+                AdminWalletShard.objects.filter(id=shard["id"]).update(**{
+                    field: F(field) - shard[field] for field in ADMIN_TOTALS
+                })
+            emptied += len(shards)
+    logger.info(f"Compacted {emptied} admin wallet shards")
+    return emptied